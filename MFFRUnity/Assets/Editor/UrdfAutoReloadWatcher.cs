@@ -21,6 +21,9 @@ public static class UrdfAutoReloadWatcher
     static FileSystemWatcher meshWatcher;
 
     static string urdfPath = "Assets/TemporaryRobotDescription/temporary_robot.urdf";
+    // Python側はビルドが完了したときだけこのファイルを置き換える（publish.py）
+    static string publishManifestPath = "Assets/TemporaryRobotDescription/publish_manifest.json";
+    static string lastBuildId = null;
 
     static UrdfAutoReloadWatcher()
     {
@@ -29,8 +32,12 @@ public static class UrdfAutoReloadWatcher
 
     public static void StartWatching()
     {
-        urdfWatcher = new FileSystemWatcher(Path.GetDirectoryName(urdfPath), "*.urdf");
+        // URDFやメッシュは一時ファイルからの置き換えで更新されるので、完了の合図であるマニフェストだけを監視する
+        urdfWatcher = new FileSystemWatcher(Path.GetDirectoryName(publishManifestPath), Path.GetFileName(publishManifestPath));
+        urdfWatcher.NotifyFilter = NotifyFilters.FileName | NotifyFilters.LastWrite;
         urdfWatcher.Changed += OnChanged;
+        urdfWatcher.Created += OnChanged;
+        urdfWatcher.Renamed += OnChanged;
         urdfWatcher.EnableRaisingEvents = true;
 
         //meshWatcher = new FileSystemWatcher(meshFolder);
@@ -42,12 +49,45 @@ public static class UrdfAutoReloadWatcher
 
     private static void OnChanged(object sender, FileSystemEventArgs e)
     {
-        Debug.Log($"URDF or mesh file changed: {e.FullPath}");
+        Debug.Log($"Robot description published: {e.FullPath}");
         EditorApplication.delayCall += () =>
         {
-            ReloadUrdfModel();
+            ReloadIfNewBuild();
         };
     }
+
+    private static void ReloadIfNewBuild()
+    {
+        string manifest;
+        try
+        {
+            manifest = File.ReadAllText(publishManifestPath);
+        }
+        catch (IOException)
+        {
+            return;
+        }
+
+        Match buildId = Regex.Match(manifest, "\"build_id\"\\s*:\\s*\"([0-9a-f]+)\"");
+        if (!buildId.Success || buildId.Groups[1].Value == lastBuildId)
+        {
+            // 同じビルドに対する重複したイベントは無視する
+            return;
+        }
+        lastBuildId = buildId.Groups[1].Value;
+
+        // 変更されたファイルだけを再インポートする
+        Match changed = Regex.Match(manifest, "\"changed\"\\s*:\\s*\\[([^\\]]*)\\]");
+        if (changed.Success)
+        {
+            string folder = Path.GetDirectoryName(publishManifestPath).Replace('\\', '/');
+            foreach (Match file in Regex.Matches(changed.Groups[1].Value, "\"([^\"]+)\""))
+            {
+                AssetDatabase.ImportAsset($"{folder}/{file.Groups[1].Value}");
+            }
+        }
+        ReloadUrdfModel();
+    }
     
 
     private static IEnumerator ImportAndThen(string urdfFile, ImportSettings settings, Action<GameObject> onComplete)
@@ -0,0 +1,88 @@
+import argparse
+import sys
+import time
+
+from blanket_generation import BLANKET_CONSTRUCTIONS, blanket_cuts, load_torus_inputs, make_blanket, make_section_face
+
+# 体積の相対誤差の許容値。OCCTの体積計算の精度（1e-5程度）より少し大きくしている
+DEFAULT_VOLUME_TOLERANCE = 1e-4
+# バウンディングボックスの許容値 [m]
+DEFAULT_BOUNDING_BOX_TOLERANCE = 1e-6
+
+
+def _timed_blanket(face_orig, cut: dict, construction: str, repeat: int):
+    # 最も速かった回を採る
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        blanket = make_blanket(face_orig, cut, construction)
+        solid = blanket.val()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return solid, best
+
+
+def _bounding_box(solid) -> tuple:
+    box = solid.BoundingBox()
+    return (box.xmin, box.ymin, box.zmin, box.xmax, box.ymax, box.zmax)
+
+
+def benchmark_constructions(repeat: int = 1, volume_tolerance: float = DEFAULT_VOLUME_TOLERANCE,
+                            bounding_box_tolerance: float = DEFAULT_BOUNDING_BOX_TOLERANCE) -> list[dict]:
+    """
+    Build every blanket with each construction of blanket_generation.revolve_symmetric and compare them.
+
+    The first construction ("union") is the reference: the other constructions must give
+    a valid solid with the same volume (relative tolerance) and bounding box.
+
+    Returns:
+        list[dict]: per blanket {"index", "seconds": {construction: s}, "volume": {construction: m^3}, "ok": bool}
+    """
+    inputs = load_torus_inputs()
+    face_orig = make_section_face(inputs["points"])
+    reference = BLANKET_CONSTRUCTIONS[0]
+    rows = []
+    for cut in blanket_cuts(inputs):
+        row = {"index": cut["index"], "seconds": {}, "volume": {}, "ok": True}
+        boxes = {}
+        for construction in BLANKET_CONSTRUCTIONS:
+            solid, seconds = _timed_blanket(face_orig, cut, construction, repeat)
+            row["seconds"][construction] = seconds
+            row["volume"][construction] = solid.Volume()
+            boxes[construction] = _bounding_box(solid)
+            if not solid.isValid():
+                row["ok"] = False
+        for construction in BLANKET_CONSTRUCTIONS[1:]:
+            relative = abs(row["volume"][construction] - row["volume"][reference]) / abs(row["volume"][reference])
+            box_difference = max(abs(a - b) for a, b in zip(boxes[construction], boxes[reference]))
+            if relative > volume_tolerance or box_difference > bounding_box_tolerance:
+                row["ok"] = False
+        rows.append(row)
+    return rows
+
+
+def print_benchmark(rows: list[dict]) -> None:
+    reference = BLANKET_CONSTRUCTIONS[0]
+    header = f"{'blanket':>7} " + " ".join(f"{c + ' [ms]':>20}" for c in BLANKET_CONSTRUCTIONS) + f" {'volume rel. diff':>17} {'ok':>4}"
+    print(header)
+    for row in rows:
+        relative = max(abs(row["volume"][c] - row["volume"][reference]) / abs(row["volume"][reference]) for c in BLANKET_CONSTRUCTIONS[1:])
+        times = " ".join(f"{row['seconds'][c] * 1000:20.1f}" for c in BLANKET_CONSTRUCTIONS)
+        print(f"{row['index'] + 1:>7} {times} {relative:17.2e} {'yes' if row['ok'] else 'NO':>4}")
+    totals = {c: sum(row["seconds"][c] for row in rows) for c in BLANKET_CONSTRUCTIONS}
+    print(f"{'total':>7} " + " ".join(f"{totals[c] * 1000:20.1f}" for c in BLANKET_CONSTRUCTIONS))
+    for construction in BLANKET_CONSTRUCTIONS[1:]:
+        print(f"{construction}: {totals[reference] / totals[construction]:.1f}x faster than {reference}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the blanket constructions of blanket_generation.revolve_symmetric (time, volume and bounding box).")
+    parser.add_argument("--repeat", type=int, default=3, help="number of builds per blanket and construction (the fastest is reported)")
+    parser.add_argument("--volume-tolerance", type=float, default=DEFAULT_VOLUME_TOLERANCE, help="allowed relative volume difference")
+    args = parser.parse_args()
+
+    rows = benchmark_constructions(args.repeat, args.volume_tolerance)
+    print_benchmark(rows)
+    if not all(row["ok"] for row in rows):
+        print("The constructions give different blankets", file=sys.stderr)
+        sys.exit(1)
@@ -1,11 +1,14 @@
+import argparse
+import json
 import cadquery as cq
 import numpy as np
-from cadquery.vis import show
-from cadquery import Workplane
 import math
-from link_and_joint_class import *
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mesh_export import TriangleMesh, write_glb_scene
+from blanket_targets import toroidal_rotation
 
 # 頂点ファイルのパス
 TORUS_DIRECTORY = "../MFFRUnity/Assets/Torus" # Unityプロジェクトのうち、トーラスのパラメータや頂点情報が格納されているディレクトリ
@@ -15,39 +18,72 @@ outer_desc = f"{TORUS_DIRECTORY}/outer_unity.txt" #各ブランケットの、
 normal_desc = f"{TORUS_DIRECTORY}/normals_unity.txt" #各ブランケットの、法線ベクトル
 coordinates_desc = f"{TORUS_DIRECTORY}/blanket_toroidal_coordinates.txt"
 mesh_dir = f"{TORUS_DIRECTORY}/Mesh" #メッシュ出力先k
+configuration_desc = f"{TORUS_DIRECTORY}/blanket_configuration.json" #各ブランケットのトロイダル方向の配置
+instanced_filename = "BLKT_instanced.glb" #インスタンス化したシーンの出力ファイル名
 
 thickness = 1.0
+alpha = 0.1  # 曲率補正の強さ（調整パラメータ）
+# ブランケットの立体の作り方（revolve_symmetric）
+BLANKET_CONSTRUCTIONS = ("union", "single_revolve")
+
+
+def _data_lines(path: str):
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#") or line == "":
+                continue
+            yield line
+
+
+def load_torus_inputs() -> dict:
+    """
+    Read the blanket inputs of the Unity project.
+
+    Returns:
+        dict: {"normals", "origins": list of [x, y] arrays per blanket, "points_inner": (x, z) of the
+            inner side, "points": (x, z) of the torus section (inner points, then outer points
+            reversed), "rotation_angles": toroidal extent of each blanket in degrees}
+    """
+    # normal_descから、法線ベクトルのデータを取得する
+    normals = []
+    origins = []
+    for line in _data_lines(normal_desc):
+        x_orig, y_orig, x_normal, y_normal  = line.split(",")
+        normals.append(np.array([float(x_normal), float(y_normal)]))
+        origins.append(np.array([float(x_orig), float(y_orig)]))
+
+    # inner_descとouter_descの中身の頂点情報を用いて、トーラス断面形状を作成する
+    # inner_desc + 逆順にしたouter_desc
+    points_inner = [tuple(float(v) for v in line.split(",")) for line in _data_lines(inner_desc)]
+    points_outer = [tuple(float(v) for v in line.split(",")) for line in _data_lines(outer_desc)]
+    points_outer.reverse()
+
+    # coordinates_desc を使って、それぞれのブランケットを何度回転押し出しするかを決定する
+    rotation_angles = []
+    for line in _data_lines(coordinates_desc):
+        rotation_around_z, extrude_angle_around_z,_ = line.split(",")
+        rotation_angles.append(float(extrude_angle_around_z))
 
-# normal_descから、法線ベクトルのデータを取得する
-normals = []
-origins = []
-with open(normal_desc, 'r') as f:
-    for line in f:
+    return {"normals": normals, "origins": origins, "points_inner": points_inner, "points": points_inner + points_outer, "rotation_angles": rotation_angles}
 
-        line = line.strip()
-        if line.startswith("#") or line == "":
-            continue
-        x_orig, y_orig, x_normal, y_normal  = line.split(",")
-        x_normal = float(x_normal)
-        y_normal = float(y_normal)
-        x_orig = float(x_orig)
-        y_orig = float(y_orig)
-        normals.append(np.array([x_normal, y_normal]))
-        origins.append(np.array([x_orig, y_orig]))
-
-# inner_descとouter_descの中身の頂点情報を用いて、トーラス断面形状を作成する
-# inner_desc + 逆順にしたouter_desc 
-points_inner = []
-with open(inner_desc, 'r') as f:
-    for line in f:
-
-        line = line.strip()
-        if line.startswith("#") or line == "":
-            continue
-        x_str, z_str = line.split(",")
-        x = float(x_str)
-        z = float(z_str)
-        points_inner.append(cq.Vector(x, z, 0))
+
+def make_section_face(points: list) -> cq.Face:
+    """Face of the torus section through the (x, z) points."""
+    # ワイヤフレームを生成する（直線で結ぶ）
+    return cq.Face.makeFromWires(cq.Workplane("XZ").spline([cq.Vector(x, z, 0) for x, z in points]).close().wire().val())
+
+
+def blanket_cuts(inputs: dict) -> list[dict]:
+    """
+    Get the cut quadrilateral and the revolve angle of every blanket.
+
+    Returns:
+        list[dict]: per blanket, {"index", "quad": four (x, y) corners in the XZ plane, "revolve_angle": degrees}
+    """
+    normals = inputs["normals"]
+    origins = inputs["origins"]
+    points_inner = [cq.Vector(x, z, 0) for x, z in inputs["points_inner"]]
     # points_innerで構成したpolylineの総長さを、normalsの数で割る
     total_length_inner = sum((points_inner[i] - points_inner[i - 1]).Length for i in range(1, len(points_inner)))
     num_normals = len(normals)  # 法線ベクトルの数
@@ -56,128 +92,237 @@ with open(inner_desc, 'r') as f:
     else:
         average_length_inner = 0
 
-# print(average_length_inner)
-
-points_outer = []
-with open(outer_desc, 'r') as f:
-    for line in f:
-
-        line = line.strip()
-        if line.startswith("#") or line == "":
-            continue
-        x_str, z_str = line.split(",")
-        x = float(x_str)
-        z = float(z_str)
-        points_outer.append(cq.Vector(x, z, 0))
-points_outer.reverse()
-
-points = points_inner + points_outer
-
-# coordinates_desc を使って、それぞれのブランケットを何度回転押し出しするかを決定する
-rotation_angles = []
-with open(coordinates_desc, 'r') as f:
-    for line in f:
-        line = line.strip()
-        if line.startswith("#") or line == "":
-            continue
-        rotation_around_z, extrude_angle_around_z,_ = line.split(",")
-        angle = float(extrude_angle_around_z)
-        rotation_angles.append(angle)
-
-# ワイヤフレームを生成する（直線で結ぶ）
-face_orig =  cq.Face.makeFromWires(cq.Workplane("XZ").spline(points).close().wire().val())
-
-blankets = []
-alpha = 0.1  # 曲率補正の強さ（調整パラメータ）
-# normalsの数だけ、forを回す
-for i in range(len(normals)):
-    normal = normals[i]
-    origin = origins[i]
-    normal_next = normals[(i + 1) % len(normals)]
-    normal_prev = normals[(i - 1) % len(normals) if i>0 else 0]
-    # 正規化
-    normal_vector = normal / np.linalg.norm(normal)
-    normal_next_vector = normal_next / np.linalg.norm(normal_next)
-    normal_prev_vector = normal_prev / np.linalg.norm(normal_prev)
-
-    # --- 曲率計算 ---
-    # 進行方向の角度
-    ang1 = math.atan2(normal_prev_vector[1], normal_prev_vector[0])
-    ang2 = math.atan2(normal_next_vector[1], normal_next_vector[0])
-    # 角度差を -pi～pi に正規化
-    delta_angle = (ang2 - ang1 + math.pi) % (2 * math.pi) - math.pi
-
-    # print(delta_angle)
-
-    # 前後originの距離（弧長近似）
-    arc_length = np.linalg.norm(origins[(i + 1) % len(normals)] - origins[(i - 1) % len(normals)])
-    curvature = abs(delta_angle) / arc_length if arc_length > 1e-6 else 0.0
-
-    # --- offset計算（曲率補正）---
-    base_offset = (average_length_inner) / 2 - 0.025
-    offset = base_offset / (1 + alpha * curvature)
-
-    # normal_vectorが[x, y]なら、垂直方向は[-y, x]または[y, -x]
-    perp_vector = np.array([-normal_vector[1], normal_vector[0]])
-    perp_vector = perp_vector / np.linalg.norm(perp_vector)  # 念のため正規化
-    perp_vector2 = np.array([-normal_next_vector[1], normal_next_vector[0]])
-    perp_vector2 = perp_vector2 / np.linalg.norm(perp_vector2)  # 念のため正規化
-    point1 = origin + perp_vector * offset
-    point2 = origin - perp_vector * offset
-    # point1, point2から、normal_vector方向に±thickness分だけ伸ばした点を計算
-    point_a = point1 + normal_vector * thickness
-    point_b = point1 - normal_vector * thickness
-    point_c = point2 - normal_vector * thickness
-    point_d = point2 + normal_vector * thickness
-    # print(f"Normal {i}: {normal}, Origin {i}: {origin}, Points: {point_a}, {point_b}, {point_c}, {point_d}")
+    cuts = []
+    # normalsの数だけ、forを回す
+    for i in range(len(normals)):
+        normal = normals[i]
+        origin = origins[i]
+        normal_next = normals[(i + 1) % len(normals)]
+        normal_prev = normals[(i - 1) % len(normals) if i>0 else 0]
+        # 正規化
+        normal_vector = normal / np.linalg.norm(normal)
+        normal_next_vector = normal_next / np.linalg.norm(normal_next)
+        normal_prev_vector = normal_prev / np.linalg.norm(normal_prev)
+
+        # --- 曲率計算 ---
+        # 進行方向の角度
+        ang1 = math.atan2(normal_prev_vector[1], normal_prev_vector[0])
+        ang2 = math.atan2(normal_next_vector[1], normal_next_vector[0])
+        # 角度差を -pi～pi に正規化
+        delta_angle = (ang2 - ang1 + math.pi) % (2 * math.pi) - math.pi
+
+        # 前後originの距離（弧長近似）
+        arc_length = np.linalg.norm(origins[(i + 1) % len(normals)] - origins[(i - 1) % len(normals)])
+        curvature = abs(delta_angle) / arc_length if arc_length > 1e-6 else 0.0
+
+        # --- offset計算（曲率補正）---
+        base_offset = (average_length_inner) / 2 - 0.025
+        offset = base_offset / (1 + alpha * curvature)
+
+        # normal_vectorが[x, y]なら、垂直方向は[-y, x]または[y, -x]
+        perp_vector = np.array([-normal_vector[1], normal_vector[0]])
+        perp_vector = perp_vector / np.linalg.norm(perp_vector)  # 念のため正規化
+        point1 = origin + perp_vector * offset
+        point2 = origin - perp_vector * offset
+        # point1, point2から、normal_vector方向に±thickness分だけ伸ばした点を計算
+        point_a = point1 + normal_vector * thickness
+        point_b = point1 - normal_vector * thickness
+        point_c = point2 - normal_vector * thickness
+        point_d = point2 + normal_vector * thickness
+
+        radius = abs(origin[0])  # normal_vector が生えている x座標を半径とみなす
+        if radius > 1e-6:
+            delta_theta_deg = (0.025 / radius) * (180.0 / math.pi)
+        else:
+            delta_theta_deg = 0.0  # 半径が小さすぎる場合の保険
+
+        # 回転角を補正：クリアランスのため、両側で合計0.05m相当分角度を減らす
+        revolve_angle = inputs["rotation_angles"][i] - 2 * delta_theta_deg
+        cuts.append({"index": i, "quad": [tuple(point_a), tuple(point_b), tuple(point_c), tuple(point_d)], "revolve_angle": revolve_angle})
+    return cuts
+
+
+def revolve_symmetric(face: cq.Face, angle: float, construction: str = "union") -> cq.Workplane:
+    """
+    Revolve a section face in the XZ plane about the z axis, from -angle/2 to +angle/2 degrees.
+
+    Args:
+        construction: "union" revolves both halves from the section and fuses them (a 3D
+            boolean). "single_revolve" rotates the section to -angle/2 first and revolves it
+            once by angle, which gives the same solid without a boolean and much faster
+            (see blanket_construction_benchmark.py).
+    """
+    if construction not in BLANKET_CONSTRUCTIONS:
+        raise ValueError(f"Unknown blanket construction: {construction}. Supported constructions are {', '.join(BLANKET_CONSTRUCTIONS)}.")
+    half_revolve = angle / 2.0
+    if construction == "single_revolve":
+        # 開始面をあらかじめ -angle/2 だけ回しておき、1回の回転押し出しで両側を作る
+        start_face = face.rotate(cq.Vector(0, 0, 0), cq.Vector(0, 0, 1), -half_revolve)
+        return cq.Workplane("XY").add(start_face).revolve(angleDegrees=angle, axisStart=(0, 0, 0), axisEnd=(0, 0, 1))
+    blanket1 = cq.Workplane("XY").add(face).revolve(angleDegrees=half_revolve, axisStart=(0, 0, 0), axisEnd=(0, 0, 1))
+    blanket2 = cq.Workplane("XY").add(face).revolve(angleDegrees=half_revolve, axisStart=(0, 0, 0), axisEnd=(0, 0, -1))
+    return blanket1.union(blanket2)
+
+
+def make_blanket(face_orig: cq.Face, cut: dict, construction: str = "union") -> cq.Workplane:
+    """Revolve the part of the torus section inside the cut quadrilateral by ±revolve_angle/2 about the z axis."""
     # point_a ~ dを使って、wireframe_cutを生成
-    face_intersect =  cq.Face.makeFromWires(cq.Workplane("XZ").polyline([point_a, point_b, point_c, point_d]).close().wire().val())
+    face_intersect =  cq.Face.makeFromWires(cq.Workplane("XZ").polyline(cut["quad"]).close().wire().val())
 
-    # face_origとface_intersectを一緒に表示
+    # face_origとface_intersectを一緒に表示（from cadquery.vis import show, from link_and_joint_class import xyz_axes）
     # show([face_orig, face_intersect, xyz_axes()])
 
-    # face_origとface_intersectの交差部分を取得
+    # face_origとface_intersectの交差部分を取得（断面上の2Dの演算）
     face_to_revolve = face_orig * face_intersect
 
-    # rotation_angles をもとに、face_to_revolveを回転させてブランケットを生成
-    # print(f"Rotation angle for blanket {i}: {rotation_angles[i]} degrees")
-    radius = abs(origin[0])  # normal_vector が生えている x座標を半径とみなす
+    return revolve_symmetric(face_to_revolve, cut["revolve_angle"], construction)
 
-    if radius > 1e-6:
-        delta_theta_deg = (0.025 / radius) * (180.0 / math.pi)
-    else:
-        delta_theta_deg = 0.0  # 半径が小さすぎる場合の保険
-
-    # 回転角を補正：クリアランスのため、両側で合計0.05m相当分角度を減らす
-    revolve_angle = rotation_angles[i] - 2 * delta_theta_deg
-    half_revolve = revolve_angle / 2.0
-
-
-    blanket1 = cq.Workplane("XY").add(face_to_revolve).revolve(angleDegrees=half_revolve, axisStart=(0, 0, 0), axisEnd=(0, 0, 1))
-    blanket2 = cq.Workplane("XY").add(face_to_revolve).revolve(angleDegrees=half_revolve, axisStart=(0, 0, 0), axisEnd=(0, 0, -1))
-    blanket = blanket1.union(blanket2)
-
-    blankets.append(blanket)
-    
-    # 生成が完了したブランケットの番号を表示
-    print(f"Generated blanket {i+1}/{len(normals)}")
-
-# show([blankets, xyz_axes()])
 
-### blanketを1こずつstlに出力する
-#### unityプロジェクトのAssets/Torus/Meshが存在していたら削除して再作成する
-
-if os.path.exists(mesh_dir):
-    shutil.rmtree(mesh_dir)
-os.makedirs(mesh_dir)
-
-
-for blanket in blankets:
+def export_blanket(blanket: cq.Workplane, index: int, directory: str) -> str:
+    """Write a blanket as BLKT_<index + 1>.gltf and return the path."""
+    path = f"{directory}/BLKT_{index+1}.gltf"
     asm = cq.Assembly()
-    asm.add(blanket, name=f"blanket_{blankets.index(blanket)}", color=cq.Color(0.5, 0.5, 0.5))
-    asm.export(f"{mesh_dir}/BLKT_{blankets.index(blanket)+1}.gltf", tolerance=5, angularTolerance=1)
-
-print(f"Exported {len(blankets)} blankets to {mesh_dir}")
+    asm.add(blanket, name=f"blanket_{index}", color=cq.Color(0.5, 0.5, 0.5))
+    asm.export(path, tolerance=5, angularTolerance=1)
+    return path
+
+
+# ワーカープロセスごとに一度だけ作るトーラス断面
+_face_orig = None
+
+
+def _initialize_worker(points: list) -> None:
+    global _face_orig
+    _face_orig = make_section_face(points)
+
+
+def _generate_blanket_in_worker(cut: dict, directory: str, construction: str) -> str:
+    return export_blanket(make_blanket(_face_orig, cut, construction), cut["index"], directory)
+
+
+def _tessellate_blanket_in_worker(cut: dict, construction: str) -> TriangleMesh:
+    # OCCTの形状はプロセス間で送れないので、三角形メッシュにして返す
+    return TriangleMesh.from_shape(make_blanket(_face_orig, cut, construction), tolerance=5, angular_tolerance=1)
+
+
+def generate_blankets(directory: str = mesh_dir, max_workers: int|None = None, construction: str = "union") -> list[str]:
+    """
+    Generate every blanket (intersection, revolve, export) into directory, which is recreated.
+
+    The blankets are distributed over a process pool; each worker builds the torus section
+    once from the shared inputs. The cut of each blanket is computed up front, so the
+    output does not depend on the number of workers or on the completion order.
+
+    Args:
+        directory: output directory of BLKT_<n>.gltf
+        max_workers: size of the process pool, defaults to the number of CPUs. 1 generates
+            the blankets in this process.
+        construction: see revolve_symmetric
+
+    Returns:
+        list[str]: paths of the written files, in blanket order
+    """
+    inputs = load_torus_inputs()
+    cuts = blanket_cuts(inputs)
+
+    ### blanketを1こずつgltfに出力する
+    #### unityプロジェクトのAssets/Torus/Meshが存在していたら削除して再作成する
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    paths = [None] * len(cuts)
+    if max_workers == 1:
+        face_orig = make_section_face(inputs["points"])
+        for cut in cuts:
+            paths[cut["index"]] = export_blanket(make_blanket(face_orig, cut, construction), cut["index"], directory)
+            print(f"Generated blanket {cut['index']+1}/{len(cuts)}")
+        return paths
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_initialize_worker, initargs=(inputs["points"],)) as executor:
+        futures = {executor.submit(_generate_blanket_in_worker, cut, directory, construction): cut["index"] for cut in cuts}
+        for future in as_completed(futures):
+            paths[futures[future]] = future.result()
+            # 生成が完了したブランケットの番号を表示
+            print(f"Generated blanket {futures[future]+1}/{len(cuts)}")
+    return paths
+
+
+def generate_instanced_blankets(path: str = f"{mesh_dir}/{instanced_filename}", max_workers: int|None = None, construction: str = "union") -> dict:
+    """
+    Write all blankets of blanket_configuration.json as one GLB scene with instanced meshes.
+
+    The configuration places every poloidal blanket shape (its "mesh", e.g. BLKT_1.gltf)
+    at many toroidal angles. Each shape that the configuration uses is generated and
+    tessellated once (in a process pool, as in generate_blankets) and stored once in the
+    scene; every item becomes a node named after it (e.g. "SB01C05") that refers to the
+    mesh and rotates it about the torus axis by the angle of the item.
+
+    The nodes reproduce the placement of BlanketConfigurationWatcher.cs in Unity. The
+    watcher imports each BLKT_<i>.gltf, whose single root node carries the Z-up to Y-up
+    rotation, and replaces that rotation with Euler(0, angle, 0) * Euler(-90, 0, 0). The
+    vertices here are converted to Y-up as well, and the item is rotated by -angle about
+    the CAD z axis, which is +angle about Unity's Y axis after the mirrored import (see
+    mesh_export.write_glb_scene). Unity has no loader for this file yet; instantiating
+    the imported scene at the origin gives the same placement as the watcher.
+
+    Args:
+        path: output GLB file
+        max_workers: size of the process pool, defaults to the number of CPUs. 1 generates
+            the blankets in this process.
+        construction: see revolve_symmetric
+
+    Returns:
+        dict: {"path", "meshes": number of stored meshes, "instances": number of nodes}
+    """
+    inputs = load_torus_inputs()
+    cuts = blanket_cuts(inputs)
+    with open(configuration_desc, 'r') as f:
+        items = json.load(f)["items"]
+    # メッシュ名は generate_blankets の出力ファイル名と同じ
+    cut_of_mesh = {f"BLKT_{cut['index']+1}.gltf": cut for cut in cuts}
+    unknown = sorted({item["mesh"] for item in items} - set(cut_of_mesh))
+    if unknown:
+        raise ValueError(f"Blankets not generated by this script in {configuration_desc}: {', '.join(unknown)}")
+    used = [name for name in cut_of_mesh if any(item["mesh"] == name for item in items)]
+
+    meshes = {}
+    if max_workers == 1:
+        face_orig = make_section_face(inputs["points"])
+        for name in used:
+            meshes[name] = TriangleMesh.from_shape(make_blanket(face_orig, cut_of_mesh[name], construction), tolerance=5, angular_tolerance=1)
+            print(f"Generated blanket {name}")
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_initialize_worker, initargs=(inputs["points"],)) as executor:
+            futures = {executor.submit(_tessellate_blanket_in_worker, cut_of_mesh[name], construction): name for name in used}
+            for future in as_completed(futures):
+                meshes[futures[future]] = future.result()
+                print(f"Generated blanket {futures[future]}")
+
+    # Unityの Euler(0, angle, 0) は左手系なので、右手系のCAD座標では -angle の回転になる（toroidal_rotation）
+    instances = [(item["name"], item["mesh"], toroidal_rotation(item["angle"])) for item in items]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # メッシュの順序は完了順ではなくブランケットの順にする
+    write_glb_scene({name: meshes[name] for name in used}, instances, path)
+    return {"path": path, "meshes": len(used), "instances": len(instances)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the blanket meshes of the Unity project.")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (1: no process pool)")
+    parser.add_argument("--mesh-dir", default=mesh_dir, help="output directory")
+    parser.add_argument("--instanced", action="store_true",
+                        help=f"write one scene ({instanced_filename}) with every item of the blanket configuration instead of one file per blanket")
+    parser.add_argument("--construction", choices=BLANKET_CONSTRUCTIONS, default="union",
+                        help="single_revolve builds each blanket without the 3D union (see revolve_symmetric)")
+    args = parser.parse_args()
+
+    if args.instanced:
+        result = generate_instanced_blankets(f"{args.mesh_dir}/{instanced_filename}", args.workers, args.construction)
+        print(f"Exported {result['meshes']} blankets as {result['instances']} instances to {result['path']}")
+    else:
+        paths = generate_blankets(args.mesh_dir, args.workers, args.construction)
+        print(f"Exported {len(paths)} blankets to {args.mesh_dir}")
 
 
 # # blanketsをstlに出力する前に、1つにまとめる
@@ -6,6 +6,7 @@ import math
 from link_and_joint_class import *
 import os
 import shutil
+from blanket_generation import revolve_symmetric
 
 # 頂点ファイルのパス
 TORUS_DIRECTORY = "../test" # Unityプロジェクトのうち、トーラスのパラメータや頂点情報が格納されているディレクトリ
@@ -17,6 +18,7 @@ coordinates_desc = f"{TORUS_DIRECTORY}/blanket_toroidal_coordinates.txt"
 mesh_dir = f"{TORUS_DIRECTORY}/Mesh" #メッシュ出力先k
 
 thickness = 1.0
+construction = "union" # "single_revolve"にすると、3Dの結合なしで1回の回転押し出しで作る（revolve_symmetric参照）
 
 # normal_descから、法線ベクトルのデータを取得する
 normals = []
@@ -132,9 +134,7 @@ face_square = cq.Face.makeFromWires(cq.Workplane("XZ").polyline([point1, point2,
 
 face_inner = face_orig.cut(face_square)
 
-blanket1 = cq.Workplane("XY").add(face_inner).revolve(angleDegrees=22.5/2/2.0, axisStart=(0, 0, 0), axisEnd=(0, 0, 1))
-blanket2 = cq.Workplane("XY").add(face_inner).revolve(angleDegrees=22.5/2/2.0, axisStart=(0, 0, 0), axisEnd=(0, 0, -1))
-blanket = blanket1.union(blanket2)
+blanket = revolve_symmetric(face_inner, 22.5/2, construction)
 
 blankets.append(blanket)
 # outer の生成
@@ -146,9 +146,7 @@ point4 = cq.Vector(0.0  , +100.0, 0)
 face_square = cq.Face.makeFromWires(cq.Workplane("XZ").polyline([point1, point2, point3, point4]).close().wire().val())
 
 face_outer = face_orig.cut(face_square)
-blanket1 = cq.Workplane("XY").add(face_outer).revolve(angleDegrees=7.5/2.0, axisStart=(0, 0, 0), axisEnd=(0, 0, 1))
-blanket2 = cq.Workplane("XY").add(face_outer).revolve(angleDegrees=7.5/2.0, axisStart=(0, 0, 0), axisEnd=(0, 0, -1))
-blanket = blanket1.union(blanket2)
+blanket = revolve_symmetric(face_outer, 7.5, construction)
 blankets.append(blanket)
 
 # Todo 
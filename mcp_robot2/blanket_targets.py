@@ -0,0 +1,120 @@
+import json
+import math
+import os
+
+import numpy as np
+
+TORUS_DIRECTORY = "../MFFRUnity/Assets/Torus" # Unityプロジェクトのうち、トーラスのパラメータや頂点情報が格納されているディレクトリ
+BLANKET_CONFIGURATION_FILENAME = "blanket_configuration.json"
+NORMALS_FILENAME = "normals_unity.txt"
+
+
+def toroidal_rotation(angle: float) -> np.ndarray:
+    """
+    Rotation of a blanket module about the torus axis, in the torus frame (right-handed, z is the torus axis).
+
+    blanket_configuration.json gives the angle of the Euler(0, angle, 0) rotation of Unity,
+    which is left-handed, so the module is rotated by -angle in the torus frame.
+
+    Args:
+        angle: toroidal angle of the module in degrees, as in blanket_configuration.json
+
+    Returns:
+        np.ndarray: 4x4 homogeneous transform
+    """
+    radians = math.radians(-angle)
+    transform = np.eye(4)
+    transform[:2, :2] = [[math.cos(radians), -math.sin(radians)], [math.sin(radians), math.cos(radians)]]
+    return transform
+
+
+class BlanketTarget:
+    """
+    Position of one blanket module in the torus frame (z is the torus axis, as in blanket_generation.py).
+
+    The section is rotated about the torus axis by toroidal_rotation(angle), i.e. by -angle,
+    as the blankets of blanket_generation.generate_instanced_blankets and the Unity watcher.
+
+    Attributes:
+        name: module name, e.g. "SB01C05"
+        section: index of the poloidal section (SB01 -> 0), i.e. of the normal in normals_unity.txt
+        angle: toroidal angle of the module in degrees, as in blanket_configuration.json
+        mesh: mesh file of the section
+        position: (3,) center of the plasma-facing side of the module
+        normal: (3,) unit normal of the module, as given in normals_unity.txt
+    """
+
+    def __init__(self, name: str, section: int, angle: float, mesh: str, position: np.ndarray, normal: np.ndarray):
+        self.name = name
+        self.section = section
+        self.angle = angle
+        self.mesh = mesh
+        self.position = position
+        self.normal = normal
+
+
+def read_section_normals(torus_directory: str = TORUS_DIRECTORY) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Read normals_unity.txt.
+
+    Returns:
+        list of (origin, normal): 2D (r, z) point and unit normal of each poloidal section
+    """
+    sections = []
+    with open(os.path.join(torus_directory, NORMALS_FILENAME), 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#") or line == "":
+                continue
+            x_orig, y_orig, x_normal, y_normal = (float(value) for value in line.split(","))
+            normal = np.array([x_normal, y_normal])
+            sections.append((np.array([x_orig, y_orig]), normal / np.linalg.norm(normal)))
+    return sections
+
+
+def load_blanket_targets(torus_directory: str = TORUS_DIRECTORY) -> dict[str, BlanketTarget]:
+    """
+    Get the position of every blanket module of blanket_configuration.json.
+
+    Module SBxx uses the section xx of normals_unity.txt, rotated about the torus axis by
+    toroidal_rotation of its angle.
+
+    Returns:
+        dict: {module name: BlanketTarget}, in the order of the configuration file
+    """
+    sections = read_section_normals(torus_directory)
+    with open(os.path.join(torus_directory, BLANKET_CONFIGURATION_FILENAME), 'r') as f:
+        items = json.load(f)["items"]
+    targets = {}
+    for item in items:
+        # "SB01C05" -> 断面 0
+        section = int(item["name"][2:4]) - 1
+        if not 0 <= section < len(sections):
+            raise ValueError(f"Blanket {item['name']} has no section in {NORMALS_FILENAME}.")
+        origin, normal = sections[section]
+        rotation = toroidal_rotation(item["angle"])[:3, :3]
+        position = rotation @ np.array([origin[0], 0.0, origin[1]])
+        normal_3d = rotation @ np.array([normal[0], 0.0, normal[1]])
+        targets[item["name"]] = BlanketTarget(item["name"], section, float(item["angle"]), item["mesh"], position, normal_3d)
+    return targets
+
+
+def handling_targets(targets: list[BlanketTarget], torus_frame: np.ndarray|None = None, standoff: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Poses an end effector must take to handle blanket modules, for kinematics.inverse_kinematics.
+
+    The end effector reaches the plasma-facing side of the module (the section origin of
+    blanket_generation.py) from the plasma, i.e. its tool axis points against the normal.
+
+    Args:
+        targets: blanket modules
+        torus_frame: 4x4 pose of the torus frame in the root frame of the robot, identity if None
+        standoff: distance kept from the module along its normal (m)
+
+    Returns:
+        tuple: (T, 3) positions and (T, 3) approach axes in the root frame of the robot
+    """
+    torus_frame = np.eye(4) if torus_frame is None else np.asarray(torus_frame, dtype=float)
+    positions = np.array([target.position + standoff * target.normal for target in targets])
+    normals = np.array([target.normal for target in targets])
+    return positions @ torus_frame[:3, :3].T + torus_frame[:3, 3], -normals @ torus_frame[:3, :3].T
@@ -0,0 +1,156 @@
+import asyncio
+import itertools
+import os
+import shutil
+import time
+import traceback
+
+from build_requests import BuildProgress, ProgressSummary, follow_progress
+from publish import versions_dir_for
+from worker_pool import run_in_worker
+
+# 終わったジョブはこの数を超えたら古い順に、出力ディレクトリごと消す
+DEFAULT_MAX_FINISHED_JOBS = 16
+
+class BuildJob:
+    """
+    A build submitted to a BuildJobQueue.
+
+    state is "queued", "running", "done" (result is the return value of the build) or
+    "failed" (error is the exception).
+    """
+
+    def __init__(self, job_id: str, targetdir: str, priority: int, func, args: tuple, kwargs: dict, description: dict|None = None):
+        self.job_id = job_id
+        self.targetdir = targetdir
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description or {}
+        self.state = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = ProgressSummary()
+        self.result = None
+        self.error = None
+
+    async def on_progress(self, event: dict) -> None:
+        self.progress.update(event)
+
+    def status(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "priority": self.priority,
+            "targetdir": self.targetdir,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": self.progress.to_dict(),
+            "error": self.error,
+            **self.description,
+        }
+
+
+class BuildJobQueue:
+    """
+    Queue of robot builds that run in the background, each into its own directory.
+
+    Jobs with a higher priority start first, jobs of the same priority in submission
+    order. At most max_concurrent jobs run at the same time (in the worker pool, see
+    worker_pool.run_in_worker), which leaves workers free for the interactive tools.
+
+    Only the last max_finished_jobs finished jobs are kept: older ones are forgotten and
+    their output directories deleted. The jobs are kept in memory only, so the queue and
+    the status of the jobs are lost when the server stops; the output directories of an
+    earlier server are deleted when the first job is submitted.
+    """
+
+    def __init__(self, jobs_dir: str, max_concurrent: int|None = None, max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS):
+        """
+        Args:
+            jobs_dir: parent directory of the job output directories (jobs_dir/<job_id>)
+            max_concurrent: number of jobs that run at the same time, defaults to half the number of CPUs
+            max_finished_jobs: number of finished (done or failed) jobs whose output is kept
+        """
+        self.jobs_dir = jobs_dir
+        self.max_concurrent = max_concurrent or max(1, (os.cpu_count() or 1) // 2)
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = {}
+        self._counter = itertools.count(1)
+        self._queue = None
+        self._runners = []
+
+    def _start_runners(self) -> None:
+        # イベントループの中で初めて投入されたときに実行タスクを作る
+        if self._queue is None:
+            # 以前のサーバーのジョブは状態が残っておらず取得できないので、出力を消す
+            shutil.rmtree(self.jobs_dir, ignore_errors=True)
+            self._queue = asyncio.PriorityQueue()
+            self._runners = [asyncio.get_running_loop().create_task(self._run_jobs()) for _ in range(self.max_concurrent)]
+
+    def submit(self, func, *args, priority: int = 0, description: dict|None = None, **kwargs) -> BuildJob:
+        """
+        Queue func(*args, targetdir=..., progress=BuildProgress, **kwargs), where targetdir is the new directory of the job.
+
+        Must be called from the event loop that runs the jobs.
+        """
+        self._start_runners()
+        number = next(self._counter)
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{number:04d}"
+        job = BuildJob(job_id, os.path.join(self.jobs_dir, job_id), priority, func, args, kwargs, description)
+        self.jobs[job_id] = job
+        self._queue.put_nowait((-priority, number, job_id))
+        return job
+
+    def job(self, job_id: str) -> BuildJob:
+        if job_id not in self.jobs:
+            raise ValueError(f"Unknown build job: {job_id}")
+        return self.jobs[job_id]
+
+    def _remove_job(self, job: BuildJob) -> None:
+        del self.jobs[job.job_id]
+        shutil.rmtree(job.targetdir, ignore_errors=True)
+        shutil.rmtree(versions_dir_for(job.targetdir), ignore_errors=True)
+
+    def collect_finished_jobs(self) -> list[str]:
+        """
+        Forget the oldest finished jobs and delete their output until at most max_finished_jobs remain.
+
+        Returns:
+            list[str]: ids of the removed jobs
+        """
+        finished = sorted((job for job in self.jobs.values() if job.state in ("done", "failed")), key=lambda job: job.finished, reverse=True)
+        removed = finished[self.max_finished_jobs:]
+        for job in removed:
+            self._remove_job(job)
+        return [job.job_id for job in removed]
+
+    def queue_position(self, job: BuildJob) -> int|None:
+        """Number of queued jobs that start before job, or None if job is not queued."""
+        if job.state != "queued":
+            return None
+        return sum(1 for other in self.jobs.values() if other.state == "queued" and (-other.priority, other.submitted, other.job_id) < (-job.priority, job.submitted, job.job_id))
+
+    async def _run_jobs(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self.jobs[job_id]
+            job.state = "running"
+            job.started = time.time()
+            progress = BuildProgress()
+            try:
+                task = asyncio.ensure_future(run_in_worker(job.func, *job.args, targetdir=job.targetdir, progress=progress, **job.kwargs))
+                job.result = await follow_progress(progress, task, job.on_progress)
+                job.state = "done"
+            except Exception as e:
+                # 失敗したジョブだけを記録し、キューの処理は続ける
+                job.error = "".join(traceback.format_exception_only(type(e), e)).strip()
+                job.state = "failed"
+            finally:
+                job.finished = time.time()
+                progress.remove()
+                self.collect_finished_jobs()
+                self._queue.task_done()
@@ -0,0 +1,178 @@
+import filecmp
+import hashlib
+import json
+import os
+
+from link_and_joint_class import Link, Joint
+from mesh_cache import to_jsonable
+from kinematics import KinematicModel
+
+MANIFEST_FILENAME = ".build_manifest.json"
+
+
+def file_sha256(path: str) -> str|None:
+    """Get the sha256 of a file, or None if it does not exist."""
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    """Write content to path only if the file content differs. Returns True if the file was written."""
+    if os.path.isfile(path):
+        with open(path, 'r', newline='') as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        f.write(content)
+    return True
+
+
+def replace_if_changed(tmp_path: str, path: str) -> bool:
+    """
+    Move the finished file tmp_path to path unless path already has the same content.
+
+    tmp_path is removed in either case. Returns True if path was replaced.
+    """
+    if os.path.isfile(path) and filecmp.cmp(tmp_path, path, shallow=False):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+
+class BuildManifest:
+    """
+    Record of the last robot generated into targetdir.
+
+    The manifest stores, per link, the generator inputs, the mesh options and the hashes of
+    the written mesh files, and per joint its origin and axis. A rebuild compares the new links against it so
+    that mesh files of unchanged links are left untouched on disk, which keeps Unity from
+    re-importing them.
+    """
+
+    def __init__(self, targetdir: str, mesh_options: dict|None = None):
+        """
+        Args:
+            targetdir: directory the robot description is generated into
+            mesh_options: keyword arguments passed to Link.gen_mesh_file (e.g. collision_method)
+        """
+        self.targetdir = targetdir.rstrip("/")
+        self.mesh_options = mesh_options or {}
+        self.path = f"{self.targetdir}/{MANIFEST_FILENAME}"
+        self.previous = {"links": {}, "joints": {}}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.previous = json.load(f)
+            except (OSError, ValueError):
+                # 壊れたマニフェストは無視して全リンクを再生成する
+                self.previous = {"links": {}, "joints": {}}
+        self.links = {}
+        self.joints = {}
+        self.rebuilt_links = []
+        self.changed_joints = []
+
+    def _link_entry(self, link: Link) -> dict:
+        collision_filenames = [name for name in (link.collision_filenames or [link.collision_filename]) if name]
+        return {
+            "generator": link.generator_name,
+            "params": to_jsonable(link.generator_params),
+            "mesh_key": link.mesh_cache_key(),
+            "mesh_options": to_jsonable(self.mesh_options),
+            "filename": link.filename,
+            "collision_filenames": collision_filenames,
+            "collision_report": link.collision_report,
+            "files": {name: file_sha256(f"{self.targetdir}/{name}") for name in [link.filename, *collision_filenames] if name},
+        }
+
+    def _is_up_to_date(self, link: Link) -> bool:
+        entry = self.previous["links"].get(link.link_name)
+        if entry is None or entry.get("mesh_key") is None:
+            return False
+        if entry["mesh_key"] != link.mesh_cache_key() or entry.get("mesh_options") != to_jsonable(self.mesh_options):
+            return False
+        # ディスク上のファイルが手で消されたり書き換えられたりしていないか確認する
+        files = entry.get("files") or {}
+        if not files:
+            return False
+        return all(file_sha256(f"{self.targetdir}/{name}") == digest for name, digest in files.items())
+
+    def update_link_mesh(self, link: Link, progress=None) -> bool:
+        """
+        Generate the mesh files of a link unless the previous build already produced them.
+
+        Args:
+            progress: passed to Link.gen_mesh_file
+
+        Returns:
+            bool: True if the mesh files were (re)written.
+        """
+        if not link.has_geometry:
+            return False
+        # 前回の出力が使えるなら形状（LazyGeometry）は生成しない
+        if self._is_up_to_date(link):
+            entry = self.previous["links"][link.link_name]
+            link.filename = entry["filename"]
+            link.collision_filenames = entry["collision_filenames"]
+            link.collision_filename = entry["collision_filenames"][0] if entry["collision_filenames"] else ""
+            link.collision_report = entry["collision_report"]
+            self.links[link.link_name] = entry
+            return False
+
+        link.gen_mesh_file(targetdir=self.targetdir, progress=progress, **self.mesh_options)
+        self.links[link.link_name] = self._link_entry(link)
+        self.rebuilt_links.append(link.link_name)
+        return True
+
+    def merge_link(self, link_name: str, entry: dict|None, rebuilt: bool) -> None:
+        """Add the result of update_link_mesh run in another process (see parallel_build)."""
+        if entry is None:
+            return
+        self.links[link_name] = entry
+        if rebuilt:
+            self.rebuilt_links.append(link_name)
+
+    def record_joint(self, joint: Joint) -> None:
+        entry = {
+            "type": joint.joint_type.value,
+            "parent": joint.parent_link.link_name,
+            "child": joint.child_link.link_name,
+            "origin_xyz": to_jsonable(joint.origin_xyz),
+            "origin_rpy": to_jsonable(joint.origin_rpy),
+            "axis_xyz": to_jsonable(joint.axis_xyz),
+            "lower_limit": joint.lower_limit,
+            "upper_limit": joint.upper_limit,
+        }
+        if self.previous["joints"].get(joint.joint_name) != entry:
+            self.changed_joints.append(joint.joint_name)
+        self.joints[joint.joint_name] = entry
+
+    def kinematic_model(self) -> KinematicModel:
+        """Kinematic model of the current build, or of the previous one if no joint was recorded yet."""
+        return KinematicModel.from_joint_entries(self.joints or self.previous["joints"])
+
+    def current_files(self) -> list[str]:
+        """Mesh files of the current build, relative to targetdir."""
+        current_files = []
+        for entry in self.links.values():
+            current_files.extend(entry.get("files", {}))
+        return current_files
+
+    def remove_stale_files(self) -> None:
+        """Delete mesh files written by the previous build that the current build no longer uses."""
+        current_files = set(self.current_files())
+        for entry in self.previous["links"].values():
+            for name in entry.get("files", {}):
+                path = f"{self.targetdir}/{name}"
+                if name not in current_files and os.path.isfile(path):
+                    os.remove(path)
+
+    def save(self) -> None:
+        self.remove_stale_files()
+        write_if_changed(self.path, json.dumps({"links": self.links, "joints": self.joints}, indent=2, sort_keys=True))
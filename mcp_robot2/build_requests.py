@@ -0,0 +1,196 @@
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+
+from worker_pool import run_in_worker
+
+# 進捗ファイルを読む間隔 [s]
+PROGRESS_POLL_INTERVAL = 0.2
+# 連続した要求をまとめる待ち時間 [s]。スライダーを動かしている間の要求は最後の一つだけが実行される
+DEFAULT_DEBOUNCE = 0.3
+
+
+class BuildCancelled(Exception):
+    """Raised by a build that was cancelled because a newer request superseded it."""
+
+
+class CancelFlag:
+    """
+    Cancellation flag that can be checked from a worker process.
+
+    The flag is a file in the temporary directory, so it can be pickled with the build
+    arguments and set by the server process while the build runs. Builds check it between
+    their steps (cooperative cancellation) and raise BuildCancelled before anything is
+    published.
+    """
+
+    _counter = itertools.count()
+
+    def __init__(self, path: str|None = None):
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), f"mcp_robot2_cancel_{os.getpid()}_{next(CancelFlag._counter)}")
+        self.path = path
+
+    def set(self) -> None:
+        with open(self.path, 'w'):
+            pass
+
+    def is_set(self) -> bool:
+        return os.path.exists(self.path)
+
+    def check(self) -> None:
+        """Raise BuildCancelled if the flag is set."""
+        if self.is_set():
+            raise BuildCancelled(f"cancelled ({self.path})")
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class BuildProgress:
+    """
+    Progress events of a build that can be reported from worker processes.
+
+    Like CancelFlag, the events go through a file in the temporary directory: each report
+    appends one JSON line, and the server process reads the new lines while it waits for
+    the build (read_new). An event is a dict with at least "phase" and usually "link".
+    """
+
+    _counter = itertools.count()
+
+    def __init__(self, path: str|None = None):
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), f"mcp_robot2_progress_{os.getpid()}_{next(BuildProgress._counter)}")
+        self.path = path
+        self.offset = 0
+
+    def report(self, phase: str, link: str|None = None, **info) -> None:
+        event = {"phase": phase, **({"link": link} if link is not None else {}), **info}
+        # 1行を1回のwriteで追記するので、複数のプロセスから書いても行は混ざらない
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event) + "\n")
+
+    def link_steps(self, link: str):
+        """Get the progress callback of Link.gen_mesh_file for a link."""
+        return lambda step: self.report(step, link)
+
+    def read_new(self) -> list[dict]:
+        """Events reported since the last call."""
+        try:
+            with open(self.path, 'r') as f:
+                f.seek(self.offset)
+                text = f.read()
+        except FileNotFoundError:
+            return []
+        # 書き込み途中の最後の行は次回に読む
+        complete = text[:text.rfind("\n") + 1]
+        self.offset += len(complete.encode("utf-8"))
+        return [json.loads(line) for line in complete.splitlines() if line]
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ProgressSummary:
+    """Counts the events of robot_spec.build_robot as done/total steps for progress notifications."""
+
+    # build_robot の "plan" の total はこれらのイベントの数
+    COUNTED_PHASES = ("link", "description", "publish")
+
+    def __init__(self):
+        self.done = 0
+        self.total = None
+        self.message = None
+
+    def update(self, event: dict) -> None:
+        if event["phase"] == "plan":
+            self.total = event["total"]
+        elif event["phase"] in self.COUNTED_PHASES:
+            self.done += 1
+        self.message = f"{event['link']}: {event['phase']}" if "link" in event else event["phase"]
+
+    def to_dict(self) -> dict:
+        return {"done": self.done, "total": self.total, "message": self.message}
+
+
+async def follow_progress(progress: BuildProgress, task: asyncio.Future, on_event):
+    """Await task and pass the events of progress to the coroutine function on_event while it runs."""
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=PROGRESS_POLL_INTERVAL)
+        for event in progress.read_new():
+            await on_event(event)
+        if done:
+            return task.result()
+
+
+class BuildCoalescer:
+    """
+    Run the latest of rapid build requests for the same target, last writer wins.
+
+    A request waits for the debounce window and is dropped if a newer request for the same
+    key arrived meanwhile. A newer request also sets the cancel flag of the running build of
+    that key, which stops at its next check without publishing. Builds of the same key never
+    run at the same time, so only the configuration of the latest request is published.
+    """
+
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE):
+        self.debounce = debounce
+        self._counter = itertools.count(1)
+        self._latest = {}
+        self._running = {}
+        self._locks = {}
+
+    def is_latest(self, key: str, number: int) -> bool:
+        return self._latest.get(key) == number
+
+    async def submit(self, key: str, func, *args, on_progress=None, **kwargs):
+        """
+        Run func(*args, cancel=CancelFlag, **kwargs) in the worker pool, unless a newer request for key supersedes it.
+
+        If on_progress is given, func also receives progress=BuildProgress and the coroutine
+        function on_progress is awaited with each event while func runs.
+
+        Returns:
+            the result of func
+
+        Raises:
+            BuildCancelled: a newer request superseded this one, before or during the build
+        """
+        number = next(self._counter)
+        self._latest[key] = number
+        running = self._running.get(key)
+        if running is not None:
+            running.set()
+
+        await asyncio.sleep(self.debounce)
+        if not self.is_latest(key, number):
+            raise BuildCancelled(f"superseded by a newer request for {key}")
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            # ロックを待つ間に新しい要求が来た場合も実行しない
+            if not self.is_latest(key, number):
+                raise BuildCancelled(f"superseded by a newer request for {key}")
+            flag = CancelFlag()
+            self._running[key] = flag
+            progress = BuildProgress() if on_progress is not None else None
+            try:
+                if progress is None:
+                    return await run_in_worker(func, *args, cancel=flag, **kwargs)
+                task = asyncio.ensure_future(run_in_worker(func, *args, cancel=flag, progress=progress, **kwargs))
+                return await follow_progress(progress, task, on_progress)
+            finally:
+                del self._running[key]
+                flag.remove()
+                if progress is not None:
+                    progress.remove()
+
+    def status(self) -> dict:
+        """{key: {"latest_request": number, "running": bool}}"""
+        return {key: {"latest_request": number, "running": key in self._running} for key, number in self._latest.items()}
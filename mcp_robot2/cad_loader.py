@@ -0,0 +1,54 @@
+import importlib
+import sys
+import threading
+import time
+
+# 形状を作るときに必要なモジュール。cadquery.vis（VTK）はサーバーでは使わないので含めない
+CAD_MODULES = ("OCP", "cadquery", "cadquery.func")
+
+_lock = threading.Lock()
+_import_times = {}
+
+
+def load_cad():
+    """
+    Import the CAD stack (OCP and cadquery) if it is not loaded yet and return the cadquery module.
+
+    The modules are not imported when the server starts. The first call imports them and
+    records how long each took (see import_timings); later calls cost a dict lookup.
+    Safe to call from several threads.
+    """
+    if len(_import_times) < len(CAD_MODULES):
+        with _lock:
+            for name in CAD_MODULES:
+                if name not in _import_times:
+                    start = time.perf_counter()
+                    importlib.import_module(name)
+                    _import_times[name] = time.perf_counter() - start
+    return sys.modules["cadquery"]
+
+
+def cad_loaded() -> bool:
+    """Whether load_cad has finished."""
+    return len(_import_times) == len(CAD_MODULES)
+
+
+def import_timings() -> dict:
+    """
+    Get the state of the CAD import.
+
+    Returns:
+        dict: {"loaded": bool, "modules": {module: seconds}, "total": seconds}
+    """
+    modules = dict(_import_times)
+    return {
+        "loaded": cad_loaded(),
+        "modules": modules,
+        "total": sum(modules.values()),
+    }
+
+
+def format_import_timings() -> str:
+    timings = import_timings()
+    modules = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in timings["modules"].items())
+    return f"{timings['total']:.2f} s ({modules})"
@@ -0,0 +1,155 @@
+import numpy as np
+
+from mesh_export import TriangleMesh
+
+COLLISION_METHODS = ("copy", "convex", "decimate")
+
+
+class CollisionGeometry:
+    """
+    Simplified collision geometry of a link.
+
+    Attributes:
+        meshes: convex hulls (method "convex") or a single mesh (methods "copy" and "decimate")
+        method: the method that produced the meshes
+        hausdorff_error: estimated surface Hausdorff distance to the visual mesh (same unit as the mesh)
+    """
+
+    def __init__(self, meshes: list[TriangleMesh], method: str, hausdorff_error: float = 0.0):
+        self.meshes = meshes
+        self.method = method
+        self.hausdorff_error = hausdorff_error
+
+    @property
+    def hull_count(self) -> int:
+        return len(self.meshes) if self.method == "convex" else 0
+
+    @property
+    def triangle_count(self) -> int:
+        return int(sum(len(m.triangles) for m in self.meshes))
+
+    def report(self) -> dict:
+        return {
+            "method": self.method,
+            "hull_count": self.hull_count,
+            "triangle_count": self.triangle_count,
+            "hausdorff_error": self.hausdorff_error,
+        }
+
+
+def _to_trimesh(mesh: TriangleMesh):
+    import trimesh
+
+    return trimesh.Trimesh(vertices=mesh.vertices, faces=mesh.triangles)
+
+
+def convex_decomposition(mesh: TriangleMesh, max_hulls: int = 8, resolution: int = 10000, max_vertices_per_hull: int = 32, volume_tolerance: float = 0.02) -> list[TriangleMesh]:
+    """
+    Approximate the mesh by a small set of convex hulls.
+
+    Each connected component whose convex hull is at most volume_tolerance larger than the
+    component itself is replaced by its hull. The other components are decomposed with V-HACD
+    into at most max_hulls hulls. Without V-HACD (vhacdx) installed, their convex hull is used.
+    """
+    hulls = []
+    for component in _to_trimesh(mesh).split(only_watertight=False):
+        hull = component.convex_hull
+        if abs(component.volume) > 0 and hull.volume <= abs(component.volume) * (1.0 + volume_tolerance):
+            hulls.append(hull)
+            continue
+        try:
+            parts = component.convex_decomposition(maxConvexHulls=max_hulls, resolution=resolution, maxNumVerticesPerCH=max_vertices_per_hull)
+        except (ImportError, ValueError):
+            parts = [hull]
+        hulls.extend(parts if isinstance(parts, list) else [parts])
+    return [TriangleMesh(h.vertices, h.faces) for h in hulls]
+
+
+def decimate(mesh: TriangleMesh, triangle_budget: int = 200) -> TriangleMesh:
+    """
+    Reduce the mesh to at most triangle_budget triangles by vertex clustering.
+
+    Vertices are snapped to a grid that is made coarser until the mesh fits in the budget.
+    """
+    if len(mesh.triangles) <= triangle_budget:
+        return mesh
+    extent = float(np.max(mesh.vertices.max(axis=0) - mesh.vertices.min(axis=0)))
+    cell = extent / 64.0 if extent > 0 else 1.0
+    origin = mesh.vertices.min(axis=0)
+    while True:
+        cells = np.floor((mesh.vertices - origin) / cell).astype(np.int64)
+        _, cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        cluster = cluster.ravel()
+        # クラスタ内の頂点の平均位置を代表点にする
+        vertices = np.zeros((len(counts), 3))
+        np.add.at(vertices, cluster, mesh.vertices)
+        vertices /= counts[:, None]
+        triangles = cluster[mesh.triangles]
+        # 潰れた三角形と重複した三角形を取り除く
+        keep = (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 0] != triangles[:, 2])
+        triangles = triangles[keep]
+        _, unique_index = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+        triangles = triangles[np.sort(unique_index)]
+        if len(triangles) <= triangle_budget or cell > extent:
+            return TriangleMesh(vertices, triangles)
+        cell *= 1.5
+
+
+def _inside_convex(hull: TriangleMesh, points: np.ndarray, eps: float = 1e-9) -> np.ndarray:
+    normals = hull.face_normals()
+    offsets = np.einsum("ij,ij->i", normals, hull.vertices[hull.triangles[:, 0]])
+    return np.all(points @ normals.T <= offsets + eps, axis=1)
+
+
+def hausdorff_error(reference: TriangleMesh, approximations: list[TriangleMesh], samples: int = 500, convex: bool = False) -> float:
+    """
+    Estimate the symmetric Hausdorff distance between a mesh and its approximation.
+
+    Points are sampled on both surfaces (plus all vertices) and their exact distance to the
+    other surface is measured, so the result is a lower bound that converges with samples.
+    With convex=True the approximations are treated as solid convex hulls: points inside the
+    other solid count as zero error, so the faces shared by adjacent hulls are ignored.
+    """
+    import trimesh
+
+    if len(reference.triangles) == 0 or not approximations:
+        return 0.0
+    ref = _to_trimesh(reference)
+    approx = trimesh.util.concatenate([_to_trimesh(m) for m in approximations])
+    error = 0.0
+    for source, target in ((ref, approx), (approx, ref)):
+        points = np.vstack([source.vertices, trimesh.sample.sample_surface(source, samples, seed=0)[0]])
+        if convex:
+            if target is approx:
+                inside = np.any([_inside_convex(hull, points) for hull in approximations], axis=0)
+            else:
+                inside = target.contains(points)
+            points = points[~inside]
+            if len(points) == 0:
+                continue
+        _, distances, _ = trimesh.proximity.closest_point(target, points)
+        error = max(error, float(distances.max()))
+    return error
+
+
+def build_collision_geometry(mesh: TriangleMesh, method: str = "convex", max_hulls: int = 8, resolution: int = 10000, triangle_budget: int = 200) -> CollisionGeometry:
+    """
+    Build the collision geometry of a link from its visual mesh.
+
+    Args:
+        mesh: visual mesh of the link
+        method: "copy" (full resolution visual mesh), "convex" (V-HACD convex hulls) or
+            "decimate" (vertex clustered mesh with at most triangle_budget triangles)
+        max_hulls: maximum number of convex hulls for "convex"
+        resolution: V-HACD voxel resolution for "convex"
+        triangle_budget: maximum number of triangles for "decimate"
+    """
+    if method == "copy":
+        return CollisionGeometry([mesh], method)
+    if method == "convex":
+        meshes = convex_decomposition(mesh, max_hulls=max_hulls, resolution=resolution)
+    elif method == "decimate":
+        meshes = [decimate(mesh, triangle_budget=triangle_budget)]
+    else:
+        raise ValueError(f"collision method must be one of {', '.join(COLLISION_METHODS)}.")
+    return CollisionGeometry(meshes, method, hausdorff_error(mesh, meshes, convex=(method == "convex")))
@@ -0,0 +1,159 @@
+import numpy as np
+
+from kinematics import KinematicModel, inverse_kinematics, manipulability
+from robot_spec import RobotSpec, spec_kinematics
+from parallel_build import build_executor
+
+# 自己干渉の判定で、ツリー上でこの距離以内のリンクの組は除外する（関節まわりで常に接しているため）
+ADJACENT_LINK_DISTANCE = 2
+
+
+def segment_distances(p1: np.ndarray, q1: np.ndarray, p2: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    """
+    Shortest distances between the segments p1-q1 and p2-q2, elementwise over the leading axes.
+
+    Args:
+        p1, q1, p2, q2: (..., 3) end points
+
+    Returns:
+        np.ndarray: (...) distances
+    """
+    eps = 1e-12
+    d1, d2, r = q1 - p1, q2 - p2, p1 - p2
+    a = np.einsum('...i,...i->...', d1, d1)
+    e = np.einsum('...i,...i->...', d2, d2)
+    b = np.einsum('...i,...i->...', d1, d2)
+    c = np.einsum('...i,...i->...', d1, r)
+    f = np.einsum('...i,...i->...', d2, r)
+    safe_a = np.where(a > eps, a, 1.0)
+    safe_e = np.where(e > eps, e, 1.0)
+    denominator = a * e - b * b
+    # 平行でなければ無限直線どうしの最近点から始め、線分の範囲に収める
+    s = np.where(denominator > eps, np.clip((b * f - c * e) / np.where(denominator > eps, denominator, 1.0), 0.0, 1.0), 0.0)
+    s = np.where(a > eps, s, 0.0)
+    t = np.where(e > eps, (b * s + f) / safe_e, 0.0)
+    # 片方が点の場合も t = 0 として、もう片方の線分上の最近点を取る
+    s = np.where((t < 0.0) | (e <= eps), np.clip(-c / safe_a, 0.0, 1.0), np.where(t > 1.0, np.clip((b - c) / safe_a, 0.0, 1.0), s))
+    s = np.where(a > eps, s, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    closest = (p1 + d1 * s[..., None]) - (p2 + d2 * t[..., None])
+    return np.linalg.norm(closest, axis=-1)
+
+
+def _tree_distances(model: KinematicModel) -> np.ndarray:
+    # 各リンクの根までの経路から、リンク間の関節数（ツリー上の距離）を求める
+    paths = []
+    for i in range(model.link_count):
+        path = [i]
+        while model.parents[path[-1]] >= 0:
+            path.append(int(model.parents[path[-1]]))
+        paths.append(path)
+    distances = np.zeros((model.link_count, model.link_count), dtype=np.int64)
+    for i, path_i in enumerate(paths):
+        for j, path_j in enumerate(paths):
+            common = len(set(path_i) & set(path_j))
+            distances[i, j] = len(path_i) + len(path_j) - 2 * common
+    return distances
+
+
+def self_collisions(model: KinematicModel, frames: dict, poses: np.ndarray, adjacent_distance: int = ADJACENT_LINK_DISTANCE) -> np.ndarray:
+    """
+    Geometry-free self-collision check with one capsule per link.
+
+    The capsule of a link runs from its origin to its child joint (LinkFrame.joint_xyz)
+    with LinkFrame.capsule_radius. Links closer than adjacent_distance joints in the tree
+    are not checked against each other.
+
+    Args:
+        model: kinematics of the robot
+        frames: {link name: LinkFrame}, e.g. from robot_spec.spec_kinematics
+        poses: (N, L, 4, 4) link poses from model.forward_kinematics
+
+    Returns:
+        np.ndarray: (N,) True where two capsules overlap
+    """
+    links = [i for i, name in enumerate(model.link_names) if name in frames and frames[name].capsule_radius is not None]
+    distances = _tree_distances(model)
+    pairs = [(i, j) for a, i in enumerate(links) for j in links[a + 1:] if distances[i, j] > adjacent_distance]
+    if not pairs:
+        return np.zeros(len(poses), dtype=bool)
+    radii = {i: frames[model.link_names[i]].capsule_radius for i in links}
+    ends = {i: frames[model.link_names[i]].joint_xyz for i in links}
+    first, second = np.array(pairs).T
+    starts = poses[:, :, :3, 3]
+    tips = np.stack([poses[:, i, :3, :3] @ ends[i] + poses[:, i, :3, 3] if i in ends else poses[:, i, :3, 3] for i in range(model.link_count)], axis=1)
+    gaps = segment_distances(starts[:, first], tips[:, first], starts[:, second], tips[:, second])
+    limits = np.array([radii[i] + radii[j] for i, j in pairs])
+    return np.any(gaps < limits, axis=1)
+
+
+def evaluate_design(spec_data: dict, positions: np.ndarray, approach_axes: np.ndarray|None, link: str|None = None,
+                    restarts: int = 4, iterations: int = 50, seed: int = 0) -> dict:
+    """
+    Score one robot design without building its geometry.
+
+    A target counts as reachable when the batched IK solves it and the solution has no
+    capsule self-collision.
+
+    Args:
+        spec_data: RobotSpec data of the design
+        positions, approach_axes: targets of kinematics.inverse_kinematics
+        link: link that has to reach the targets, the last link if None
+        restarts, iterations, seed: options of kinematics.inverse_kinematics
+
+    Returns:
+        dict: {"reachable": count, "solved": count, "self_collisions": solved targets whose solution collides,
+            "mean_manipulability": mean over the reachable targets, "reachable_targets": indices}
+    """
+    model, frames = spec_kinematics(RobotSpec(spec_data))
+    solutions, solved, _ = inverse_kinematics(model, positions, approach_axes, link=link, restarts=restarts, iterations=iterations, seed=seed)
+    poses = model.forward_kinematics(solutions)
+    collided = self_collisions(model, frames, poses)
+    reachable = solved & ~collided
+    indices = manipulability(model.jacobian(solutions, link=link, poses=poses))
+    return {
+        "reachable": int(reachable.sum()),
+        "solved": int(solved.sum()),
+        "self_collisions": int((solved & collided).sum()),
+        "mean_manipulability": float(indices[reachable].mean()) if reachable.any() else 0.0,
+        "reachable_targets": np.flatnonzero(reachable).tolist(),
+    }
+
+
+def _evaluate_designs(spec_data_list: list[dict], positions: np.ndarray, approach_axes: np.ndarray|None, options: dict) -> list[dict]:
+    return [evaluate_design(spec_data, positions, approach_axes, **options) for spec_data in spec_data_list]
+
+
+def sweep_designs(specs: list[RobotSpec], positions: np.ndarray, approach_axes: np.ndarray|None = None, parallel: bool = True,
+                  max_workers: int|None = None, chunk_size: int = 16, **options) -> list[dict]:
+    """
+    Evaluate many robot designs with evaluate_design and rank them.
+
+    Designs are sent to the shared process pool in chunks, so each worker pays the import
+    cost once and the targets are pickled once per chunk.
+
+    Args:
+        specs: designs to compare
+        positions, approach_axes: targets of kinematics.inverse_kinematics
+        parallel: evaluate in the process pool of parallel_build
+        max_workers: size of the process pool when it is created
+        chunk_size: designs per task of the pool
+        options: other arguments of evaluate_design (link, restarts, iterations, seed)
+
+    Returns:
+        list[dict]: one row per design, best first: the result of evaluate_design plus "index" (position
+            in specs) and "rank". Designs are ranked by reachable targets, then mean manipulability.
+    """
+    spec_data_list = [spec.to_dict() for spec in specs]
+    chunks = [spec_data_list[start:start + chunk_size] for start in range(0, len(spec_data_list), chunk_size)]
+    if parallel and len(chunks) > 1:
+        with build_executor(max_workers) as executor:
+            futures = [executor.submit(_evaluate_designs, chunk, positions, approach_axes, options) for chunk in chunks]
+            results = [row for future in futures for row in future.result()]
+    else:
+        results = [row for chunk in chunks for row in _evaluate_designs(chunk, positions, approach_axes, options)]
+    rows = [dict(result, index=index) for index, result in enumerate(results)]
+    rows.sort(key=lambda row: (-row["reachable"], -row["mean_manipulability"], row["index"]))
+    for rank, row in enumerate(rows, start=1):
+        row["rank"] = rank
+    return rows
@@ -0,0 +1,375 @@
+import hashlib
+import math
+
+import numpy as np
+
+# 関節の種類（KinematicModel.joint_types の値）
+FIXED = 0
+REVOLUTE = 1
+PRISMATIC = 2
+
+_JOINT_CODES = {"fixed": FIXED, "revolute": REVOLUTE, "continuous": REVOLUTE, "prismatic": PRISMATIC}
+
+
+def rpy_to_matrix(rpy: np.ndarray) -> np.ndarray:
+    """Rotation matrix of URDF roll-pitch-yaw angles (fixed axes X, Y, Z: R = Rz @ Ry @ Rx)."""
+    roll, pitch, yaw = rpy
+    cr, sr = math.cos(roll), math.sin(roll)
+    cp, sp = math.cos(pitch), math.sin(pitch)
+    cy, sy = math.cos(yaw), math.sin(yaw)
+    return np.array([
+        [cy*cp, cy*sp*sr - sy*cr, cy*sp*cr + sy*sr],
+        [sy*cp, sy*sp*sr + cy*cr, sy*sp*cr - cy*sr],
+        [-sp, cp*sr, cp*cr],
+    ])
+
+
+def origin_transform(xyz: np.ndarray, rpy: np.ndarray) -> np.ndarray:
+    """4x4 homogeneous transform of a URDF <origin xyz rpy>."""
+    transform = np.eye(4)
+    transform[:3, :3] = rpy_to_matrix(rpy)
+    transform[:3, 3] = xyz
+    return transform
+
+
+class KinematicModel:
+    """
+    Array form of a Link/Joint tree for batched kinematics.
+
+    Link 0 is the root (the parent of the first joint, usually "world"), and link i > 0 is
+    the child of joints[i-1]. Parents always come before their children.
+
+    Attributes:
+        link_names: names of the links, root first
+        joint_names: names of the movable joints, in the order of the configuration vector q
+        parents: (L,) index of the parent link, -1 for the root
+        origins: (L, 4, 4) transform from the parent link to the joint frame (identity for the root)
+        axes: (L, 3) unit joint axis in the joint frame
+        joint_types: (L,) FIXED, REVOLUTE or PRISMATIC
+        joint_indices: (L,) index into q of the joint moving each link, -1 if fixed
+        lower_limits, upper_limits: (J,) joint limits
+        key: hash of the kinematic description, unchanged by anything that does not move the links
+    """
+
+    def __init__(self, link_names, joint_names, parents, origins, axes, joint_types, joint_indices, lower_limits, upper_limits):
+        self.link_names = list(link_names)
+        self.joint_names = list(joint_names)
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.origins = np.asarray(origins, dtype=float)
+        self.axes = np.asarray(axes, dtype=float)
+        self.joint_types = np.asarray(joint_types, dtype=np.int64)
+        self.joint_indices = np.asarray(joint_indices, dtype=np.int64)
+        self.lower_limits = np.asarray(lower_limits, dtype=float)
+        self.upper_limits = np.asarray(upper_limits, dtype=float)
+        self.key = self._description_hash()
+        # 回転関節の回転はロドリゲスの公式 R(q) = I + sin(q) K + (1 - cos(q)) K^2 (K は軸の外積行列)。
+        # 親リンクの回転に1回の行列積で掛けられるよう、リンクごとに
+        # [O | O K | O K^2 | o]（回転関節）、[O | O a | o]（直動関節）、[O | o]（固定）を横に並べておく
+        k = np.zeros((len(self.axes), 3, 3))
+        k[:, 0, 1], k[:, 0, 2], k[:, 1, 2] = -self.axes[:, 2], self.axes[:, 1], -self.axes[:, 0]
+        k[:, 1, 0], k[:, 2, 0], k[:, 2, 1] = self.axes[:, 2], -self.axes[:, 1], self.axes[:, 0]
+        self._link_factors = []
+        for i, (origin, cross, axis) in enumerate(zip(self.origins, k, self.axes)):
+            rotation, position = origin[:3, :3], origin[:3, 3:]
+            if self.joint_types[i] == REVOLUTE:
+                self._link_factors.append(np.hstack([rotation, rotation @ cross, rotation @ cross @ cross, position]))
+            elif self.joint_types[i] == PRISMATIC:
+                self._link_factors.append(np.hstack([rotation, (rotation @ axis)[:, None], position]))
+            else:
+                self._link_factors.append(np.hstack([rotation, position]))
+
+    @classmethod
+    def from_joints(cls, joints: list) -> "KinematicModel":
+        """
+        Compile the model from Joint objects.
+
+        Args:
+            joints: joints of the robot, each parent link being the root or the child of an earlier joint
+        """
+        entries = {}
+        for joint in joints:
+            entries[joint.joint_name] = {
+                "type": joint.joint_type.value,
+                "parent": joint.parent_link.link_name,
+                "child": joint.child_link.link_name,
+                "origin_xyz": joint.origin_xyz,
+                "origin_rpy": joint.origin_rpy,
+                "axis_xyz": joint.axis_xyz,
+                "lower_limit": joint.lower_limit,
+                "upper_limit": joint.upper_limit,
+            }
+        return cls.from_joint_entries(entries)
+
+    @classmethod
+    def from_joint_entries(cls, entries: dict) -> "KinematicModel":
+        """
+        Compile the model from joint descriptions, e.g. the "joints" of a build manifest.
+
+        Args:
+            entries: {joint name: {type, parent, child, origin_xyz, origin_rpy, axis_xyz, lower_limit, upper_limit}}.
+                Joints are reordered so that parents come first (the manifest stores them sorted by name).
+        """
+        if not entries:
+            raise ValueError("A kinematic model needs at least one joint.")
+        roots = {joint["parent"] for joint in entries.values()} - {joint["child"] for joint in entries.values()}
+        if len(roots) != 1:
+            raise ValueError(f"A kinematic model needs exactly one root link, got {', '.join(sorted(roots)) or 'none'}.")
+        link_names = list(roots)
+        ordered = []
+        pending = list(entries.items())
+        while pending:
+            ready = [item for item in pending if item[1]["parent"] in link_names + [joint["child"] for _, joint in ordered]]
+            if not ready:
+                raise ValueError(f"Joints not connected to {link_names[0]}: {', '.join(name for name, _ in pending)}")
+            ordered.extend(ready)
+            pending = [item for item in pending if item not in ready]
+        parents = [-1]
+        origins = [np.eye(4)]
+        axes = [np.zeros(3)]
+        joint_types = [FIXED]
+        joint_indices = [-1]
+        joint_names, lower_limits, upper_limits = [], [], []
+        for joint_name, joint in ordered:
+            joint_type = joint["type"]
+            if joint_type not in _JOINT_CODES:
+                raise ValueError(f"Unsupported joint type for kinematics: {joint_type} ({joint_name})")
+            link_names.append(joint["child"])
+            parents.append(link_names.index(joint["parent"]))
+            origins.append(origin_transform(joint["origin_xyz"], joint["origin_rpy"]))
+            axis = np.asarray(joint["axis_xyz"], dtype=float)
+            axes.append(axis / np.linalg.norm(axis) if np.linalg.norm(axis) > 0 else axis)
+            joint_types.append(_JOINT_CODES[joint_type])
+            if joint_type == "fixed":
+                joint_indices.append(-1)
+                continue
+            joint_indices.append(len(joint_names))
+            joint_names.append(joint_name)
+            if joint_type == "continuous":
+                lower_limits.append(-np.inf)
+                upper_limits.append(np.inf)
+            else:
+                lower_limits.append(joint.get("lower_limit", -math.pi))
+                upper_limits.append(joint.get("upper_limit", math.pi))
+        return cls(link_names, joint_names, parents, origins, axes, joint_types, joint_indices, lower_limits, upper_limits)
+
+    def _description_hash(self) -> str:
+        # メッシュの許容誤差などは含めず、運動学に関わる量だけからハッシュを作る
+        digest = hashlib.sha256()
+        digest.update("\n".join(self.link_names + [""] + self.joint_names).encode("utf-8"))
+        for array in (self.parents, np.round(self.origins, 12), self.axes, self.joint_types, self.joint_indices, self.lower_limits, self.upper_limits):
+            digest.update(np.ascontiguousarray(array + 0.0 if array.dtype.kind == "f" else array).tobytes())
+        return digest.hexdigest()
+
+    def link_index(self, link: str|None = None) -> int:
+        """Index of a link in the model, the last link (the end effector) if link is None."""
+        if link is None:
+            return self.link_count - 1
+        if link not in self.link_names:
+            raise ValueError(f"Unknown link: {link}")
+        return self.link_names.index(link)
+
+    def ancestor_joints(self, link: str|None = None) -> np.ndarray:
+        """(J,) bool mask of the joints that move the link."""
+        mask = np.zeros(self.joint_count, dtype=bool)
+        i = self.link_index(link)
+        while i > 0:
+            if self.joint_indices[i] >= 0:
+                mask[self.joint_indices[i]] = True
+            i = self.parents[i]
+        return mask
+
+    @property
+    def link_count(self) -> int:
+        return len(self.link_names)
+
+    @property
+    def joint_count(self) -> int:
+        return len(self.joint_names)
+
+    def forward_kinematics(self, q: np.ndarray) -> np.ndarray:
+        """
+        Poses of all links in the root frame for a batch of joint configurations.
+
+        Args:
+            q: (N, J) joint positions (rad or m), or (J,) for a single configuration
+
+        Returns:
+            np.ndarray: (N, L, 4, 4) link poses, or (L, 4, 4) for a single configuration
+        """
+        q = np.asarray(q, dtype=float)
+        single = q.ndim == 1
+        q = np.atleast_2d(q)
+        if q.shape[1] != self.joint_count:
+            raise ValueError(f"q must have {self.joint_count} joint positions per configuration, got {q.shape[1]}.")
+        n = q.shape[0]
+        rotations = [np.broadcast_to(np.eye(3), (n, 3, 3))]
+        positions = [np.zeros((n, 3))]
+        for i in range(1, self.link_count):
+            parent = self.parents[i]
+            # (N*3, 3) @ (3, k) の1回の行列積で、親の回転に原点の回転・関節の項・原点の位置をまとめて掛ける
+            product = rotations[parent].reshape(-1, 3) @ self._link_factors[i]
+            joint_index = self.joint_indices[i]
+            if joint_index < 0:
+                rotation = product[:, :3]
+                offset = product[:, 3]
+            elif self.joint_types[i] == REVOLUTE:
+                angle = np.repeat(q[:, joint_index], 3)[:, None]
+                rotation = product[:, :3] + np.sin(angle) * product[:, 3:6] + (1 - np.cos(angle)) * product[:, 6:9]
+                offset = product[:, 9]
+            else:
+                offset = product[:, 4] + np.repeat(q[:, joint_index], 3) * product[:, 3]
+                rotation = product[:, :3]
+            rotations.append(np.ascontiguousarray(rotation).reshape(n, 3, 3))
+            positions.append(positions[parent] + offset.reshape(n, 3))
+        poses = np.zeros((n, self.link_count, 4, 4))
+        poses[:, :, :3, :3] = np.stack(rotations, axis=1)
+        poses[:, :, :3, 3] = np.stack(positions, axis=1)
+        poses[:, :, 3, 3] = 1.0
+        return poses[0] if single else poses
+
+    def jacobian(self, q: np.ndarray, link: str|None = None, poses: np.ndarray|None = None) -> np.ndarray:
+        """
+        Geometric Jacobians of a link in the root frame for a batch of joint configurations.
+
+        Rows are the linear velocity of the link origin (x, y, z) followed by the angular
+        velocity. Columns of joints that do not move the link are zero.
+
+        Args:
+            q: (N, J) joint positions, or (J,) for a single configuration
+            link: name of the link, the last link if None
+            poses: result of forward_kinematics(q), if already computed
+
+        Returns:
+            np.ndarray: (N, 6, J) Jacobians, or (6, J) for a single configuration
+        """
+        q = np.asarray(q, dtype=float)
+        single = q.ndim == 1
+        if poses is None:
+            poses = self.forward_kinematics(q)
+        poses = poses[None] if single else poses
+        target = self.link_index(link)
+        mask = self.ancestor_joints(link)
+        # 各関節の子リンクの姿勢から軸と位置を取る（軸まわりの回転・軸方向の移動では軸と回転軸上の点は変わらない）
+        moving_links = np.flatnonzero(self.joint_indices >= 0)
+        moving_links = moving_links[mask[self.joint_indices[moving_links]]]
+        columns = self.joint_indices[moving_links]
+        frames = poses[:, moving_links]
+        axes = np.einsum('nlij,lj->nli', frames[..., :3, :3], self.axes[moving_links])
+        jacobians = np.zeros((poses.shape[0], 6, self.joint_count))
+        revolute = self.joint_types[moving_links] == REVOLUTE
+        offsets = poses[:, target, None, :3, 3] - frames[..., :3, 3]
+        linear = np.where(revolute[None, :, None], np.cross(axes, offsets), axes)
+        angular = np.where(revolute[None, :, None], axes, 0.0)
+        jacobians[:, :3, columns] = linear.transpose(0, 2, 1)
+        jacobians[:, 3:, columns] = angular.transpose(0, 2, 1)
+        return jacobians[0] if single else jacobians
+
+
+def manipulability(jacobians: np.ndarray) -> np.ndarray:
+    """
+    Yoshikawa manipulability index sqrt(det(J J^T)) of a batch of Jacobians.
+
+    With fewer joints than Jacobian rows, sqrt(det(J^T J)) is used instead so that the
+    index is not always zero. Pass jacobians[:, :3] to score only the translation.
+
+    Args:
+        jacobians: (N, M, J) or (M, J) Jacobians
+
+    Returns:
+        np.ndarray: (N,) indices, or a float for a single Jacobian
+    """
+    jacobians = np.asarray(jacobians, dtype=float)
+    transposed = np.swapaxes(jacobians, -1, -2)
+    if jacobians.shape[-2] <= jacobians.shape[-1]:
+        gram = jacobians @ transposed
+    else:
+        gram = transposed @ jacobians
+    # 特異姿勢では丸め誤差で行列式がわずかに負になる
+    return np.sqrt(np.clip(np.linalg.det(gram), 0.0, None))
+
+
+def _axis_error(current: np.ndarray, target: np.ndarray) -> np.ndarray:
+    # current を target に向ける回転ベクトル（小さい角度では角度 x 回転軸）
+    return np.cross(current, target)
+
+
+def inverse_kinematics(model: KinematicModel, positions: np.ndarray, approach_axes: np.ndarray|None = None, link: str|None = None,
+                       tool_axis: np.ndarray = np.array([0.0, 0.0, 1.0]), restarts: int = 8, iterations: int = 100,
+                       damping: float = 0.05, max_step: float = 0.5, tolerance: float = 1e-3,
+                       stall_ratio: float = 1e-2, stall_iterations: int = 5, seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Solve the inverse kinematics of many targets at once with damped least squares.
+
+    Every target is solved from several random configurations within the joint limits,
+    all in one batch, and the best solution of each target is returned. The joints are
+    clipped to their limits after every step. Starts leave the batch as soon as another
+    start of their target is solved or their error stops decreasing.
+
+    Args:
+        model: kinematics of the robot
+        positions: (T, 3) target positions of the link origin in the root frame
+        approach_axes: (T, 3) directions tool_axis of the link must point to, or None to solve positions only
+        link: link that has to reach the targets, the last link if None
+        tool_axis: axis of the link aligned with approach_axes, in the link frame
+        restarts: random initial configurations per target
+        iterations: maximum damped least-squares steps
+        damping: damping factor (lambda) of the least-squares step
+        max_step: largest change of a joint per step (rad or m)
+        tolerance: error below which a target is solved (m, and rad for the approach axis)
+        stall_ratio, stall_iterations: a start is given up when its error has not improved on
+            its best by stall_ratio for stall_iterations steps
+        seed: seed of the initial configurations
+
+    Returns:
+        tuple: (T, J) best configuration, (T,) bool solved, (T,) remaining error of each target
+    """
+    positions = np.atleast_2d(np.asarray(positions, dtype=float))
+    targets = len(positions)
+    rows = 3 if approach_axes is None else 6
+    target = model.link_index(link)
+    lower = np.where(np.isfinite(model.lower_limits), model.lower_limits, -math.pi)
+    upper = np.where(np.isfinite(model.upper_limits), model.upper_limits, math.pi)
+
+    # 全ターゲット x 全リスタートを1つのバッチとして解く
+    rng = np.random.default_rng(seed)
+    q = rng.uniform(lower, upper, (targets * restarts, model.joint_count))
+    goal_positions = np.repeat(positions, restarts, axis=0)
+    if approach_axes is not None:
+        goal_axes = np.repeat(np.atleast_2d(np.asarray(approach_axes, dtype=float)), restarts, axis=0)
+        goal_axes /= np.linalg.norm(goal_axes, axis=1, keepdims=True)
+    tool_axis = np.asarray(tool_axis, dtype=float) / np.linalg.norm(tool_axis)
+    errors = np.full(len(q), np.inf)
+    best_errors = np.full(len(q), np.inf)
+    stalled = np.zeros(len(q), dtype=np.int64)
+    active = np.arange(len(q))
+    identity = damping ** 2 * np.eye(rows)
+    for iteration in range(iterations + 1):
+        poses = model.forward_kinematics(q[active])
+        residual = goal_positions[active] - poses[:, target, :3, 3]
+        if approach_axes is not None:
+            residual = np.concatenate([residual, _axis_error(poses[:, target, :3, :3] @ tool_axis, goal_axes[active])], axis=1)
+        error = np.linalg.norm(residual, axis=1)
+        # 誤差がほとんど減らなくなったもの（届かない目標や局所解）は打ち切る
+        improved = error < best_errors[active] * (1 - stall_ratio)
+        stalled[active] = np.where(improved, 0, stalled[active] + 1)
+        best_errors[active] = np.minimum(best_errors[active], error)
+        errors[active] = error
+        # 解けたターゲットは、残りのリスタートもまとめてバッチから外す
+        solved = np.zeros(targets, dtype=bool)
+        solved[active[error < tolerance] // restarts] = True
+        remaining = ~solved[active // restarts] & (stalled[active] < stall_iterations)
+        active, poses, residual = active[remaining], poses[remaining], residual[remaining]
+        if len(active) == 0 or iteration == iterations:
+            break
+        jacobians = model.jacobian(q[active], link=link, poses=poses)[:, :rows]
+        # dq = J^T (J J^T + lambda^2 I)^-1 e
+        step = np.linalg.solve(jacobians @ jacobians.transpose(0, 2, 1) + identity, residual[..., None])
+        dq = (jacobians.transpose(0, 2, 1) @ step)[..., 0]
+        scale = np.maximum(np.abs(dq).max(axis=1, keepdims=True) / max_step, 1.0)
+        q[active] = np.clip(q[active] + dq / scale, lower, upper)
+
+    errors = errors.reshape(targets, restarts)
+    best = np.argmin(errors, axis=1)
+    solutions = q.reshape(targets, restarts, model.joint_count)[np.arange(targets), best]
+    best_errors = errors[np.arange(targets), best]
+    return solutions, best_errors < tolerance, best_errors
@@ -1,21 +1,119 @@
-import cadquery as cq
-from cadquery.vis import show
-from cadquery import Workplane
-from cadquery import *
-from cadquery.func import *
 import math
 from enum import Enum
-from typing import Any
+from typing import Any, TYPE_CHECKING
 import numpy as np
 import os
+import shutil
+import functools
+import inspect
 from mcp.server.fastmcp import FastMCP
+from mesh_cache import MeshCache, default_mesh_cache, make_cache_key, register_generator_code
+from mesh_export import TriangleMesh, export_mesh
+from collision_geometry import build_collision_geometry
+from mass_properties import DEFAULT_DENSITY, MassProperties
+from kinematics import rpy_to_matrix
+from cad_loader import load_cad
+from worker_pool import run_in_worker
+
+# cadquery は読み込みに数秒かかるので、形状を作るときに読み込む（cad_loader）
+if TYPE_CHECKING:
+    import cadquery as cq
 
 mcp = FastMCP("mcp_robot2")
 
+class PrimitiveType(Enum):
+    box = "box"
+    cylinder = "cylinder"
+    sphere = "sphere"
+
+class CollisionPrimitive:
+    """
+    Analytic collision shape of a link, emitted as a native URDF <box>/<cylinder>/<sphere>.
+
+    The shape is centered at origin_xyz in the link frame. A cylinder is aligned with the z
+    axis of its origin frame, as in URDF.
+    """
+    def __init__(self,
+                primitive_type: PrimitiveType,
+                size: np.ndarray = np.zeros(3),
+                radius: float = 0.0,
+                length: float = 0.0,
+                origin_xyz: np.ndarray = np.zeros(3),
+                origin_rpy: np.ndarray = np.zeros(3)):
+        self.primitive_type = primitive_type
+        self.size = np.asarray(size, dtype=float)
+        self.radius = float(radius)
+        self.length = float(length)
+        self.origin_xyz = np.asarray(origin_xyz, dtype=float)
+        self.origin_rpy = np.asarray(origin_rpy, dtype=float)
+
+    @classmethod
+    def box(cls, size, origin_xyz: np.ndarray = np.zeros(3), origin_rpy: np.ndarray = np.zeros(3)) -> "CollisionPrimitive":
+        return cls(PrimitiveType.box, size=size, origin_xyz=origin_xyz, origin_rpy=origin_rpy)
+
+    @classmethod
+    def cylinder(cls, radius: float, length: float, origin_xyz: np.ndarray = np.zeros(3), origin_rpy: np.ndarray = np.zeros(3)) -> "CollisionPrimitive":
+        return cls(PrimitiveType.cylinder, radius=radius, length=length, origin_xyz=origin_xyz, origin_rpy=origin_rpy)
+
+    @classmethod
+    def sphere(cls, radius: float, origin_xyz: np.ndarray = np.zeros(3)) -> "CollisionPrimitive":
+        return cls(PrimitiveType.sphere, radius=radius, origin_xyz=origin_xyz)
+
+    def transformed(self, xyz: np.ndarray, rpy: np.ndarray) -> "CollisionPrimitive":
+        """Get the primitive after rotating it by rpy about the link origin and then translating it by xyz."""
+        rotation = rpy_to_matrix(rpy)
+        new_rotation = rotation @ rpy_to_matrix(self.origin_rpy)
+        # 回転行列からrpyに戻す（URDFと同じZ-Y-X順）
+        pitch = math.asin(max(-1.0, min(1.0, -new_rotation[2, 0])))
+        roll = math.atan2(new_rotation[2, 1], new_rotation[2, 2])
+        yaw = math.atan2(new_rotation[1, 0], new_rotation[0, 0])
+        return CollisionPrimitive(self.primitive_type, self.size, self.radius, self.length,
+                                  origin_xyz=np.asarray(xyz, dtype=float) + rotation @ self.origin_xyz,
+                                  origin_rpy=np.array([roll, pitch, yaw]) + 0.0)
+
+    def get_collision_description(self) -> str:
+        """Get the <collision> element of the primitive."""
+        ret_description = '\t\t<collision>\n'
+        ret_description += '\t\t\t<origin xyz="{} {} {}" rpy="{} {} {}"/>\n'.format(*self.origin_xyz, *self.origin_rpy)
+        ret_description += '\t\t\t<geometry>\n'
+        if self.primitive_type == PrimitiveType.box:
+            ret_description += '\t\t\t\t<box size="{} {} {}"/>\n'.format(*self.size)
+        elif self.primitive_type == PrimitiveType.cylinder:
+            ret_description += f'\t\t\t\t<cylinder radius="{self.radius}" length="{self.length}"/>\n'
+        elif self.primitive_type == PrimitiveType.sphere:
+            ret_description += f'\t\t\t\t<sphere radius="{self.radius}"/>\n'
+        ret_description += '\t\t\t</geometry>\n'
+        ret_description += '\t\t</collision>\n'
+        return ret_description
+
+class LazyGeometry:
+    """
+    Memoized thunk of the CAD shape of a link.
+
+    The generator passes the function that builds the shape instead of the shape itself,
+    so the OCCT booleans only run when the geometry is first needed (mesh export on a
+    cache miss, OCCT mass properties). The CAD stack itself is imported then as well
+    (cad_loader.load_cad). Copies of a Link share the thunk and therefore build the
+    shape only once.
+    """
+    def __init__(self, build):
+        self.build = build
+        self.shape = None
+        self.evaluated = False
+
+    def __call__(self) -> "cq.Workplane":
+        if not self.evaluated:
+            load_cad()
+            self.shape = self.build()
+            self.evaluated = True
+            # 生成後はクロージャを保持しない
+            self.build = None
+        return self.shape
+
 class Link:
     def __init__(self, 
                 link_name: str,
-                link_geometry: cq.Workplane|None, 
+                link_geometry: "cq.Workplane|LazyGeometry|None", 
                 joint_xyz: np.ndarray = np.zeros(3), 
                 joint_rpy: np.ndarray = np.zeros(3),
                 geometry_xyz: np.ndarray = np.zeros(3),
@@ -23,7 +121,10 @@ class Link:
                 mass:float = 1.0,
                 filename:str = "",
                 collision_filename:str = "",
-                inertia_vector:np.ndarray = np.zeros(6)
+                inertia_vector:np.ndarray = np.zeros(6),
+                collision_primitives: list[CollisionPrimitive]|None = None,
+                center_of_mass: np.ndarray = np.zeros(3),
+                mass_properties: MassProperties|None = None
                     ):
         self.link_name = link_name
         self.link_geometry = link_geometry
@@ -35,9 +136,30 @@ class Link:
         self.mass = mass
         self.filename = filename
         self.collision_filename = collision_filename
+        # 凸分解した場合は複数の衝突判定用メッシュを持つ。空ならcollision_filenameだけを使う
+        self.collision_filenames = []
+        self.collision_report = None
+        # 解析的な形状で表せるリンクは、メッシュの代わりにプリミティブで衝突判定する
+        self.collision_primitives = collision_primitives or []
         self.inertia_vector = inertia_vector
+        self.center_of_mass = center_of_mass
+        # 単位密度での質量特性。生成関数が解析的に求められない場合はNoneで、OCCTで計算する（mass_properties.compute_link_inertias）
+        self.mass_properties = mass_properties
+        if mass_properties is not None:
+            self.set_mass_properties(mass_properties)
+        # link_generatorで登録された生成関数が設定する。メッシュキャッシュのキーに使う
+        self.generator_name = None
+        self.generator_params = {}
         self.validate()
 
+    def set_mass_properties(self, mass_properties: MassProperties, density: float = DEFAULT_DENSITY):
+        """Set mass, center_of_mass and inertia_vector from unit-density mass properties."""
+        self.mass_properties = mass_properties
+        properties = mass_properties.scaled(density)
+        self.mass = properties.mass
+        self.center_of_mass = properties.center_of_mass
+        self.inertia_vector = properties.inertia_vector
+
     def validate(self):
         if not isinstance(self.joint_xyz, np.ndarray) or self.joint_xyz.shape != (3,):
             raise ValueError("joint_xyz must be a 3-element numpy array.")
@@ -49,30 +171,140 @@ class Link:
             raise ValueError("geometry_rpy must be a 3-element numpy array.")
         print("Link validation passed.")
 
-    def gen_mesh_file(self, filename: str=None, targetdir: str=".") -> None:
-        """Generate a mesh file for the link."""
+    @property
+    def link_geometry(self) -> "cq.Workplane|None":
+        """CAD shape of the link. A LazyGeometry is built on first access."""
+        if isinstance(self._link_geometry, LazyGeometry):
+            return self._link_geometry()
+        return self._link_geometry
+
+    @link_geometry.setter
+    def link_geometry(self, link_geometry: "cq.Workplane|LazyGeometry|None"):
+        self._link_geometry = link_geometry
+
+    @property
+    def has_geometry(self) -> bool:
+        """Whether the link has a shape, without building a LazyGeometry."""
+        return self._link_geometry is not None
+
+    @property
+    def geometry_built(self) -> bool:
+        """Whether the shape of the link has been built (False for an unevaluated LazyGeometry)."""
+        if isinstance(self._link_geometry, LazyGeometry):
+            return self._link_geometry.evaluated
+        return self._link_geometry is not None
+
+    def mesh_cache_key(self, tolerance: float = 0.1, angular_tolerance: float = 0.1, file_format: str = "stl", export_options: dict|None = None) -> str|None:
+        """Get the content address of the link mesh, or None if the link was not made by a registered generator."""
+        if self.generator_name is None:
+            return None
+        return make_cache_key(self.generator_name, self.generator_params, format=file_format, options=export_options or {}, tolerance=tolerance, angular_tolerance=angular_tolerance)
+
+    def gen_mesh_file(self, filename: str=None, targetdir: str=".", tolerance: float = 0.1, angular_tolerance: float = 0.1, mesh_cache: MeshCache|None = default_mesh_cache, formats: tuple = ("stl",), export_options: dict|None = None, collision_method: str = "copy", collision_options: dict|None = None, progress=None) -> None:
+        """
+        Generate mesh files for the link.
+
+        The geometry is tessellated at most once and the resulting buffer is written in every
+        requested format (see mesh_export.MESH_WRITERS). The URDF refers to the first format.
+        If the link was created by a registered generator, each file is looked up in
+        mesh_cache first and the shape is only built (see LazyGeometry) and tessellated
+        on a cache miss. Pass mesh_cache=None to always export.
+
+        Args:
+            formats: output formats, e.g. ("stl", "glb"). Written as mesh/<link_name>.<format>
+            export_options: per-format writer options, e.g. {"glb": {"y_up": False}}
+            collision_method: "copy" uses the visual mesh as collision mesh, "convex" writes a
+                set of convex hulls and "decimate" a reduced mesh (see collision_geometry)
+            collision_options: keyword arguments of collision_geometry.build_collision_geometry
+            progress: called with "geometry", "tessellation", "export" and "collision" when
+                that step starts (see build_requests.BuildProgress)
+        """
 
         targetdir = targetdir.rstrip("/")
-        if self.link_geometry is None:
+        progress = progress or (lambda step: None)
+        export_options = export_options or {}
+        # 形状はキャッシュに無いときだけ生成する（LazyGeometry）
+        if not self.has_geometry:
             # print("Link geometry is not defined. Skipped.")
             return
         if filename is None:
-            filename = f"{targetdir}/mesh/{self.link_name}.stl"
-            # if there is no directory, create it
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-            cq.exporters.export(self.link_geometry, filename)
-            self.filename = f"mesh/{self.link_name}.stl"
-
-            collision_filename = f"{targetdir}/collision/{self.link_name}_col.stl"
-            # if there is no directory, create it
-            os.makedirs(os.path.dirname(collision_filename), exist_ok=True)
-            cq.exporters.export(self.link_geometry, collision_filename)
-            self.collision_filename = f"collision/{self.link_name}_col.stl"
+            mesh = None
+            for file_format in formats:
+                filename = f"{targetdir}/mesh/{self.link_name}.{file_format}"
+                # if there is no directory, create it
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                options = export_options.get(file_format, {})
+                cache_key = self.mesh_cache_key(tolerance, angular_tolerance, file_format, options) if mesh_cache is not None else None
+                if cache_key is not None and mesh_cache.fetch(cache_key, filename, suffix=f".{file_format}"):
+                    continue
+                if mesh is None:
+                    progress("geometry")
+                    geometry = self.link_geometry
+                    progress("tessellation")
+                    mesh = TriangleMesh.from_shape(geometry, tolerance, angular_tolerance)
+                progress("export")
+                export_mesh(mesh, filename, file_format, **options)
+                if cache_key is not None:
+                    mesh_cache.store(cache_key, filename, suffix=f".{file_format}")
+            self.filename = f"mesh/{self.link_name}.{formats[0]}"
+
+            if self.collision_primitives:
+                # the URDF uses the analytic primitives, so no collision mesh is needed
+                self.collision_filename = ""
+                self.collision_filenames = []
+                self.collision_report = None
+            elif collision_method == "copy":
+                collision_filename = f"{targetdir}/collision/{self.link_name}_col.{formats[0]}"
+                # if there is no directory, create it
+                os.makedirs(os.path.dirname(collision_filename), exist_ok=True)
+                # 衝突判定用メッシュは見た目用と同じ形状なので、再エクスポートせずにコピーする
+                shutil.copyfile(f"{targetdir}/{self.filename}", collision_filename)
+                self.collision_filename = f"collision/{self.link_name}_col.{formats[0]}"
+                self.collision_filenames = [self.collision_filename]
+                self.collision_report = None
+            else:
+                progress("collision")
+                self.gen_collision_files(targetdir, mesh, tolerance, angular_tolerance, mesh_cache, collision_method, collision_options or {})
 
             # print(f"Mesh file generated: {filename}")
         # else:
         #     print(f"Mesh file already exists: {filename}. Skipped.")
 
+    def gen_collision_files(self, targetdir: str, mesh: TriangleMesh|None, tolerance: float, angular_tolerance: float, mesh_cache: MeshCache|None, collision_method: str, collision_options: dict) -> None:
+        """
+        Write the simplified collision meshes of the link as collision/<link_name>_col[_<i>].stl.
+
+        The hull count, triangle count and Hausdorff error are kept in self.collision_report.
+        """
+        cache_key = None
+        if mesh_cache is not None and self.generator_name is not None:
+            cache_key = make_cache_key(self.generator_name, self.generator_params, collision=collision_method, options=collision_options, tolerance=tolerance, angular_tolerance=angular_tolerance)
+
+        report = mesh_cache.load_json(cache_key) if cache_key is not None else None
+        if report is not None:
+            names = [f"collision/{self.link_name}_col_{i}.stl" if report["file_count"] > 1 else f"collision/{self.link_name}_col.stl" for i in range(report["file_count"])]
+            if all(mesh_cache.fetch(cache_key, f"{targetdir}/{name}", suffix=f".col{i}.stl") for i, name in enumerate(names)):
+                self.collision_filenames = names
+                self.collision_filename = names[0]
+                self.collision_report = report["report"]
+                return
+
+        if mesh is None:
+            mesh = TriangleMesh.from_shape(self.link_geometry, tolerance, angular_tolerance)
+        collision = build_collision_geometry(mesh, collision_method, **collision_options)
+        names = []
+        for i, collision_mesh in enumerate(collision.meshes):
+            name = f"collision/{self.link_name}_col_{i}.stl" if len(collision.meshes) > 1 else f"collision/{self.link_name}_col.stl"
+            export_mesh(collision_mesh, f"{targetdir}/{name}", "stl")
+            if cache_key is not None:
+                mesh_cache.store(cache_key, f"{targetdir}/{name}", suffix=f".col{i}.stl")
+            names.append(name)
+        self.collision_filenames = names
+        self.collision_filename = names[0]
+        self.collision_report = collision.report()
+        if cache_key is not None:
+            mesh_cache.store_json(cache_key, {"file_count": len(names), "report": self.collision_report})
+
     def get_link_description(self) -> str:
         """Get the description of the link."""
         ret_description = ''
@@ -80,18 +312,25 @@ class Link:
             ret_description += f'\t<link name="{self.link_name}"/>\n'
             return ret_description
         ret_description += f'\t<link name="{self.link_name}">\n'
-        if self.link_geometry is not None:
+        # the geometry may have been dropped after the mesh was exported in another process
+        if self.has_geometry or self.filename:
             ret_description += '\t\t<visual>\n'
             ret_description += '\t\t\t<geometry>\n'
             ret_description += f'\t\t\t\t<mesh filename="{self.filename}"/>\n'
             ret_description += '\t\t\t</geometry>\n'
             ret_description += '\t\t</visual>\n'
-            ret_description += '\t\t<collision>\n'
-            ret_description += '\t\t\t<geometry>\n'
-            ret_description += f'\t\t\t\t<mesh filename="{self.collision_filename}"/>\n'
-            ret_description += '\t\t\t</geometry>\n'
-            ret_description += '\t\t</collision>\n'
+        if self.collision_primitives:
+            for primitive in self.collision_primitives:
+                ret_description += primitive.get_collision_description()
+        elif self.has_geometry or self.filename:
+            for collision_filename in (self.collision_filenames or [self.collision_filename]):
+                ret_description += '\t\t<collision>\n'
+                ret_description += '\t\t\t<geometry>\n'
+                ret_description += f'\t\t\t\t<mesh filename="{collision_filename}"/>\n'
+                ret_description += '\t\t\t</geometry>\n'
+                ret_description += '\t\t</collision>\n'
         ret_description += '\t\t<inertial>\n'
+        ret_description += '\t\t\t<origin xyz="{} {} {}" rpy="0 0 0"/>\n'.format(*self.center_of_mass)
         ret_description += f'\t\t\t<mass value="{self.mass}"/>\n'
         ret_description += f'\t\t\t<inertia ixx="{self.inertia_vector[0]}" ixy="{self.inertia_vector[1]}" ixz="{self.inertia_vector[2]}" iyy="{self.inertia_vector[3]}" iyz="{self.inertia_vector[4]}" izz="{self.inertia_vector[5]}"/>\n'
         ret_description += '\t\t</inertial>\n'
@@ -177,8 +416,76 @@ class Joint:
         return f'\t\t<joint name="{self.joint_name}">\n'
 
 
+LINK_GENERATORS = {}
+LINK_FRAMES = {}
+
+class LinkFrame:
+    """
+    Kinematic data of a link that follows from the generator arguments alone, without building the geometry.
+
+    Attributes:
+        joint_xyz, joint_rpy: origin of the child joint in the link frame (Link.joint_xyz/joint_rpy)
+        capsule_radius: radius of a capsule from the link origin to joint_xyz that stands in for the
+            link in geometry-free self-collision checks, or None to leave the link out
+    """
+
+    def __init__(self, joint_xyz: np.ndarray, joint_rpy: np.ndarray, capsule_radius: float|None = None):
+        self.joint_xyz = joint_xyz
+        self.joint_rpy = joint_rpy
+        self.capsule_radius = capsule_radius
+
+def link_generator(func=None, *, frame=None):
+    """
+    Register a link generator function.
+
+    The returned Link remembers the generator name and its arguments (except link_name),
+    which identify the link geometry, e.g. as the key of the mesh cache. The key also
+    covers the code of the generator (see mesh_cache.register_generator_code).
+
+    Args:
+        frame: function of the generator arguments (without link_name) returning the LinkFrame
+            of the link, used by link_frame. Use as @link_generator(frame=...).
+    """
+    if func is None:
+        return lambda func: link_generator(func, frame=frame)
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        link = func(*args, **kwargs)
+        if link is not None:
+            link.generator_name = func.__name__
+            link.generator_params = {k: v for k, v in bound.arguments.items() if k != "link_name"}
+        return link
+
+    LINK_GENERATORS[func.__name__] = wrapper
+    register_generator_code(func)
+    if frame is not None:
+        LINK_FRAMES[func.__name__] = frame
+    return wrapper
+
+def link_frame(generator_name: str, params: dict) -> LinkFrame:
+    """
+    Get the joint origin and capsule of a link without running its generator (no CAD).
+
+    Args:
+        generator_name: name of a generator registered with a frame function
+        params: generator arguments without link_name
+    """
+    if generator_name not in LINK_FRAMES:
+        raise ValueError(f"Link generator {generator_name} has no frame function.")
+    bound = inspect.signature(LINK_GENERATORS[generator_name]).bind_partial(**params)
+    bound.apply_defaults()
+    return LINK_FRAMES[generator_name](**{k: v for k, v in bound.arguments.items() if k != "link_name"})
+
+
 def xyz_axes(vector_xyz: np.ndarray = np.zeros(3),vector_rpy: np.ndarray = np.zeros(3)):
     """X, Y, Z軸を表示する関数"""
+    cq = load_cad()
+    from cadquery import Workplane
+
     # 赤: X軸、緑: Y軸、青: Z軸
     axis_length = 1  # 円柱の長さ
     axis_radius = 0.1  # 円柱の半径
@@ -208,6 +515,12 @@ def xyz_axes(vector_xyz: np.ndarray = np.zeros(3),vector_rpy: np.ndarray = np.ze
     return asm
 
 
+def gen_link_frame(cylinder_length: float, cylinder_diameter: float, elbow_size: float, angle: float = 0.0, **params) -> LinkFrame:
+    joint_xyz = np.array([elbow_size/2*math.cos(math.radians(angle)), elbow_size/2*math.sin(math.radians(angle)), cylinder_length+elbow_size/2])
+    joint_rpy = np.array([0, math.radians(90), math.radians(angle)])  # Assuming the joint is aligned with the elbow angle
+    return LinkFrame(joint_xyz, joint_rpy, capsule_radius=cylinder_diameter/2)
+
+@link_generator(frame=gen_link_frame)
 def gen_link(link_name: str, cylinder_length: float, cylinder_diameter: float, elbow_size: float, elbow_diameter: float, angle: float = 0.0) -> Link:
     """
     Generate a link based on the type provided.
@@ -224,27 +537,41 @@ def gen_link(link_name: str, cylinder_length: float, cylinder_diameter: float, e
     """
 
 
-    # Create the elbow
-    elbow_torus = torus(elbow_size, elbow_diameter)
-    filter_box = box(elbow_size, elbow_size, elbow_size).translate((elbow_size/2,elbow_size/2, -elbow_size/2))
-    elbow = elbow_torus * filter_box
-    elbow = elbow.rotate((0, 0, 0), (1, 0, 0), 90).translate((-elbow_size/2, 0, cylinder_length)).rotate((0, 0, 0), (0, 0, 1), 180)  # Rotate the elbow to align it with the cylinder
-    elbow = elbow.rotate((0, 0, 0), (0, 0, 1), angle)  # Rotate the elbow by the specified angle
-    # Combine the cylinder and elbow
+    def build_geometry():
+        from cadquery import Workplane
+        from cadquery.func import box, torus
+
+        # Create the elbow
+        elbow_torus = torus(elbow_size, elbow_diameter)
+        filter_box = box(elbow_size, elbow_size, elbow_size).translate((elbow_size/2,elbow_size/2, -elbow_size/2))
+        elbow = elbow_torus * filter_box
+        elbow = elbow.rotate((0, 0, 0), (1, 0, 0), 90).translate((-elbow_size/2, 0, cylinder_length)).rotate((0, 0, 0), (0, 0, 1), 180)  # Rotate the elbow to align it with the cylinder
+        elbow = elbow.rotate((0, 0, 0), (0, 0, 1), angle)  # Rotate the elbow by the specified angle
+        # Combine the cylinder and elbow
+        if cylinder_length > 0:
+            # Create the main cylinder
+            cylinder = Workplane("XY").circle(cylinder_diameter / 2).extrude(cylinder_length)
+            return cylinder.add(elbow)
+        return elbow
+
+    elbow_mass = MassProperties.torus_sector(elbow_size / 2, elbow_diameter / 2, math.pi / 2)
+    elbow_mass = elbow_mass.rotate((0, 0, 0), (1, 0, 0), 90).translate((-elbow_size/2, 0, cylinder_length)).rotate((0, 0, 0), (0, 0, 1), 180)
+    elbow_mass = elbow_mass.rotate((0, 0, 0), (0, 0, 1), angle)
     if cylinder_length > 0:
-        # Create the main cylinder
-        cylinder = Workplane("XY").circle(cylinder_diameter / 2).extrude(cylinder_length)
-        link = cylinder.add(elbow)
+        mass_properties = MassProperties.cylinder(cylinder_diameter / 2, cylinder_length) + elbow_mass
     else:
-        link = elbow
+        mass_properties = elbow_mass
     
     # calculate the joint position and orientation
-    joint_xyz = np.array([elbow_size/2*math.cos(math.radians(angle)), elbow_size/2*math.sin(math.radians(angle)), cylinder_length+elbow_size/2])
+    frame = gen_link_frame(cylinder_length, cylinder_diameter, elbow_size, angle)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
 
-    joint_rpy = np.array([0, math.radians(90), math.radians(angle)])  # Assuming the joint is aligned with the elbow angle
+    return Link(link_name=link_name, link_geometry=LazyGeometry(build_geometry), joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3), mass_properties=mass_properties)
 
-    return Link(link_name=link_name, link_geometry=link, joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3))
+def gen_ee_link_frame(cylinder_length: float, cylinder_diameter: float, **params) -> LinkFrame:
+    return LinkFrame(np.array([0, 0, cylinder_length/2]), np.array([0, 0, 0]), capsule_radius=cylinder_diameter/2)
 
+@link_generator(frame=gen_ee_link_frame)
 def gen_ee_link(link_name: str, cylinder_length: float, cylinder_diameter: float) -> Link| None:
     """
     Generate an end effector link based on the type provided.
@@ -256,18 +583,22 @@ def gen_ee_link(link_name: str, cylinder_length: float, cylinder_diameter: float
     Returns:
         object: The generated end effector link object.
     """
-    if cylinder_length > 0:
-        # Create the main cylinder
-        cylinder = Workplane("XY").circle(cylinder_diameter / 2).extrude(cylinder_length)
-        link = cylinder
-    else:
+    if cylinder_length <= 0:
         return None
+
+    def build_geometry():
+        from cadquery import Workplane
+
+        # Create the main cylinder
+        return Workplane("XY").circle(cylinder_diameter / 2).extrude(cylinder_length)
         
     # calculate the joint position and orientation
-    joint_xyz = np.array([0, 0, cylinder_length/2])
-    joint_rpy = np.array([0, 0, 0])  # Assuming the joint is aligned with the elbow angle
+    frame = gen_ee_link_frame(cylinder_length, cylinder_diameter)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
+    collision_primitives = [CollisionPrimitive.cylinder(cylinder_diameter / 2, cylinder_length, origin_xyz=np.array([0, 0, cylinder_length/2]))]
 
-    return Link(link_name=link_name, link_geometry=link, joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3))
+    return Link(link_name=link_name, link_geometry=LazyGeometry(build_geometry), joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3), collision_primitives=collision_primitives,
+                mass_properties=MassProperties.cylinder(cylinder_diameter / 2, cylinder_length))
 
 
     return gen_link(link_name, cylinder_length, cylinder_diameter, elbow_size, elbow_diameter, angle)
@@ -285,81 +616,58 @@ async def update_robot(list_of_length=[3, 3, 3]) -> None:
         mcp.error("Invalid list_of_length. It should be a list of three lengths.")
         return
 
+    # CADの処理はワーカープロセスで行い、イベントループを塞がない
+    await run_in_worker(build_test_robot, list_of_length)
+
+def build_test_robot(list_of_length: list) -> None:
+    """Body of update_robot: write test_robot.urdf/srdf and the meshes of the telbot type robot."""
     # Delete the existing mesh directory if it exists
     if os.path.exists("mesh"):
         import shutil
         shutil.rmtree("mesh")
 
 
-    robot_description = '<?xml version="1.0" ?>\n<robot name="test_robot">\n'
-    robot_description += Link("world", None).get_link_description()
-
-
-    srdf_description = '<?xml version="1.0" ?>\n'
-    srdf_description += '<robot name="test_robot">\n'
-    srdf_description += '\t<group name="arm">\n'
-
-    base_link = gen_link("base_link", list_of_length[0], 3, 3, 3, 0)
-    base_link.gen_mesh_file()
-    robot_description += Joint("world_joint", JointType.fixed, Link("world", None), base_link).get_joint_description()
-    robot_description += base_link.get_link_description()
-    srdf_description += Joint("world_joint", JointType.fixed, Link("world", None), base_link).get_joint_description_srdf()
-
-    links = [base_link]
-
-    for i in range(len(list_of_length)):
-        if i == 0: # Skip base link
-            continue
-        link_a = gen_link(f"link_{2*i-1}", 0, 3, 3, 3, 180)
-        link_a.gen_mesh_file()
-        links.append(link_a)
-        robot_description += link_a.get_link_description()
-        joint_previous_to_link_a = Joint(f"joint_{2*i-1}", JointType.revolute, links[2*i-2], link_a)
-        robot_description += joint_previous_to_link_a.get_joint_description()
-        srdf_description += joint_previous_to_link_a.get_joint_description_srdf()
-
-        link_b = gen_link(f"link_{2*i}", list_of_length[i], 3, 3, 3, 0)
-        link_b.gen_mesh_file()
-        links.append(link_b)
-        robot_description += link_b.get_link_description()
-        joint_previous_to_link_b = Joint(f"joint_{2*i}", JointType.revolute, link_a, link_b)
-        robot_description += joint_previous_to_link_b.get_joint_description()
-        srdf_description += joint_previous_to_link_b.get_joint_description_srdf()
-
-    link_7 = gen_link(f"link_{2*len(list_of_length)+1}", 0, 3, 3, 3, 180)
-    link_7.gen_mesh_file()
-    links.append(link_7)
-    robot_description += link_7.get_link_description()
-    joint_previous_to_link_7 = Joint(f"joint_{2*len(list_of_length)+1}", JointType.revolute, links[-2], link_7)
-    robot_description += joint_previous_to_link_7.get_joint_description()
-    srdf_description += joint_previous_to_link_7.get_joint_description_srdf()
-
-    link_ee = gen_ee_link(f"link_{2*len(list_of_length)+2}", 3, 2)
-    link_ee.gen_mesh_file()
-    links.append(link_ee)
-    robot_description += link_ee.get_link_description()
-    joint_previous_to_link_ee = Joint(f"joint_{2*len(list_of_length)+2}", JointType.revolute, links[-2], link_ee)
-    robot_description += joint_previous_to_link_ee.get_joint_description()
-    srdf_description += joint_previous_to_link_ee.get_joint_description_srdf()
-
-
-
-    robot_description += '</robot>'
-
-    srdf_description += '\t</group>\n'
-    srdf_description += f'\t<end_effector name="eef" parent_link="{links[-1].link_name}" group="arm"/>\n'
-    srdf_description += '\t<virtual_joint name="virtual_joint" type="fixed" parent_frame="world" child_link="base_link"/>\n'
-
-    for i in range(len(links) - 1):
-        srdf_description += f'\t<disable_collisions link1="{links[i].link_name}" link2="{links[i+1].link_name}" reason="Adjacent"/>\n'
-
-    srdf_description += '</robot>'
-
-    # Save the descriptions to files
-    with open('test_robot.urdf', 'w') as f:
-        f.write(robot_description)
-    with open('test_robot.srdf', 'w') as f:
-        f.write(srdf_description)
+    # 文字列を連結せず、要素ごとにファイルへ書き出す
+    from urdf_writer import RobotDescriptionWriter
+    writer = RobotDescriptionWriter('test_robot.urdf', 'test_robot.srdf', newline=None)
+    with writer:
+        writer.add_link(Link("world", None))
+
+        base_link = gen_link("base_link", list_of_length[0], 3, 3, 3, 0)
+        base_link.gen_mesh_file()
+        writer.add_joint(Joint("world_joint", JointType.fixed, Link("world", None), base_link))
+        writer.add_link(base_link)
+
+        links = [base_link]
+
+        for i in range(len(list_of_length)):
+            if i == 0: # Skip base link
+                continue
+            link_a = gen_link(f"link_{2*i-1}", 0, 3, 3, 3, 180)
+            link_a.gen_mesh_file()
+            links.append(link_a)
+            writer.add_link(link_a)
+            writer.add_joint(Joint(f"joint_{2*i-1}", JointType.revolute, links[2*i-2], link_a))
+
+            link_b = gen_link(f"link_{2*i}", list_of_length[i], 3, 3, 3, 0)
+            link_b.gen_mesh_file()
+            links.append(link_b)
+            writer.add_link(link_b)
+            writer.add_joint(Joint(f"joint_{2*i}", JointType.revolute, link_a, link_b))
+
+        link_7 = gen_link(f"link_{2*len(list_of_length)+1}", 0, 3, 3, 3, 180)
+        link_7.gen_mesh_file()
+        links.append(link_7)
+        writer.add_link(link_7)
+        writer.add_joint(Joint(f"joint_{2*len(list_of_length)+1}", JointType.revolute, links[-2], link_7))
+
+        link_ee = gen_ee_link(f"link_{2*len(list_of_length)+2}", 3, 2)
+        link_ee.gen_mesh_file()
+        links.append(link_ee)
+        writer.add_link(link_ee)
+        writer.add_joint(Joint(f"joint_{2*len(list_of_length)+2}", JointType.revolute, links[-2], link_ee))
+
+        writer.finish(end_effector_link=links[-1].link_name, base_link="base_link", adjacent_links=links)
 
 
 
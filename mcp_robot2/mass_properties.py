@@ -0,0 +1,226 @@
+import hashlib
+import io
+import math
+from itertools import combinations
+
+import numpy as np
+
+from mesh_cache import MeshCache, default_mesh_cache, make_cache_key
+
+# 中実の鋼材を想定した密度 [kg/m^3]
+DEFAULT_DENSITY = 7850.0
+
+
+def _rotation_about_axis(axis: np.ndarray, degrees: float) -> np.ndarray:
+    axis = np.asarray(axis, dtype=float)
+    axis = axis / np.linalg.norm(axis)
+    angle = math.radians(degrees)
+    k = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    return np.eye(3) + math.sin(angle) * k + (1 - math.cos(angle)) * (k @ k)
+
+
+def _shift_matrix(mass: float, offset: np.ndarray) -> np.ndarray:
+    # 平行軸の定理: 重心から offset だけ離れた点まわりの慣性テンソルとの差
+    offset = np.asarray(offset, dtype=float)
+    return mass * (np.dot(offset, offset) * np.eye(3) - np.outer(offset, offset))
+
+
+class MassProperties:
+    """
+    Mass, center of mass and inertia tensor (about the center of mass) of a solid.
+
+    The constructors return the properties of a unit-density solid, so a link generator can
+    describe its shape once and the density is applied with scaled(). translate() and rotate()
+    follow the conventions of cq.Workplane, so the properties can be built alongside the
+    geometry with the same operations. Solids combined with + must not overlap; - removes a
+    solid contained in the other one (e.g. the overlap of two boxes).
+    """
+
+    def __init__(self, mass: float = 0.0, center_of_mass: np.ndarray = np.zeros(3), inertia: np.ndarray = np.zeros((3, 3))):
+        self.mass = float(mass)
+        self.center_of_mass = np.asarray(center_of_mass, dtype=float)
+        self.inertia = np.asarray(inertia, dtype=float)
+
+    @classmethod
+    def box(cls, size) -> "MassProperties":
+        """Box centered at the origin, like cq.Workplane.box."""
+        x, y, z = size
+        mass = x * y * z
+        return cls(mass, np.zeros(3), mass / 12.0 * np.diag([y*y + z*z, x*x + z*z, x*x + y*y]))
+
+    @classmethod
+    def from_bounds(cls, lower, upper) -> "MassProperties":
+        """Axis-aligned box between two corners."""
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        return cls.box(upper - lower).translate((lower + upper) / 2.0)
+
+    @classmethod
+    def box_union(cls, bounds: list) -> "MassProperties":
+        """
+        Union of possibly overlapping axis-aligned boxes, given as (lower, upper) corners.
+
+        The overlaps are handled exactly by inclusion-exclusion, since the intersection of
+        axis-aligned boxes is again a box.
+        """
+        total = cls()
+        for count in range(1, len(bounds) + 1):
+            for subset in combinations(bounds, count):
+                lower = np.max([b[0] for b in subset], axis=0)
+                upper = np.min([b[1] for b in subset], axis=0)
+                if np.any(upper <= lower):
+                    continue
+                part = cls.from_bounds(lower, upper)
+                total = total + part if count % 2 == 1 else total - part
+        return total
+
+    @classmethod
+    def cylinder(cls, radius: float, length: float) -> "MassProperties":
+        """Cylinder along z from 0 to length, like Workplane("XY").circle(radius).extrude(length)."""
+        mass = math.pi * radius * radius * length
+        ixx = mass * (3 * radius * radius + length * length) / 12.0
+        return cls(mass, np.array([0, 0, length / 2.0]), np.diag([ixx, ixx, mass * radius * radius / 2.0]))
+
+    @classmethod
+    def half_cylinder(cls, radius: float, length: float) -> "MassProperties":
+        """The y >= 0 half of cylinder(radius, length)."""
+        mass = math.pi * radius * radius * length / 2.0
+        ixx = mass * (3 * radius * radius + length * length) / 12.0
+        # 軸の中点まわりの慣性テンソルから、重心まわりに移す
+        axis_center = np.array([0, 0, length / 2.0])
+        center_of_mass = np.array([0, 4 * radius / (3 * math.pi), length / 2.0])
+        inertia = np.diag([ixx, ixx, mass * radius * radius / 2.0]) - _shift_matrix(mass, center_of_mass - axis_center)
+        return cls(mass, center_of_mass, inertia)
+
+    @classmethod
+    def d_shape(cls, diameter: float, height: float) -> "MassProperties":
+        """Same solid as snake_link.make_d_shape."""
+        half_circle = cls.half_cylinder(diameter / 2, height)
+        rectangle = cls.box((diameter, diameter / 2, height)).translate((0, -diameter / 4, height / 2))
+        return (half_circle + rectangle).translate((0, diameter / 2, -height / 2))
+
+    @classmethod
+    def torus_sector(cls, major_radius: float, minor_radius: float, angle: float) -> "MassProperties":
+        """
+        Part of a torus around the z axis, centered at the origin, between the angles 0 and
+        angle (radians) measured from the x axis.
+        """
+        R, a = major_radius, minor_radius
+        # 断面上の積分: ∫ρ dA, ∫ρ^2 dA, ∫ρ^3 dA, ∫z^2 ρ dA (ρは z 軸からの距離)
+        s1 = math.pi * a * a * R
+        s2 = math.pi * a * a * (R * R + a * a / 4.0)
+        s3 = s1 * (R * R + 3.0 * a * a / 4.0)
+        sz = s1 * a * a / 4.0
+        mass = s1 * angle
+        center_of_mass = np.array([s2 * math.sin(angle), s2 * (1 - math.cos(angle)), 0.0]) / mass
+        xx = s3 * (angle / 2.0 + math.sin(2 * angle) / 4.0)
+        yy = s3 * (angle / 2.0 - math.sin(2 * angle) / 4.0)
+        xy = s3 * math.sin(angle) ** 2 / 2.0
+        zz = sz * angle
+        inertia_at_origin = np.array([
+            [yy + zz, -xy, 0.0],
+            [-xy, xx + zz, 0.0],
+            [0.0, 0.0, xx + yy],
+        ])
+        return cls(mass, center_of_mass, inertia_at_origin - _shift_matrix(mass, center_of_mass))
+
+    def translate(self, xyz) -> "MassProperties":
+        return MassProperties(self.mass, self.center_of_mass + np.asarray(xyz, dtype=float), self.inertia)
+
+    def rotate(self, axis_start, axis_end, degrees: float) -> "MassProperties":
+        """Rotate about the axis through axis_start and axis_end, like cq.Workplane.rotate."""
+        axis_start = np.asarray(axis_start, dtype=float)
+        rotation = _rotation_about_axis(np.asarray(axis_end, dtype=float) - axis_start, degrees)
+        return MassProperties(self.mass, axis_start + rotation @ (self.center_of_mass - axis_start), rotation @ self.inertia @ rotation.T)
+
+    def _combine(self, other: "MassProperties", sign: float) -> "MassProperties":
+        mass = self.mass + sign * other.mass
+        if mass == 0:
+            return MassProperties()
+        center_of_mass = (self.mass * self.center_of_mass + sign * other.mass * other.center_of_mass) / mass
+        inertia = self.inertia + _shift_matrix(self.mass, self.center_of_mass - center_of_mass) \
+            + sign * (other.inertia + _shift_matrix(other.mass, other.center_of_mass - center_of_mass))
+        return MassProperties(mass, center_of_mass, inertia)
+
+    def __add__(self, other: "MassProperties") -> "MassProperties":
+        return self._combine(other, 1.0)
+
+    def __sub__(self, other: "MassProperties") -> "MassProperties":
+        return self._combine(other, -1.0)
+
+    def scaled(self, density: float) -> "MassProperties":
+        return MassProperties(self.mass * density, self.center_of_mass, self.inertia * density)
+
+    @property
+    def inertia_vector(self) -> np.ndarray:
+        """[ixx, ixy, ixz, iyy, iyz, izz] as in the URDF <inertia> element."""
+        i = self.inertia
+        return np.array([i[0, 0], i[0, 1], i[0, 2], i[1, 1], i[1, 2], i[2, 2]])
+
+    def to_dict(self) -> dict:
+        return {"mass": self.mass, "center_of_mass": self.center_of_mass.tolist(), "inertia": self.inertia.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MassProperties":
+        return cls(data["mass"], np.array(data["center_of_mass"]), np.array(data["inertia"]))
+
+
+def occt_mass_properties(geometry) -> MassProperties:
+    """Unit-density mass properties of a cadquery shape or Workplane, computed by OCCT (slow)."""
+    import cadquery as cq
+    from OCP.BRepGProp import BRepGProp
+    from OCP.GProp import GProp_GProps
+
+    if isinstance(geometry, cq.Workplane):
+        geometry = cq.Compound.makeCompound([v for v in geometry.vals() if isinstance(v, cq.Shape)])
+    props = GProp_GProps()
+    BRepGProp.VolumeProperties_s(geometry.wrapped, props)
+    if props.Mass() == 0:
+        return MassProperties()
+    center = props.CentreOfMass()
+    matrix = props.MatrixOfInertia()
+    inertia = np.array([[matrix.Value(r, c) for c in range(1, 4)] for r in range(1, 4)])
+    return MassProperties(props.Mass(), np.array([center.X(), center.Y(), center.Z()]), inertia)
+
+
+def shape_hash(link) -> str|None:
+    """Key of the OCCT result cache: the generator inputs if known, else the BRep of the shape."""
+    if link.generator_name is not None:
+        return make_cache_key(link.generator_name, link.generator_params, properties="mass")
+    if not link.has_geometry:
+        return None
+    import cadquery as cq
+
+    geometry = link.link_geometry
+    if isinstance(geometry, cq.Workplane):
+        geometry = cq.Compound.makeCompound([v for v in geometry.vals() if isinstance(v, cq.Shape)])
+    stream = io.BytesIO()
+    geometry.exportBrep(stream)
+    return hashlib.sha256(stream.getvalue()).hexdigest()
+
+
+def compute_link_inertias(links: list, density: float = DEFAULT_DENSITY, mesh_cache: MeshCache = default_mesh_cache) -> None:
+    """
+    Set mass, center_of_mass and inertia_vector of all links of a robot in one pass.
+
+    Links whose generator describes its solid analytically (link.mass_properties) are
+    computed without OCCT. The others are measured with OCCT once per shape and the result
+    is kept in mesh_cache, so an unchanged link costs a JSON read on the next build.
+    """
+    for link in links:
+        if link is None:
+            continue
+        properties = link.mass_properties
+        if properties is None:
+            key = shape_hash(link)
+            if key is None:
+                continue
+            cached = mesh_cache.load_json(key, suffix=".mass.json")
+            if cached is not None:
+                properties = MassProperties.from_dict(cached)
+            elif not link.has_geometry:
+                continue
+            else:
+                properties = occt_mass_properties(link.link_geometry)
+                mesh_cache.store_json(key, properties.to_dict(), suffix=".mass.json")
+        link.set_mass_properties(properties, density)
@@ -0,0 +1,194 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+from enum import Enum
+
+import numpy as np
+
+# キャッシュの形式を変えたときはこの値を上げて、古いエントリを無効にする
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mesh_cache")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+# 合計サイズの見積もりは他のプロセスの追加を知らないので、この回数の追加ごとに数え直す
+EVICT_RESCAN_INTERVAL = 64
+
+# 登録されたジェネレータ名 -> ジェネレータのコードのハッシュ（register_generator_code）
+GENERATOR_CODE_HASHES = {}
+
+
+def to_jsonable(value: object) -> object:
+    """Convert generator parameters (numpy arrays, enums, tuples) into JSON-serializable values."""
+    if isinstance(value, np.ndarray):
+        return [to_jsonable(v) for v in value.tolist()]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, float):
+        # -0.0 と 0.0 を同じキーにする
+        return value + 0.0
+    return value
+
+
+def code_hash(func) -> str:
+    """
+    Hash the code of a generator function.
+
+    The whole source file that defines func is hashed, so that changes of the helper
+    functions it calls also give new keys. Falls back to the bytecode of func when the
+    source is not available.
+    """
+    try:
+        with open(inspect.getsourcefile(func), 'rb') as f:
+            data = f.read()
+    except (TypeError, OSError):
+        data = func.__code__.co_code
+    return hashlib.sha256(data).hexdigest()
+
+
+def register_generator_code(func) -> None:
+    """Include the code of the generator func in the keys of make_cache_key for its name."""
+    GENERATOR_CODE_HASHES[func.__name__] = code_hash(func)
+
+
+def make_cache_key(generator_name: str, generator_params: dict, **export_options) -> str:
+    """
+    Compute the content address of a generated mesh.
+
+    The key also covers the code of the generator if it was registered with
+    register_generator_code (link_and_joint_class.link_generator does this), so editing
+    a generator invalidates its entries without bumping CACHE_VERSION.
+
+    Args:
+        generator_name: name of the link generator function (e.g. "gen_horizontal_link")
+        generator_params: arguments passed to the generator, without the link name
+        export_options: options that change the exported file (tolerance, format, ...)
+
+    Returns:
+        str: sha256 hex digest identifying the mesh
+    """
+    payload = {
+        "version": CACHE_VERSION,
+        "generator": generator_name,
+        "code": GENERATOR_CODE_HASHES.get(generator_name),
+        "params": to_jsonable(generator_params),
+        "export": to_jsonable(export_options),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class MeshCache:
+    """
+    Persistent, size-bounded cache of exported mesh files.
+
+    Entries are stored as <cache_dir>/<key[:2]>/<key><suffix>. The modification time of an
+    entry is refreshed on every hit, and the least recently used entries are evicted once
+    the total size exceeds max_bytes. The total size is counted once and then kept up to
+    date by the stores of this process; the cache directory is only scanned again when the
+    total exceeds max_bytes or every EVICT_RESCAN_INTERVAL stores.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._total_bytes = None
+        self._stores = 0
+
+    def path_for(self, key: str, suffix: str = ".stl") -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}{suffix}")
+
+    def fetch(self, key: str, dest: str, suffix: str = ".stl") -> bool:
+        """Copy the cached file to dest. Returns False on a cache miss."""
+        cached = self.path_for(key, suffix)
+        if not os.path.isfile(cached):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        shutil.copyfile(cached, dest)
+        # LRU管理のため、ヒットしたエントリの更新時刻を現在時刻にする
+        os.utime(cached)
+        return True
+
+    def store(self, key: str, src: str, suffix: str = ".stl") -> None:
+        """Add the file src to the cache, then evict old entries if the cache is too large."""
+        cached = self.path_for(key, suffix)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        # 別プロセスが同じキーを読んでいても壊れたファイルが見えないよう、一時ファイル経由で置き換える
+        tmp_path = f"{cached}.{os.getpid()}.tmp"
+        shutil.copyfile(src, tmp_path)
+        self._replace(tmp_path, cached)
+
+    def load_json(self, key: str, suffix: str = ".json") -> dict|None:
+        """Read a JSON entry (e.g. metadata of a multi-file entry). Returns None on a cache miss."""
+        cached = self.path_for(key, suffix)
+        try:
+            with open(cached, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(cached)
+        return data
+
+    def store_json(self, key: str, data: dict, suffix: str = ".json") -> None:
+        cached = self.path_for(key, suffix)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_path = f"{cached}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        self._replace(tmp_path, cached)
+
+    def _replace(self, tmp_path: str, cached: str) -> None:
+        # 置き換えるエントリの分を差し引いて合計サイズを更新する
+        added = os.path.getsize(tmp_path)
+        try:
+            added -= os.path.getsize(cached)
+        except OSError:
+            pass
+        os.replace(tmp_path, cached)
+        self._stores += 1
+        if self._total_bytes is not None:
+            self._total_bytes += added
+        if self._total_bytes is None or self._total_bytes > self.max_bytes or self._stores % EVICT_RESCAN_INTERVAL == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Scan the cache and delete least recently used entries until it fits in max_bytes."""
+        entries = []
+        total_bytes = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        if total_bytes > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total_bytes -= size
+                if total_bytes <= self.max_bytes:
+                    break
+        self._total_bytes = total_bytes
+
+    def clear(self) -> None:
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        self._total_bytes = 0
+
+
+default_mesh_cache = MeshCache()
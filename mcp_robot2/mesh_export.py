@@ -0,0 +1,259 @@
+import base64
+import json
+import math
+import os
+import struct
+
+import numpy as np
+
+
+class TriangleMesh:
+    """
+    Tessellated shape as a vertex/index buffer.
+
+    A shape is tessellated once with from_shape, and the buffer can then be written in any
+    format registered in MESH_WRITERS without another OCCT pass.
+    """
+
+    def __init__(self, vertices: np.ndarray, triangles: np.ndarray):
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+
+    @classmethod
+    def from_shape(cls, geometry, tolerance: float = 0.1, angular_tolerance: float = 0.1) -> "TriangleMesh":
+        """
+        Tessellate a cadquery shape or Workplane.
+
+        Args:
+            geometry: cq.Workplane or cq.Shape
+            tolerance: linear deflection, same meaning as in cq.exporters.export
+            angular_tolerance: angular deflection in radians
+        """
+        import cadquery as cq
+
+        if isinstance(geometry, cq.Workplane):
+            shape = cq.Compound.makeCompound([v for v in geometry.vals() if isinstance(v, cq.Shape)])
+        else:
+            shape = geometry
+        vertices, triangles = shape.tessellate(tolerance, angular_tolerance)
+        if len(triangles) == 0:
+            return cls(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+        return cls(np.array([v.toTuple() for v in vertices]), np.array(triangles))
+
+    def face_normals(self) -> np.ndarray:
+        v0, v1, v2 = (self.vertices[self.triangles[:, i]] for i in range(3))
+        normals = np.cross(v1 - v0, v2 - v0)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        return normals / np.where(lengths > 0, lengths, 1.0)
+
+    def vertex_normals(self) -> np.ndarray:
+        # 面積で重み付けした面法線を頂点ごとに足し合わせる
+        v0, v1, v2 = (self.vertices[self.triangles[:, i]] for i in range(3))
+        weighted = np.cross(v1 - v0, v2 - v0)
+        normals = np.zeros_like(self.vertices)
+        for i in range(3):
+            np.add.at(normals, self.triangles[:, i], weighted)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        return normals / np.where(lengths > 0, lengths, 1.0)
+
+
+def write_stl(mesh: TriangleMesh, path: str, ascii: bool = False) -> None:
+    """Write the mesh as STL (binary by default)."""
+    normals = mesh.face_normals()
+    corners = mesh.vertices[mesh.triangles]
+    if ascii:
+        with open(path, 'w') as f:
+            f.write("solid mesh\n")
+            for n, (a, b, c) in zip(normals, corners):
+                f.write(f"facet normal {n[0]:e} {n[1]:e} {n[2]:e}\n outer loop\n")
+                for p in (a, b, c):
+                    f.write(f"  vertex {p[0]:e} {p[1]:e} {p[2]:e}\n")
+                f.write(" endloop\nendfacet\n")
+            f.write("endsolid mesh\n")
+        return
+
+    record = np.dtype([("normal", "<f4", 3), ("corners", "<f4", (3, 3)), ("attribute", "<u2")])
+    data = np.zeros(len(mesh.triangles), dtype=record)
+    data["normal"] = normals
+    data["corners"] = corners
+    with open(path, 'wb') as f:
+        f.write(b"binary STL written by mesh_export".ljust(80, b"\0"))
+        f.write(struct.pack("<I", len(data)))
+        f.write(data.tobytes())
+
+
+def write_obj(mesh: TriangleMesh, path: str, precision: int = 6) -> None:
+    """Write the mesh as Wavefront OBJ."""
+    with open(path, 'w') as f:
+        np.savetxt(f, mesh.vertices, fmt=f"v %.{precision}f %.{precision}f %.{precision}f")
+        # OBJのインデックスは1始まり
+        np.savetxt(f, mesh.triangles + 1, fmt="f %d %d %d")
+
+
+# glTFはY軸が上向き。Z-upのCAD座標を(x, z, -y)に変換する
+Z_UP_TO_Y_UP = np.array([[1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, -1.0, 0.0]])
+
+
+def _quaternion(rotation: np.ndarray) -> list[float]:
+    """Unit quaternion [x, y, z, w] (glTF order) of a rotation matrix."""
+    r = rotation
+    trace = r[0, 0] + r[1, 1] + r[2, 2]
+    # 180度付近でも桁落ちしないよう、最も大きい成分から求める
+    if trace > max(r[0, 0], r[1, 1], r[2, 2]):
+        s = 2.0 * math.sqrt(1.0 + trace)
+        x, y, z, w = (r[2, 1] - r[1, 2]) / s, (r[0, 2] - r[2, 0]) / s, (r[1, 0] - r[0, 1]) / s, s / 4.0
+    elif r[0, 0] >= r[1, 1] and r[0, 0] >= r[2, 2]:
+        s = 2.0 * math.sqrt(1.0 + r[0, 0] - r[1, 1] - r[2, 2])
+        x, y, z, w = s / 4.0, (r[0, 1] + r[1, 0]) / s, (r[0, 2] + r[2, 0]) / s, (r[2, 1] - r[1, 2]) / s
+    elif r[1, 1] >= r[2, 2]:
+        s = 2.0 * math.sqrt(1.0 - r[0, 0] + r[1, 1] - r[2, 2])
+        x, y, z, w = (r[0, 1] + r[1, 0]) / s, s / 4.0, (r[1, 2] + r[2, 1]) / s, (r[0, 2] - r[2, 0]) / s
+    else:
+        s = 2.0 * math.sqrt(1.0 - r[0, 0] - r[1, 1] + r[2, 2])
+        x, y, z, w = (r[0, 2] + r[2, 0]) / s, (r[1, 2] + r[2, 1]) / s, s / 4.0, (r[1, 0] - r[0, 1]) / s
+    return [float(x), float(y), float(z), float(w)]
+
+
+def _node_transform(transform: np.ndarray) -> dict:
+    # 剛体変換は translation/rotation で書く（matrix より短い）。それ以外は matrix（列優先）
+    rotation = transform[:3, :3]
+    if not np.allclose(transform[3], [0, 0, 0, 1]) or not np.allclose(rotation @ rotation.T, np.eye(3)) or np.linalg.det(rotation) < 0:
+        return {"matrix": transform.T.ravel().tolist()}
+    node = {}
+    if not np.allclose(transform[:3, 3], 0):
+        node["translation"] = transform[:3, 3].tolist()
+    if not np.allclose(rotation, np.eye(3)):
+        node["rotation"] = _quaternion(rotation)
+    return node
+
+
+def _gltf_scene_document(meshes: list[TriangleMesh], nodes: list[dict], y_up: bool) -> tuple[dict, bytes]:
+    # メッシュごとに位置・法線・インデックスの順でバッファに並べる
+    buffer = b""
+    buffer_views = []
+    accessors = []
+    gltf_meshes = []
+    for mesh in meshes:
+        positions = mesh.vertices
+        normals = mesh.vertex_normals()
+        if y_up:
+            positions = positions[:, [0, 2, 1]] * np.array([1.0, 1.0, -1.0])
+            normals = normals[:, [0, 2, 1]] * np.array([1.0, 1.0, -1.0])
+        positions = positions.astype("<f4")
+        normals = normals.astype("<f4")
+        indices = mesh.triangles.astype("<u4").ravel()
+        first = len(accessors)
+        for data, target in ((positions, 34962), (normals, 34962), (indices, 34963)):
+            buffer_views.append({"buffer": 0, "byteOffset": len(buffer), "byteLength": data.nbytes, "target": target})
+            buffer += data.tobytes()
+        accessors += [
+            {"bufferView": first, "componentType": 5126, "count": len(positions), "type": "VEC3",
+             "min": positions.min(axis=0).tolist() if len(positions) else [0, 0, 0],
+             "max": positions.max(axis=0).tolist() if len(positions) else [0, 0, 0]},
+            {"bufferView": first + 1, "componentType": 5126, "count": len(normals), "type": "VEC3"},
+            {"bufferView": first + 2, "componentType": 5125, "count": len(indices), "type": "SCALAR"},
+        ]
+        gltf_meshes.append({"primitives": [{"attributes": {"POSITION": first, "NORMAL": first + 1}, "indices": first + 2, "mode": 4}]})
+
+    document = {
+        "asset": {"version": "2.0", "generator": "mcp_robot2 mesh_export"},
+        "scene": 0,
+        "scenes": [{"nodes": list(range(len(nodes)))}],
+        "nodes": nodes,
+        "meshes": gltf_meshes,
+        "buffers": [{"byteLength": len(buffer)}],
+        "bufferViews": buffer_views,
+        "accessors": accessors,
+    }
+    return document, buffer
+
+
+def _gltf_document(mesh: TriangleMesh, y_up: bool) -> tuple[dict, bytes]:
+    return _gltf_scene_document([mesh], [{"mesh": 0}], y_up)
+
+
+def _write_glb_document(document: dict, buffer: bytes, path: str) -> None:
+    json_chunk = json.dumps(document, separators=(",", ":")).encode("utf-8")
+    # チャンクは4バイト境界に揃える（JSONは空白、バイナリは0で埋める）
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    buffer += b"\0" * (-len(buffer) % 4)
+    total_length = 12 + 8 + len(json_chunk) + 8 + len(buffer)
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<III", 0x46546C67, 2, total_length))
+        f.write(struct.pack("<II", len(json_chunk), 0x4E4F534A))
+        f.write(json_chunk)
+        f.write(struct.pack("<II", len(buffer), 0x004E4942))
+        f.write(buffer)
+
+
+def write_glb(mesh: TriangleMesh, path: str, y_up: bool = True) -> None:
+    """Write the mesh as binary glTF (GLB)."""
+    document, buffer = _gltf_document(mesh, y_up)
+    _write_glb_document(document, buffer, path)
+
+
+def write_glb_scene(meshes: dict[str, TriangleMesh], instances: list[tuple[str, str, np.ndarray]], path: str, y_up: bool = True) -> None:
+    """
+    Write one GLB scene in which each mesh is stored once and placed by any number of nodes.
+
+    Args:
+        meshes: {mesh name: mesh}
+        instances: (node name, mesh name, 4x4 transform in the CAD frame) per node
+        path: output file name
+        y_up: convert the Z-up CAD frame to the Y-up glTF frame, as write_glb
+
+    glTF is right-handed. Unity's glTF importer (glTFast) mirrors the X axis, so a node
+    rotated by +θ about the glTF +Y axis appears in Unity with Quaternion.Euler(0, -θ, 0).
+    """
+    names = list(meshes)
+    unknown = sorted({mesh_name for _, mesh_name, _ in instances} - set(names))
+    if unknown:
+        raise ValueError(f"Instances refer to unknown meshes: {', '.join(unknown)}")
+    nodes = []
+    for node_name, mesh_name, transform in instances:
+        transform = np.asarray(transform, dtype=float)
+        if y_up:
+            # 頂点と同じ座標変換を姿勢にもかける
+            frame = np.eye(4)
+            frame[:3, :3] = Z_UP_TO_Y_UP
+            transform = frame @ transform @ frame.T
+        nodes.append({"name": node_name, "mesh": names.index(mesh_name), **_node_transform(transform)})
+    document, buffer = _gltf_scene_document([meshes[name] for name in names], nodes, y_up)
+    for mesh, name in zip(document["meshes"], names):
+        mesh["name"] = name
+    _write_glb_document(document, buffer, path)
+
+
+def write_gltf(mesh: TriangleMesh, path: str, y_up: bool = True) -> None:
+    """Write the mesh as glTF JSON with the buffer embedded as a data URI."""
+    document, buffer = _gltf_document(mesh, y_up)
+    document["buffers"][0]["uri"] = "data:application/octet-stream;base64," + base64.b64encode(buffer).decode("ascii")
+    with open(path, 'w') as f:
+        json.dump(document, f)
+
+
+MESH_WRITERS = {
+    "stl": write_stl,
+    "obj": write_obj,
+    "glb": write_glb,
+    "gltf": write_gltf,
+}
+
+
+def export_mesh(mesh: TriangleMesh, path: str, file_format: str|None = None, **options) -> None:
+    """
+    Write a tessellated mesh to path.
+
+    Args:
+        mesh: the vertex/index buffer
+        path: output file name
+        file_format: one of MESH_WRITERS. Defaults to the extension of path.
+        options: format specific options (ascii for stl, precision for obj, y_up for glb/gltf)
+    """
+    if file_format is None:
+        file_format = os.path.splitext(path)[1].lstrip(".")
+    file_format = file_format.lower()
+    if file_format not in MESH_WRITERS:
+        raise ValueError(f"Unsupported mesh format: {file_format}. Supported formats are {', '.join(MESH_WRITERS)}.")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    MESH_WRITERS[file_format](mesh, path, **options)
@@ -0,0 +1,159 @@
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from link_and_joint_class import Link
+from build_manifest import BuildManifest
+from mass_properties import DEFAULT_DENSITY, compute_link_inertias
+from mesh_cache import make_cache_key
+from build_requests import BuildProgress, CancelFlag
+from worker_pool import worker_cpu_share
+
+_executor = None
+
+
+def get_executor(max_workers: int|None = None) -> ProcessPoolExecutor:
+    """Get the process pool shared by all parallel builds, creating it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Stop the process pool of the parallel builds. The next get_executor creates a new one."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+@contextmanager
+def build_executor(max_workers: int|None = None):
+    """
+    Get a process pool for one parallel build or sweep.
+
+    In the parent process this is the shared pool of get_executor. In a worker of
+    worker_pool (an MCP tool running in run_in_worker) a pool of the worker's share of the
+    CPUs is created for the block and shut down when it ends, so the workers never keep
+    pools of their own and do not start cpu_count processes each.
+
+    Usage:
+        with build_executor(max_workers) as executor:
+            futures = [executor.submit(func, item) for item in items]
+    """
+    share = worker_cpu_share()
+    if share is None:
+        yield get_executor(max_workers)
+        return
+    with ProcessPoolExecutor(max_workers=min(max_workers or share, share)) as executor:
+        yield executor
+
+
+def _shape_groups(link_specs: list) -> list[tuple]:
+    """Group the link specs that call the same generator with the same arguments (apart from link_name)."""
+    groups = {}
+    for index, (generator, params) in enumerate(link_specs):
+        key = make_cache_key(generator.__name__, {k: v for k, v in params.items() if k != "link_name"})
+        groups.setdefault(key, (generator, params, []))[2].append(index)
+    return list(groups.values())
+
+
+def _links_of_shape(link: Link, link_names: list[str]) -> list[Link]:
+    # 同じ形状のリンクは一度だけ生成し、名前だけ変えた複製を使う
+    links = [link]
+    for name in link_names[1:]:
+        duplicate = copy.copy(link)
+        duplicate.link_name = name
+        links.append(duplicate)
+    return links
+
+
+def _build_links_in_worker(generator, params: dict, link_names: list[str], targetdir: str, mesh_options: dict, density: float,
+                           progress: BuildProgress|None = None) -> list[tuple]:
+    """Run a link generator, compute its inertia and export the meshes of every link of that shape in a worker process."""
+    link = generator(**params)
+    compute_link_inertias([link], density)
+    # ワーカーごとにマニフェストを読み直す。保存は親プロセスがまとめて行う
+    manifest = BuildManifest(targetdir, mesh_options)
+    results = []
+    for shaped_link in _links_of_shape(link, link_names):
+        rebuilt = manifest.update_link_mesh(shaped_link, progress.link_steps(shaped_link.link_name) if progress is not None else None)
+        results.append((shaped_link, manifest.links.get(shaped_link.link_name), rebuilt))
+    # OCCT shapes cannot be sent back to the parent process. The mesh is already on disk.
+    for shaped_link, _, _ in results:
+        shaped_link.link_geometry = None
+    return results
+
+
+def build_links(link_specs: list, manifest: BuildManifest, parallel: bool = False, max_workers: int|None = None, density: float = DEFAULT_DENSITY,
+                cancel: CancelFlag|None = None, progress: BuildProgress|None = None, on_link=None) -> list[Link]:
+    """
+    Generate the links and their mesh files.
+
+    Links with the same generator and arguments (apart from link_name) are generated once
+    and share the geometry.
+
+    Args:
+        link_specs: list of (generator, kwargs) tuples, in chain order
+        manifest: manifest of the previous build in the target directory
+        parallel: if True, each distinct shape is generated and exported in a worker process.
+            Workers receive the generator arguments, not OCCT shapes, and the returned links
+            carry no geometry (only their mesh file names).
+        max_workers: size of the process pool, defaults to the number of CPUs (see build_executor)
+        density: density of the link material, for the URDF <inertial> elements
+        cancel: checked before each shape; BuildCancelled is raised when it is set
+        progress: receives the geometry/tessellation/export/collision steps of each link
+        on_link: called with each link and its manifest entry (None without geometry) as soon as
+            its mesh files are in manifest.targetdir, in chain order when serial and in
+            completion order when parallel
+
+    Returns:
+        list[Link]: the generated links, in the same order as link_specs
+    """
+    groups = _shape_groups(link_specs)
+    if not parallel:
+        links = [None] * len(link_specs)
+        for generator, params, indices in groups:
+            if cancel is not None:
+                cancel.check()
+            link_names = [link_specs[index][1].get("link_name") for index in indices]
+            for index, shaped_link in zip(indices, _links_of_shape(generator(**params), link_names)):
+                links[index] = shaped_link
+        compute_link_inertias(links, density)
+        for link in links:
+            # 形状はメッシュを書き出すときに作られるので、ここでも確認する
+            if cancel is not None:
+                cancel.check()
+            manifest.update_link_mesh(link, progress.link_steps(link.link_name) if progress is not None else None)
+            if on_link is not None:
+                on_link(link, manifest.links.get(link.link_name))
+        return links
+
+    with build_executor(max_workers) as executor:
+        futures = {}
+        for generator, params, indices in groups:
+            link_names = [link_specs[index][1].get("link_name") for index in indices]
+            futures[executor.submit(_build_links_in_worker, generator, params, link_names, manifest.targetdir, manifest.mesh_options, density, progress)] = indices
+        results = [None] * len(link_specs)
+        # 終わった形状から受け取り、on_link で順に公開できるようにする
+        for future in as_completed(futures):
+            if cancel is not None and cancel.is_set():
+                # まだ始まっていない形状は取り消す。実行中のものは終わるまで待つ（書き出し途中のファイルを残さない）
+                for pending in futures:
+                    pending.cancel()
+                for pending in futures:
+                    if not pending.cancelled():
+                        pending.exception()
+                cancel.check()
+            for index, result in zip(futures[future], future.result()):
+                results[index] = result
+                if on_link is not None:
+                    on_link(result[0], result[1])
+    # 結果はリンクの順序どおりに登録し、URDFのリンク順序を保つ
+    links = []
+    for link, entry, rebuilt in results:
+        manifest.merge_link(link.link_name, entry, rebuilt)
+        links.append(link)
+    return links
@@ -0,0 +1,318 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from build_manifest import file_sha256
+
+PUBLISH_MANIFEST_FILENAME = "publish_manifest.json"
+# バージョンディレクトリのうち、targetdir に公開されているものを記録するファイル
+CURRENT_VERSION_FILENAME = "current"
+# 使われていないバージョンはこの数を超えたら古い順に消す
+DEFAULT_MAX_VERSIONS = 16
+# publish_manifest.json より前の生成器が書いたファイル（ディレクトリ, ファイル名）
+LEGACY_FILE_PATTERNS = (
+    ("mesh", re.compile(r"[^.]+\.stl")),
+    ("collision", re.compile(r"[^.]+_col\.stl")),
+    ("", re.compile(r"temporary_robot\.[^.]+")),
+)
+
+
+def versions_dir_for(targetdir: str) -> str:
+    """
+    Get the directory that keeps the complete builds of targetdir, one subdirectory per version.
+
+    It is a sibling whose name starts with '.', so Unity does not import it.
+    """
+    targetdir = os.path.abspath(targetdir)
+    return os.path.join(os.path.dirname(targetdir), f".{os.path.basename(targetdir)}.versions")
+
+
+def version_name(key: str) -> str:
+    """Directory name of the build whose content hash (build plan key) is key."""
+    return key[:16]
+
+
+def version_dir_for(targetdir: str, key: str) -> str:
+    return os.path.join(versions_dir_for(targetdir), version_name(key))
+
+
+def current_version(targetdir: str) -> str|None:
+    """Name of the version published in targetdir, or None."""
+    try:
+        with open(os.path.join(versions_dir_for(targetdir), CURRENT_VERSION_FILENAME), 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def current_build_dir(targetdir: str) -> str:
+    """Directory of the version published in targetdir (its meshes, URDF and build manifest)."""
+    version = current_version(targetdir)
+    if version is None:
+        raise ValueError(f"No robot has been built into {targetdir} yet.")
+    return os.path.join(versions_dir_for(targetdir), version)
+
+
+def switch_current_version(targetdir: str, key: str) -> None:
+    """Atomically record the version of key as the one published in targetdir."""
+    versions_dir = versions_dir_for(targetdir)
+    content = version_name(key).encode("utf-8")
+    _replace_durably(lambda f: f.write(content), os.path.join(versions_dir, CURRENT_VERSION_FILENAME))
+    fsync_dir(versions_dir)
+    # LRUの管理のため、使われたバージョンの更新時刻を現在時刻にする
+    os.utime(os.path.join(versions_dir, version_name(key)))
+
+
+def begin_version(targetdir: str, key: str) -> str:
+    """
+    Create the directory a new version of targetdir is built into.
+
+    The directory is a copy of the current version, so the BuildManifest of the new build
+    sees the meshes of the previous one and only rebuilds the changed links. The new
+    version becomes visible under its name only with commit_version.
+
+    Returns:
+        str: the temporary build directory
+    """
+    build_dir = f"{version_dir_for(targetdir, key)}.{os.getpid()}.tmp"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    version = current_version(targetdir)
+    current_dir = os.path.join(versions_dir_for(targetdir), version) if version is not None else None
+    if current_dir is not None and os.path.isdir(current_dir):
+        # ハードリンクにすると上書きで元のバージョンが壊れるので、コピーする
+        shutil.copytree(current_dir, build_dir)
+    else:
+        os.makedirs(build_dir)
+    return build_dir
+
+
+def commit_version(build_dir: str, targetdir: str, key: str) -> str:
+    """
+    Rename a finished build directory of begin_version to its version name.
+
+    If another build of the same key committed first, its directory is kept and build_dir
+    is deleted.
+
+    Returns:
+        str: the version directory
+    """
+    version_dir = version_dir_for(targetdir, key)
+    try:
+        os.rename(build_dir, version_dir)
+    except OSError:
+        if not os.path.isdir(version_dir):
+            raise
+        shutil.rmtree(build_dir, ignore_errors=True)
+    fsync_dir(os.path.dirname(version_dir))
+    return version_dir
+
+
+def collect_versions(targetdir: str, max_versions: int = DEFAULT_MAX_VERSIONS) -> list[str]:
+    """
+    Delete the least recently used versions of targetdir until at most max_versions remain.
+
+    The current version and the directories of running builds are never deleted.
+
+    Returns:
+        list[str]: names of the deleted versions
+    """
+    versions_dir = versions_dir_for(targetdir)
+    current = current_version(targetdir)
+    try:
+        names = [name for name in os.listdir(versions_dir) if os.path.isdir(os.path.join(versions_dir, name)) and not name.endswith(".tmp")]
+    except FileNotFoundError:
+        return []
+    names.sort(key=lambda name: os.stat(os.path.join(versions_dir, name)).st_mtime, reverse=True)
+    removed = []
+    for name in names[max_versions:]:
+        if name == current:
+            continue
+        shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+        removed.append(name)
+    return removed
+
+
+def fsync_dir(path: str) -> None:
+    """Flush a directory entry (renames) to disk. Windows cannot open directories, so this is a no-op there."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _replace_durably(write, path: str) -> None:
+    # 一時ファイルに書き込んでfsyncしてから置き換えるので、読み手には古い内容か新しい内容しか見えない
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_publish_manifest(targetdir: str) -> dict:
+    path = os.path.join(targetdir, PUBLISH_MANIFEST_FILENAME)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def _files_without_manifest(targetdir: str) -> list[str]:
+    """
+    Files that the generator wrote to targetdir before it had a publish manifest.
+
+    Only the files of LEGACY_FILE_PATTERNS count: mesh/<link>.stl, collision/<link>_col.stl
+    (links that now have several hulls or primitive collisions) and temporary_robot.*.
+    """
+    found = []
+    for directory, pattern in LEGACY_FILE_PATTERNS:
+        try:
+            names = os.listdir(os.path.join(targetdir, directory))
+        except FileNotFoundError:
+            continue
+        found.extend(f"{directory}/{name}" if directory else name for name in sorted(names)
+                     if pattern.fullmatch(name) and os.path.isfile(os.path.join(targetdir, directory, name)))
+    return found
+
+
+def _remove_published_file(targetdir: str, name: str) -> None:
+    """Delete a published file together with what Unity made of it (.meta, the mesh prefab and its <stem>_<i>.asset meshes)."""
+    path = os.path.join(targetdir, name)
+    directory, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    imported = re.compile(rf"{re.escape(stem)}(\.prefab|_\d+\.asset)(\.meta)?")
+    companions = [f"{filename}.meta", *(other for other in os.listdir(directory) if imported.fullmatch(other))]
+    for other in [filename, *companions]:
+        try:
+            os.remove(os.path.join(directory, other))
+        except FileNotFoundError:
+            pass
+
+
+def publish_files(build_dir: str, targetdir: str, files: list[str]) -> list[str]:
+    """
+    Publish finished files of a build that is still running (progressive publishing).
+
+    The files are replaced durably like in publish, but neither the entry point nor
+    publish_manifest.json is touched: a consumer that only follows the manifest still sees
+    complete builds, and one that wants early feedback can load the meshes as they appear.
+    The final publish lists these files in "changed" as well. If the build does not get
+    to publish, restore_files puts the previous files back.
+
+    Returns:
+        list[str]: the files whose content differed from targetdir
+    """
+    changed = []
+    for name in dict.fromkeys(files):
+        source_path = os.path.join(build_dir, name)
+        target_path = os.path.join(targetdir, name)
+        if file_sha256(target_path) == file_sha256(source_path):
+            continue
+        with open(source_path, 'rb') as src:
+            _replace_durably(lambda f: shutil.copyfileobj(src, f), target_path)
+        changed.append(name)
+    for directory in {os.path.dirname(os.path.join(targetdir, name)) for name in changed}:
+        fsync_dir(directory)
+    return changed
+
+
+def restore_files(source_dir: str, targetdir: str, files: list[str]) -> None:
+    """
+    Undo publish_files: put back the files of source_dir (the published version) and delete the others.
+
+    Called when a build that published files progressively is cancelled or fails, so
+    that targetdir shows the previous robot again.
+    """
+    present = [name for name in files if os.path.isfile(os.path.join(source_dir, name))]
+    publish_files(source_dir, targetdir, present)
+    for name in files:
+        if name not in present and os.path.isfile(os.path.join(targetdir, name)):
+            _remove_published_file(targetdir, name)
+
+
+def publish(build_dir: str, targetdir: str, files: list[str], entry_point: str) -> dict:
+    """
+    Copy a complete build from build_dir to targetdir and write the publish manifest.
+
+    Only files whose content differs from targetdir are copied. Each one is written to a
+    temporary file, fsynced and renamed into place, so the consumer never sees a partial
+    file. Files are published in the given order and entry_point (the URDF) last, then
+    publish_manifest.json is replaced as the commit point of the build: a consumer that
+    watches it sees one event per complete build. Files of the previous build that are not
+    in files are deleted afterwards, with the files Unity imported from them. If targetdir
+    has no publish manifest yet, the files of the generator before publish manifests
+    (LEGACY_FILE_PATTERNS) count as the previous build. If the manifest cannot be read,
+    no file is deleted.
+
+    Args:
+        build_dir: directory the build was generated into
+        targetdir: directory read by the consumer (Unity)
+        files: paths of the build relative to build_dir
+        entry_point: file the consumer loads, relative to build_dir
+
+    Returns:
+        dict: the publish manifest. "files" maps every file of the build to its sha256,
+            "changed" and "removed" list the files that differ from the previous build,
+            and "build_id" identifies the content of the whole build.
+    """
+    previous = load_publish_manifest(targetdir)
+    has_manifest = os.path.exists(os.path.join(targetdir, PUBLISH_MANIFEST_FILENAME))
+    files = [name for name in dict.fromkeys(files) if name != entry_point] + [entry_point]
+    hashes = {name: file_sha256(os.path.join(build_dir, name)) for name in files}
+    missing = [name for name, digest in hashes.items() if digest is None]
+    if missing:
+        raise ValueError(f"Files missing in the build directory: {', '.join(missing)}")
+
+    changed = []
+    for name in files:
+        target_path = os.path.join(targetdir, name)
+        # publish_files で先に公開したファイルも、前回の公開から変わっていれば changed に含める
+        if file_sha256(target_path) == hashes[name]:
+            if previous.get("files", {}).get(name) != hashes[name]:
+                changed.append(name)
+            continue
+        with open(os.path.join(build_dir, name), 'rb') as src:
+            _replace_durably(lambda f: shutil.copyfileobj(src, f), target_path)
+        changed.append(name)
+
+    if "build_id" in previous:
+        previous_files = previous["files"]
+    elif not has_manifest:
+        # publish_manifest.json がなければ、以前の生成器が書いたファイルを前回の出力とみなす
+        previous_files = _files_without_manifest(targetdir)
+    else:
+        # 読めないマニフェストからは前回のファイルが分からないので、何も消さない
+        previous_files = []
+    removed = []
+    for name in previous_files:
+        path = os.path.join(targetdir, name)
+        if name not in hashes and os.path.isfile(path):
+            _remove_published_file(targetdir, name)
+            removed.append(name)
+    for directory in {os.path.dirname(os.path.join(targetdir, name)) for name in files}:
+        fsync_dir(directory)
+
+    build_id = hashlib.sha256(json.dumps(hashes, sort_keys=True).encode("utf-8")).hexdigest()
+    manifest = {
+        "build_id": build_id,
+        "entry_point": entry_point,
+        "files": hashes,
+        "changed": changed,
+        "removed": removed,
+    }
+    if previous.get("build_id") != build_id or changed or removed:
+        content = json.dumps(manifest, indent=2).encode("utf-8")
+        _replace_durably(lambda f: f.write(content), os.path.join(targetdir, PUBLISH_MANIFEST_FILENAME))
+        fsync_dir(targetdir)
+    return manifest
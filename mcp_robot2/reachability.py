@@ -0,0 +1,223 @@
+import glob
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from kinematics import KinematicModel
+from blanket_targets import BlanketTarget
+
+REACHABILITY_PREFIX = ".reachability_"
+# トーラス座標のビン数（トロイダル角, 大半径, 高さ）
+DEFAULT_BINS = (72, 48, 56)
+DEFAULT_RADIUS_RANGE = (0.0, 12.0)
+DEFAULT_HEIGHT_RANGE = (-7.0, 7.0)
+
+
+def torus_coordinates(positions: np.ndarray) -> np.ndarray:
+    """
+    Convert points of the torus frame (z is the torus axis) to torus coordinates.
+
+    Returns:
+        np.ndarray: (..., 3) toroidal angle in [-pi, pi), major radius and height
+    """
+    positions = np.asarray(positions, dtype=float)
+    phi = np.arctan2(positions[..., 1], positions[..., 0])
+    # arctan2 は pi を返しうるので [-pi, pi) にそろえる
+    phi = np.where(phi >= math.pi, phi - 2 * math.pi, phi)
+    return np.stack([phi, np.hypot(positions[..., 0], positions[..., 1]), positions[..., 2]], axis=-1)
+
+
+class ReachabilityMap:
+    """
+    Voxel grid, in torus coordinates, of the positions a link reached over random joint configurations.
+
+    Each voxel counts the sampled configurations that put the link origin inside it, so a
+    voxel with a count of zero was not reached. The counts are a memory-mapped .npy file
+    next to the robot description, with the grid settings in a .json file of the same name.
+    Both are named after the key, which hashes the kinematic description of the robot
+    (KinematicModel.key) and the grid settings; mesh options do not change it.
+    """
+
+    def __init__(self, counts: np.ndarray, metadata: dict):
+        self.counts = counts
+        self.metadata = metadata
+        self.key = metadata["key"]
+        self.link = metadata["link"]
+        self.bins = tuple(metadata["bins"])
+        self.lower = np.array([-math.pi, metadata["radius_range"][0], metadata["height_range"][0]])
+        upper = np.array([math.pi, metadata["radius_range"][1], metadata["height_range"][1]])
+        self.scale = np.array(self.bins) / (upper - self.lower)
+        # ロボットのルート座標系 -> トーラス座標系
+        self.to_torus = np.linalg.inv(np.array(metadata["torus_frame"]))
+
+    @staticmethod
+    def map_key(model: KinematicModel, link: str, samples: int, bins: tuple, radius_range: tuple, height_range: tuple,
+                torus_frame: np.ndarray, seed: int) -> str:
+        settings = {
+            "link": link,
+            "samples": samples,
+            "bins": list(bins),
+            "radius_range": list(radius_range),
+            "height_range": list(height_range),
+            "torus_frame": np.round(torus_frame, 12).tolist(),
+            "seed": seed,
+        }
+        return hashlib.sha256((model.key + json.dumps(settings, sort_keys=True)).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def path_of(directory: str, key: str) -> str:
+        """Path of the counts of a map, without extension."""
+        return os.path.join(directory, f"{REACHABILITY_PREFIX}{key[:16]}")
+
+    @classmethod
+    def build(cls, model: KinematicModel, path: str, link: str|None = None, samples: int = 1000000, bins: tuple = DEFAULT_BINS,
+              radius_range: tuple = DEFAULT_RADIUS_RANGE, height_range: tuple = DEFAULT_HEIGHT_RANGE,
+              torus_frame: np.ndarray|None = None, batch_size: int = 100000, seed: int = 0) -> "ReachabilityMap":
+        """
+        Sample joint space within the joint limits and write the map to path.npy and path.json.
+
+        Args:
+            model: kinematics of the robot
+            path: output path without extension
+            link: link whose origin is binned, the last link if None
+            samples: number of random joint configurations
+            bins: number of bins of the toroidal angle, major radius and height
+            radius_range, height_range: extent of the grid (m)
+            torus_frame: 4x4 pose of the torus frame in the root frame of the robot, identity if None
+            batch_size: configurations per forward kinematics call
+            seed: seed of the sampler, so that a map is reproducible from its key
+        """
+        link = model.link_names[model.link_index(link)]
+        torus_frame = np.eye(4) if torus_frame is None else np.asarray(torus_frame, dtype=float)
+        metadata = {
+            "key": cls.map_key(model, link, samples, bins, radius_range, height_range, torus_frame, seed),
+            "kinematic_key": model.key,
+            "link": link,
+            "samples": samples,
+            "bins": list(bins),
+            "radius_range": list(radius_range),
+            "height_range": list(height_range),
+            "torus_frame": torus_frame.tolist(),
+            "seed": seed,
+        }
+        counts = np.zeros(bins, dtype=np.uint32)
+        reachability = cls(counts, metadata)
+        target = model.link_index(link)
+        # 連続回転関節は1周分だけサンプルする
+        lower = np.where(np.isfinite(model.lower_limits), model.lower_limits, -math.pi)
+        upper = np.where(np.isfinite(model.upper_limits), model.upper_limits, math.pi)
+        rng = np.random.default_rng(seed)
+        for start in range(0, samples, batch_size):
+            q = rng.uniform(lower, upper, (min(batch_size, samples - start), model.joint_count))
+            positions = model.forward_kinematics(q)[:, target, :3, 3]
+            indices, inside = reachability.voxel_indices(positions)
+            np.add.at(counts, tuple(indices[inside].T), 1)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        stored = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint32, shape=counts.shape)
+        stored[:] = counts
+        stored.flush()
+        del stored
+        os.replace(tmp_path, f"{path}.npy")
+        # メタデータを最後に書くので、.json があれば .npy は完成している
+        tmp_path = f"{path}.{os.getpid()}.tmp.json"
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(tmp_path, f"{path}.json")
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> "ReachabilityMap|None":
+        """Open a map written by build, memory-mapped read-only. Returns None if it does not exist."""
+        try:
+            with open(f"{path}.json", 'r') as f:
+                metadata = json.load(f)
+            counts = np.load(f"{path}.npy", mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if counts.shape != tuple(metadata["bins"]):
+            return None
+        return cls(counts, metadata)
+
+    def voxel_indices(self, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Voxels of points given in the root frame of the robot.
+
+        Returns:
+            tuple: (N, 3) voxel indices and (N,) mask of the points inside the grid
+        """
+        positions = np.atleast_2d(np.asarray(positions, dtype=float))
+        local = positions @ self.to_torus[:3, :3].T + self.to_torus[:3, 3]
+        indices = np.floor((torus_coordinates(local) - self.lower) * self.scale).astype(np.int64)
+        inside = np.all((indices >= 0) & (indices < self.bins), axis=1)
+        return indices, inside
+
+    def reach_counts(self, positions: np.ndarray) -> np.ndarray:
+        """(N,) sampled configurations that reached the voxel of each point, 0 outside the grid."""
+        indices, inside = self.voxel_indices(positions)
+        counts = np.zeros(len(indices), dtype=np.uint32)
+        counts[inside] = self.counts[tuple(indices[inside].T)]
+        return counts
+
+    def can_reach(self, position: np.ndarray) -> bool:
+        """Whether the link reached the voxel of a point given in the root frame of the robot."""
+        indices, inside = self.voxel_indices(position)
+        return bool(inside[0]) and bool(self.counts[tuple(indices[0])])
+
+    def can_reach_blanket(self, target: BlanketTarget) -> bool:
+        """Whether the link reached the voxel of a blanket module (positions are in the torus frame)."""
+        torus_frame = np.array(self.metadata["torus_frame"])
+        return self.can_reach(torus_frame[:3, :3] @ target.position + torus_frame[:3, 3])
+
+
+def reachability_map_for(model: KinematicModel, directory: str, link: str|None = None, **options) -> ReachabilityMap:
+    """
+    Get the reachability map of a robot from directory, building it only if the kinematics or the settings changed.
+
+    When a new map is built, the maps of the same link with other settings and the maps
+    of an older robot in directory are deleted, so next to the description only the
+    current map of each link is kept.
+
+    Args:
+        model: kinematics of the robot
+        directory: directory of the robot description (the URDF)
+        link: link whose origin is binned, the last link if None
+        options: other arguments of ReachabilityMap.build
+    """
+    link = model.link_names[model.link_index(link)]
+    settings = {name: options.get(name, default) for name, default in (
+        ("samples", 1000000), ("bins", DEFAULT_BINS), ("radius_range", DEFAULT_RADIUS_RANGE), ("height_range", DEFAULT_HEIGHT_RANGE), ("seed", 0))}
+    torus_frame = np.eye(4) if options.get("torus_frame") is None else np.asarray(options["torus_frame"], dtype=float)
+    key = ReachabilityMap.map_key(model, link, settings["samples"], settings["bins"], settings["radius_range"], settings["height_range"], torus_frame, settings["seed"])
+    path = ReachabilityMap.path_of(directory, key)
+    reachability = ReachabilityMap.load(path)
+    if reachability is not None and reachability.key == key:
+        return reachability
+
+    _remove_stale_maps(directory, model, link, key)
+    return ReachabilityMap.build(model, path, link=link, **options)
+
+
+def _remove_stale_maps(directory: str, model: KinematicModel, link: str, key: str) -> None:
+    # 別のリンクのマップは残し、同じリンクで設定が古いものと、運動学が古いものだけを消す
+    for metadata_path in glob.glob(os.path.join(directory, f"{REACHABILITY_PREFIX}*.json")):
+        if ".tmp." in os.path.basename(metadata_path):
+            continue
+        try:
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if metadata.get("key") == key or (metadata.get("link") != link and metadata.get("kinematic_key") == model.key):
+            continue
+        # .json があれば .npy は完成している、という前提を崩さないように .json から消す
+        for stale_path in (metadata_path, f"{metadata_path[:-len('.json')]}.npy"):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                # 他の呼び出しが先に消した場合や、Windowsでまだメモリマップされている場合
+                pass
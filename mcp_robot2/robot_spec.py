@@ -0,0 +1,399 @@
+import copy
+import hashlib
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+
+from link_and_joint_class import Link, Joint, JointType, LINK_GENERATORS, link_frame
+import snake_link  # registers the snake transporter generators in LINK_GENERATORS
+from mesh_cache import make_cache_key, to_jsonable
+from build_manifest import BuildManifest, file_sha256, write_if_changed
+from parallel_build import build_links
+from urdf_writer import DESCRIPTION_FORMAT_VERSION, RobotDescriptionWriter
+from publish import (publish, publish_files, restore_files, load_publish_manifest, version_dir_for, version_name, current_version,
+                     current_build_dir, switch_current_version, begin_version, commit_version, collect_versions)
+from kinematics import KinematicModel
+from build_requests import BuildProgress, CancelFlag
+
+SPEC_VERSION = 1
+SPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "robot_specs")
+PLAN_FILENAME = ".build_plan.json"
+
+# Joint の引数のうち、仕様に書けるもの
+JOINT_OPTIONS = ("axis_xyz", "origin_xyz", "origin_rpy", "lower_limit", "upper_limit", "velocity_limit", "effort_limit", "damping", "friction")
+JOINT_FLOAT_OPTIONS = ("lower_limit", "upper_limit", "velocity_limit", "effort_limit", "damping", "friction")
+
+
+def _stable_hash(payload: object) -> str:
+    encoded = json.dumps(to_jsonable(payload), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _to_array(value: object) -> object:
+    # JSONの数値リストは生成関数が受け取るnumpy配列に戻す
+    if isinstance(value, list) and value and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+        return np.array(value)
+    return value
+
+
+class RobotSpec:
+    """
+    Declarative description of a robot, loaded from JSON or YAML.
+
+    Format:
+        name: robot name
+        links: list of {name, generator, params}. generator is a function registered with
+            @link_generator, params are its arguments without link_name.
+        joints: list of {name, type, parent, child, axis_xyz, origin_xyz, origin_rpy, ...}.
+            The parent of the first joint is "world". origin_xyz/origin_rpy default to the
+            joint position of the parent link, like Joint.
+        srdf: {group, end_effector, virtual_joint_child, disable_adjacent_collisions}
+
+    Fields are changed with patch(), e.g. spec.patch({"links.link_02.params.link_length": 1.5}).
+    """
+
+    def __init__(self, data: dict):
+        self.data = copy.deepcopy(data)
+        self.validate()
+
+    @classmethod
+    def load(cls, path: str) -> "RobotSpec":
+        with open(path, 'r', encoding='utf-8') as f:
+            if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ValueError("Reading a YAML robot spec requires PyYAML. Use the JSON format or install pyyaml.")
+                return cls(yaml.safe_load(f))
+            return cls(json.load(f))
+
+    @property
+    def name(self) -> str:
+        return self.data.get("name", "robot")
+
+    @property
+    def links(self) -> list[dict]:
+        return self.data["links"]
+
+    @property
+    def joints(self) -> list[dict]:
+        return self.data["joints"]
+
+    @property
+    def srdf(self) -> dict:
+        return self.data.get("srdf", {})
+
+    def link(self, name: str) -> dict:
+        for link in self.links:
+            if link["name"] == name:
+                return link
+        raise ValueError(f"Unknown link: {name}")
+
+    def validate(self) -> None:
+        if self.data.get("version", SPEC_VERSION) != SPEC_VERSION:
+            raise ValueError(f"Unsupported robot spec version: {self.data.get('version')}")
+        names = [link["name"] for link in self.links]
+        if len(set(names)) != len(names):
+            raise ValueError("Link names in the robot spec must be unique.")
+        for link in self.links:
+            if link["generator"] not in LINK_GENERATORS:
+                raise ValueError(f"Unknown link generator: {link['generator']}. Registered generators are {', '.join(LINK_GENERATORS)}.")
+        # 親リンクは先に定義されていなければならない（ジョイントの順序がそのまま生成順になる）
+        defined = {"world"}
+        for joint in self.joints:
+            JointType(joint["type"])
+            if joint["parent"] not in defined:
+                raise ValueError(f"Parent link {joint['parent']} of {joint['name']} must be the child of an earlier joint.")
+            if joint["child"] not in names or joint["child"] in defined:
+                raise ValueError(f"Child link {joint['child']} of {joint['name']} must be a link of the spec with a single parent.")
+            defined.add(joint["child"])
+        missing = set(names) - defined
+        if missing:
+            raise ValueError(f"Links not connected by any joint: {', '.join(sorted(missing))}")
+
+    def patch(self, updates: dict) -> "RobotSpec":
+        """
+        Set spec fields by dotted path. Items of "links" and "joints" are addressed by name.
+
+        Args:
+            updates: {path: value}, e.g. {"links.link_02.params.link_length": 1.5,
+                "joints.joint_01.axis_xyz": [0, 1, 0]}
+        """
+        for path, value in updates.items():
+            keys = path.split(".")
+            node = self.data
+            for key in keys[:-1]:
+                if isinstance(node, list):
+                    node = next((item for item in node if item.get("name") == key), None)
+                    if node is None:
+                        raise ValueError(f"Unknown item {key} in {path}")
+                else:
+                    node = node.setdefault(key, {})
+            node[keys[-1]] = to_jsonable(value)
+        self.validate()
+        return self
+
+    def to_dict(self) -> dict:
+        return copy.deepcopy(self.data)
+
+
+class BuildTask:
+    """
+    One step of a build plan.
+
+    Attributes:
+        kind: "geometry" (run a link generator), "export" (mesh files of a link), "urdf" or "srdf"
+        name: link name, or the file name for "urdf"/"srdf"
+        key: stable hash of the task inputs and of the keys of its dependencies
+        deps: keys of the tasks that must run first
+        payload: inputs of the task
+    """
+
+    def __init__(self, kind: str, name: str, payload: dict, deps: list[str]):
+        self.kind = kind
+        self.name = name
+        self.payload = payload
+        self.deps = deps
+        self.key = _stable_hash({"kind": kind, "payload": payload, "deps": deps})
+
+
+class BuildPlan:
+    """
+    Dependency-ordered list of build tasks compiled from a RobotSpec.
+
+    Geometry tasks are keyed by the mesh cache key of the generator (its name, code and
+    parameters), so links with the same shape share one task. A task whose key is unchanged
+    since the previous build has the same output.
+
+    build_robot uses the plan as a whole: its key names the version directory, so a plan
+    that is already published is skipped and one built before is restored, and the export
+    tasks give the links to build. Within a build, the unchanged links are skipped by
+    BuildManifest (mesh key and file hashes of each link), and links of the same shape
+    share their meshes through the mesh cache, which uses the same shape key as the
+    geometry tasks.
+    """
+
+    def __init__(self, spec: RobotSpec, tasks: list[BuildTask]):
+        self.spec = spec
+        self.tasks = tasks
+        self.key = _stable_hash([task.key for task in tasks])
+
+    def tasks_of(self, kind: str) -> list[BuildTask]:
+        return [task for task in self.tasks if task.kind == kind]
+
+    def to_dict(self) -> dict:
+        return {"key": self.key, "tasks": [{"kind": t.kind, "name": t.name, "key": t.key, "deps": t.deps} for t in self.tasks]}
+
+
+def compile_build_plan(spec: RobotSpec, mesh_options: dict|None = None) -> BuildPlan:
+    """
+    Compile a robot spec into a build plan.
+
+    Args:
+        spec: the robot
+        mesh_options: keyword arguments of Link.gen_mesh_file (e.g. collision_method)
+    """
+    mesh_options = mesh_options or {}
+    tasks = []
+    geometry_tasks = {}
+    geometry_keys = {}
+    export_keys = []
+    for link in spec.links:
+        # 同じ生成関数と引数のリンクは形状が同じなので、1つのタスクにまとめる
+        shape_key = make_cache_key(link["generator"], link.get("params", {}))
+        if shape_key not in geometry_tasks:
+            # shape_key は生成関数のコードと CACHE_VERSION も含むので、生成関数を書き換えるとタスクのキーも変わる
+            geometry_tasks[shape_key] = BuildTask("geometry", link["name"], {"generator": link["generator"], "params": link.get("params", {}), "shape_key": shape_key}, [])
+            tasks.append(geometry_tasks[shape_key])
+        geometry_keys[link["name"]] = geometry_tasks[shape_key].key
+    for link in spec.links:
+        export = BuildTask("export", link["name"], {"link_name": link["name"], "mesh_options": mesh_options}, [geometry_keys[link["name"]]])
+        tasks.append(export)
+        export_keys.append(export.key)
+    tasks.append(BuildTask("urdf", f"{spec.name}.urdf", {"name": spec.name, "joints": spec.joints, "format": DESCRIPTION_FORMAT_VERSION}, export_keys))
+    tasks.append(BuildTask("srdf", f"{spec.name}.srdf", {"name": spec.name, "joints": [j["name"] for j in spec.joints], "srdf": spec.srdf, "format": DESCRIPTION_FORMAT_VERSION}, export_keys))
+    return BuildPlan(spec, tasks)
+
+
+def _joint_from_spec(joint: dict, links: dict) -> Joint:
+    options = {}
+    for option in JOINT_OPTIONS:
+        if joint.get(option) is not None:
+            value = _to_array(joint[option])
+            options[option] = float(value) if option in JOINT_FLOAT_OPTIONS else value
+    parent = links[joint["parent"]] if joint["parent"] != "world" else Link("world", None)
+    return Joint(joint["name"], JointType(joint["type"]), parent, links[joint["child"]], **options)
+
+
+def spec_kinematics(spec: RobotSpec) -> tuple[KinematicModel, dict]:
+    """
+    Compile the kinematics of a robot spec from the frame functions of its generators, without building any geometry.
+
+    Returns:
+        tuple: (KinematicModel, {link name: LinkFrame})
+    """
+    frames = {link["name"]: link_frame(link["generator"], {key: _to_array(value) for key, value in link.get("params", {}).items()}) for link in spec.links}
+    entries = {}
+    for joint in spec.joints:
+        # Joint と同じく、原点の既定値は親リンクのジョイント位置
+        parent = frames.get(joint["parent"])
+        entries[joint["name"]] = {
+            "type": joint["type"],
+            "parent": joint["parent"],
+            "child": joint["child"],
+            "origin_xyz": joint.get("origin_xyz", parent.joint_xyz if parent is not None else np.zeros(3)),
+            "origin_rpy": joint.get("origin_rpy", parent.joint_rpy if parent is not None else np.zeros(3)),
+            "axis_xyz": joint.get("axis_xyz", [0, 0, 1]),
+            "lower_limit": joint.get("lower_limit", -math.pi),
+            "upper_limit": joint.get("upper_limit", math.pi),
+        }
+    return KinematicModel.from_joint_entries(entries), frames
+
+
+def _version_matches(plan: BuildPlan, version_dir: str) -> bool:
+    # ディレクトリ名はキーの先頭だけなので、ビルド計画のキー全体も確認する
+    try:
+        with open(os.path.join(version_dir, PLAN_FILENAME), 'r') as f:
+            return json.load(f).get("key") == plan.key
+    except (OSError, ValueError):
+        return False
+
+
+def _plan_is_published(plan: BuildPlan, targetdir: str) -> bool:
+    if current_version(targetdir) != version_name(plan.key) or not _version_matches(plan, version_dir_for(targetdir, plan.key)):
+        return False
+    # 公開済みのファイルが手で変更されていないことも確認する
+    published = load_publish_manifest(targetdir).get("files", {})
+    return bool(published) and all(file_sha256(os.path.join(targetdir, name)) == digest for name, digest in published.items())
+
+
+def _version_files(manifest: BuildManifest) -> list[str]:
+    """Mesh files of the build recorded in manifest."""
+    return [name for entry in manifest.previous["links"].values() for name in entry.get("files", {})]
+
+
+def build_robot(spec: RobotSpec, targetdir: str, urdf_filename: str = "temporary_robot.urdf", srdf_filename: str = "temporary_robot.srdf",
+                parallel: bool = False, mesh_options: dict|None = None, cancel: CancelFlag|None = None,
+                progress: BuildProgress|None = None, progressive: bool = False) -> dict:
+    """
+    Build a robot spec into targetdir (see publish.publish).
+
+    Every build is kept in a version directory named by the hash of its build plan
+    (publish.versions_dir_for), which also covers the code of the generators and the
+    URDF/SRDF format version, so editing a generator rebuilds its links. The whole build is skipped if its plan is the published
+    one, and a plan that was built before is published again from its version directory
+    without generating anything. Otherwise the new version starts as a copy of the
+    current one: links whose mesh is unchanged are skipped by the BuildManifest, links of
+    the same shape share their meshes through the mesh cache, and the descriptions are
+    streamed to the new version directory, which is then published and becomes the
+    current version. Concurrent builds never write to the same directory. The least
+    recently used versions are deleted (publish.collect_versions).
+
+    If cancel is set while the build runs, build_links stops at its next check and
+    BuildCancelled is raised. The unfinished version directory is deleted, nothing is
+    published and targetdir keeps the previous robot.
+
+    progress receives the events of the build: "plan" (with "total", the number of "link",
+    "description" and "publish" events to come), the geometry/tessellation/export/collision
+    steps of each generated link, "link" when the meshes of a link are ready (with "files"),
+    "description" and "publish". With progressive=True the meshes of each link are
+    published (publish.publish_files) as soon as they are ready, so a consumer can load them
+    before the slowest link is done; the URDF and the publish manifest still change only
+    once, at the end. If such a build is cancelled or fails, the meshes it published are
+    restored from the current version (publish.restore_files). Without a current version
+    there is nothing to restore, so the first build into targetdir is never progressive.
+
+    Returns:
+        dict: {"plan": plan key, "skipped": bool, "restored": bool (published from a stored version),
+            "rebuilt_links": [...], "collision_reports": {link: report}}
+    """
+    mesh_options = mesh_options or {}
+    plan = compile_build_plan(spec, mesh_options)
+    version_dir = version_dir_for(targetdir, plan.key)
+
+    report = progress.report if progress is not None else (lambda phase, link=None, **info: None)
+    skipped = _plan_is_published(plan, targetdir)
+    restored = not skipped and _version_matches(plan, version_dir)
+    report("plan", plan=plan.key, skipped=skipped or restored, total=1 if restored else 0 if skipped else len(plan.tasks_of("export")) + 2)
+    if skipped or restored:
+        manifest = BuildManifest(version_dir, mesh_options=mesh_options)
+        if restored:
+            # 以前に生成した設計に戻すときは、そのバージョンを公開し直すだけ
+            report("publish")
+            publish(version_dir, targetdir, _version_files(manifest) + [srdf_filename], entry_point=urdf_filename)
+        switch_current_version(targetdir, plan.key)
+        reports = {name: entry["collision_report"] for name, entry in manifest.previous["links"].items() if entry.get("collision_report")}
+        return {"plan": plan.key, "skipped": skipped, "restored": restored, "rebuilt_links": [], "collision_reports": reports}
+
+    previous_dir = None
+    if progressive and current_version(targetdir) is not None and os.path.isdir(current_build_dir(targetdir)):
+        previous_dir = current_build_dir(targetdir)
+    published = []
+    build_dir = begin_version(targetdir, plan.key)
+    try:
+        manifest = BuildManifest(build_dir, mesh_options=mesh_options)
+        built = _build_version(spec, plan, manifest, targetdir, urdf_filename, srdf_filename, parallel, cancel, report, progress,
+                               published if previous_dir is not None else None)
+        version_dir = commit_version(build_dir, targetdir, plan.key)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        # 途中で公開したメッシュを、公開中のバージョンのものに戻す
+        if published:
+            restore_files(previous_dir, targetdir, published)
+        raise
+    publish(version_dir, targetdir, manifest.current_files() + [srdf_filename], entry_point=urdf_filename)
+    switch_current_version(targetdir, plan.key)
+    collect_versions(targetdir)
+
+    reports = {link.link_name: link.collision_report for link in built if link.collision_report}
+    return {"plan": plan.key, "skipped": False, "restored": False, "rebuilt_links": manifest.rebuilt_links, "collision_reports": reports}
+
+
+def _build_version(spec: RobotSpec, plan: BuildPlan, manifest: BuildManifest, targetdir: str, urdf_filename: str, srdf_filename: str,
+                   parallel: bool, cancel: CancelFlag|None, report, progress: BuildProgress|None, published: list|None) -> list[Link]:
+    """
+    Generate the meshes and descriptions of a build into manifest.targetdir (see build_robot).
+
+    If published is a list, the meshes of each link are published as soon as they are
+    ready and the files that changed in targetdir are appended to it.
+    """
+    build_dir = manifest.targetdir
+    link_specs = []
+    for task in plan.tasks_of("export"):
+        link = spec.link(task.name)
+        params = {key: _to_array(value) for key, value in link.get("params", {}).items()}
+        link_specs.append((LINK_GENERATORS[link["generator"]], dict(link_name=link["name"], **params)))
+
+    def on_link(link: Link, entry: dict|None) -> None:
+        files = list((entry or {}).get("files", {}))
+        if published is not None and files:
+            published.extend(publish_files(build_dir, targetdir, files))
+        report("link", link.link_name, files=files, published=published is not None and bool(files))
+
+    built = build_links(link_specs, manifest, parallel=parallel, cancel=cancel, progress=progress, on_link=on_link)
+    links = {link["name"]: built_link for link, built_link in zip(spec.links, built)}
+    joints = [_joint_from_spec(joint, links) for joint in spec.joints]
+
+    report("description")
+    srdf = spec.srdf
+    with RobotDescriptionWriter(os.path.join(build_dir, urdf_filename), os.path.join(build_dir, srdf_filename),
+                                robot_name=spec.name, group_name=srdf.get("group", "arm")) as writer:
+        writer.add_link(Link("world", None))
+        for joint in joints:
+            writer.add_joint(joint)
+            writer.add_link(joint.child_link)
+        end_effector = links[srdf["end_effector"]].link_name if srdf.get("end_effector") else built[-1].link_name
+        adjacent_links = built if srdf.get("disable_adjacent_collisions", True) else []
+        writer.finish(end_effector_link=end_effector, base_link=srdf.get("virtual_joint_child", "base_link"), adjacent_links=adjacent_links)
+
+    for joint in joints:
+        manifest.record_joint(joint)
+    manifest.save()
+    write_if_changed(os.path.join(build_dir, PLAN_FILENAME), json.dumps(plan.to_dict(), indent=2))
+    if cancel is not None:
+        cancel.check()
+    report("publish")
+    return built
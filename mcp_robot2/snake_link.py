@@ -1,21 +1,17 @@
-import cadquery as cq
-from cadquery.vis import show
-from cadquery import Workplane
-from cadquery import *
-from cadquery.func import *
 import math
-from enum import Enum
-from typing import Any
+from typing import TYPE_CHECKING
 import numpy as np
 import os
-from mcp.server.fastmcp import FastMCP
+from link_and_joint_class import CollisionPrimitive, Joint, JointType, LazyGeometry, Link, LinkFrame, MassProperties, gen_link, link_generator, load_cad
 
-mcp = FastMCP("mcp_robot2")
-from link_and_joint_class import *
+if TYPE_CHECKING:
+    import cadquery as cq
 
 
 
-def make_d_shape(diameter: float, height: float) -> cq.Workplane:
+def make_d_shape(diameter: float, height: float) -> "cq.Workplane":
+    from cadquery import Workplane
+
     # 半円と、直径部分の長方形を組み合わせてD字型を作成
     half_circle = Workplane("XY").circle(diameter / 2).extrude(height)
     rectangle = Workplane("XY").rect(diameter, diameter/2).extrude(height).translate((0, -diameter / 4, 0))
@@ -24,6 +20,24 @@ def make_d_shape(diameter: float, height: float) -> cq.Workplane:
     return d_shape
 
 
+def make_joint_solid(joint_structure: str|bool, width: float, height: float) -> "cq.Workplane":
+    # clevisは上下2枚、tangは中央1枚のD字型（joint_structureは呼び出し側で検証済み）
+    if (isinstance(joint_structure, str) and joint_structure.lower() == "clevis") or joint_structure is True:
+        top = make_d_shape(width, height/10).translate((0, 0, height/2.0 - height/10/2.0))
+        bottom = make_d_shape(width, height/10).translate((0, 0, -height/2.0 + height/10/2.0))
+        return top.union(bottom)
+    return make_d_shape(width, 0.75 * height)
+
+
+def gen_base_rail_link_frame(origin_xyz: np.ndarray = np.zeros(3), origin_rpy: np.ndarray = np.zeros(3), joint_xyz: np.ndarray = None, joint_rpy: np.ndarray = None, **params) -> LinkFrame:
+    if joint_xyz is None:
+        joint_xyz = np.zeros(3) + origin_xyz
+    if joint_rpy is None:
+        joint_rpy = origin_rpy
+    # レールは土台なので自己干渉の判定には含めない
+    return LinkFrame(joint_xyz, joint_rpy)
+
+@link_generator(frame=gen_base_rail_link_frame)
 def gen_base_rail_link(
         link_name: str,
         rail_length: float,
@@ -34,28 +48,46 @@ def gen_base_rail_link(
         joint_xyz: np.ndarray = None,
         joint_rpy: np.ndarray = None
 ) -> Link:
-    # Generate a base rail link
-    rail1 = Workplane("XZ").rect(rail_size, rail_size).extrude(rail_length).translate(( rail_width/2, 0,0))
-    rail2 = Workplane("XZ").rect(rail_size, rail_size).extrude(rail_length).translate((-rail_width/2, 0,0))
+    def build_geometry():
+        from cadquery import Workplane
 
-    link_geometry = rail1 + rail2
-    link_geometry = link_geometry.translate(tuple(origin_xyz))
-    link_geometry = link_geometry.rotate(tuple(origin_xyz), (1, 0, 0), math.degrees(origin_rpy[0])).rotate(tuple(origin_xyz), (0, 1, 0), math.degrees(origin_rpy[1])).rotate(tuple(origin_xyz), (0, 0, 1), math.degrees(origin_rpy[2]))
+        # Generate a base rail link
+        rail1 = Workplane("XZ").rect(rail_size, rail_size).extrude(rail_length).translate(( rail_width/2, 0,0))
+        rail2 = Workplane("XZ").rect(rail_size, rail_size).extrude(rail_length).translate((-rail_width/2, 0,0))
 
-    if joint_xyz is None:
-        joint_xyz = np.zeros(3) + origin_xyz
-    if joint_rpy is None:
-        joint_rpy = origin_rpy
+        link_geometry = rail1 + rail2
+        link_geometry = link_geometry.translate(tuple(origin_xyz))
+        return link_geometry.rotate(tuple(origin_xyz), (1, 0, 0), math.degrees(origin_rpy[0])).rotate(tuple(origin_xyz), (0, 1, 0), math.degrees(origin_rpy[1])).rotate(tuple(origin_xyz), (0, 0, 1), math.degrees(origin_rpy[2]))
+
+    rail_mass = MassProperties.from_bounds([-rail_size/2, -rail_length, -rail_size/2], [rail_size/2, 0, rail_size/2])
+    mass_properties = rail_mass.translate(( rail_width/2, 0, 0)) + rail_mass.translate((-rail_width/2, 0, 0))
+    mass_properties = mass_properties.translate(tuple(origin_xyz))
+    mass_properties = mass_properties.rotate(tuple(origin_xyz), (1, 0, 0), math.degrees(origin_rpy[0])).rotate(tuple(origin_xyz), (0, 1, 0), math.degrees(origin_rpy[1])).rotate(tuple(origin_xyz), (0, 0, 1), math.degrees(origin_rpy[2]))
+
+    frame = gen_base_rail_link_frame(origin_xyz, origin_rpy, joint_xyz, joint_rpy)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
+
+    # XZ平面から押し出したレールは -Y 方向に伸びる
+    collision_primitives = [
+        CollisionPrimitive.box([rail_size, rail_length, rail_size], origin_xyz=np.array([ rail_width/2, -rail_length/2, 0])).transformed(origin_xyz, origin_rpy),
+        CollisionPrimitive.box([rail_size, rail_length, rail_size], origin_xyz=np.array([-rail_width/2, -rail_length/2, 0])).transformed(origin_xyz, origin_rpy),
+    ]
 
     return Link(
         link_name="base_rail_link",
-        link_geometry=link_geometry,
+        link_geometry=LazyGeometry(build_geometry),
         joint_xyz=joint_xyz,
         joint_rpy=joint_rpy,
         geometry_xyz=np.zeros(3),
         geometry_rpy=np.zeros(3),
+        collision_primitives=collision_primitives,
+        mass_properties=mass_properties,
     )
 
+def gen_gimbal_link2_frame(cylinder2_offset_y: float, cylinder2_offset_z: float, cylinder2_radius: float, **params) -> LinkFrame:
+    return LinkFrame(np.array([0, cylinder2_offset_y, cylinder2_offset_z]), np.array([0, 0, 0]), capsule_radius=cylinder2_radius/2.0)
+
+@link_generator(frame=gen_gimbal_link2_frame)
 def gen_gimbal_link2(
     link_name: str,
     cylinder1_radius: float,
@@ -85,63 +117,71 @@ def gen_gimbal_link2(
     Returns:
         Link: The generated link object.
     """
-    # オフセット長さが設定されている場合、それ分の円筒を作成
-    if cylinder1_length > 0:
-        offset_cylinder = (
-            Workplane("XY")
-            .center(0, 0)
-            .circle(cylinder1_radius/2.0)
-            .extrude(cylinder1_length)
-        )
-        offset_cylinder = offset_cylinder.rotate((0,0,0),(1,0,0),-90)
-    else:
-        offset_cylinder = cq.Compound.makeCompound([])
-
-    # boxを作成して、斜めに切る
-    # 2*sqrt(2) 
-    edge_length = cylinder2_width
-    box_final_width = (edge_length + cylinder2_width/5 if joint_structure == "clevis" else edge_length)
-    box_solid = Workplane("XY").box(edge_length, edge_length, box_final_width)
-    # (0,0), (edge_length, edge_length), (edge_length,0) を結んだ三角柱
-    triangle_pole = Workplane("XY").polyline([
-        (0, 0),
-        (edge_length, edge_length),
-        (edge_length, 0),
-        (0, 0)
-    ]).close().extrude(box_final_width/2, both=True)
-    triangle_pole = triangle_pole.translate((-edge_length/2, -edge_length/2, 0))
-    box_solid = box_solid.cut(triangle_pole).rotate((0, 0, 0), (0, 1, 0), 90).rotate((0, 0, 0), (0, 0, 1), 180).translate((0, cylinder1_length+edge_length/2, 0))
-
-    # cylinder2を作成
-    if joint_structure == "clevis":
-        cylinder_left = (Workplane("XY").center(0, 0).circle(cylinder2_radius/2.0).extrude(cylinder2_width/10)).rotate((0,0,0),(0,1,0),-90).translate((-cylinder2_width/2.0, cylinder2_offset_y, cylinder2_offset_z))
-        cylinder_right = (Workplane("XY").center(0, 0).circle(cylinder2_radius/2.0).extrude(cylinder2_width/10)).rotate((0,0,0),(0,1,0),+90).translate((cylinder2_width/2.0, cylinder2_offset_y, cylinder2_offset_z))
-
-        cylinder = cylinder_left + cylinder_right
-    elif joint_structure == "tang":
-        cylinder = (Workplane("XY").center(0, 0).circle(cylinder2_radius/2.0).extrude(cylinder2_width/2,both=True)).rotate((0,0,0),(0,1,0),-90).translate((0, cylinder2_offset_y, cylinder2_offset_z))
-
-    else:
+    if joint_structure not in ("clevis", "tang"):
         raise ValueError("joint_structure must be 'clevis' or 'tang' or False. If you want to disable the joint structure, set it to False.")
 
-    link_geometry =  box_solid + cylinder + offset_cylinder
-
-    joint_xyz = np.array([0, cylinder2_offset_y, cylinder2_offset_z])
-    joint_rpy = np.array([0, 0, 0])
+    def build_geometry():
+        import cadquery as cq
+        from cadquery import Workplane
+
+        # オフセット長さが設定されている場合、それ分の円筒を作成
+        if cylinder1_length > 0:
+            offset_cylinder = (
+                Workplane("XY")
+                .center(0, 0)
+                .circle(cylinder1_radius/2.0)
+                .extrude(cylinder1_length)
+            )
+            offset_cylinder = offset_cylinder.rotate((0,0,0),(1,0,0),-90)
+        else:
+            offset_cylinder = cq.Compound.makeCompound([])
+
+        # boxを作成して、斜めに切る
+        # 2*sqrt(2) 
+        edge_length = cylinder2_width
+        box_final_width = (edge_length + cylinder2_width/5 if joint_structure == "clevis" else edge_length)
+        box_solid = Workplane("XY").box(edge_length, edge_length, box_final_width)
+        # (0,0), (edge_length, edge_length), (edge_length,0) を結んだ三角柱
+        triangle_pole = Workplane("XY").polyline([
+            (0, 0),
+            (edge_length, edge_length),
+            (edge_length, 0),
+            (0, 0)
+        ]).close().extrude(box_final_width/2, both=True)
+        triangle_pole = triangle_pole.translate((-edge_length/2, -edge_length/2, 0))
+        box_solid = box_solid.cut(triangle_pole).rotate((0, 0, 0), (0, 1, 0), 90).rotate((0, 0, 0), (0, 0, 1), 180).translate((0, cylinder1_length+edge_length/2, 0))
+
+        # cylinder2を作成
+        if joint_structure == "clevis":
+            cylinder_left = (Workplane("XY").center(0, 0).circle(cylinder2_radius/2.0).extrude(cylinder2_width/10)).rotate((0,0,0),(0,1,0),-90).translate((-cylinder2_width/2.0, cylinder2_offset_y, cylinder2_offset_z))
+            cylinder_right = (Workplane("XY").center(0, 0).circle(cylinder2_radius/2.0).extrude(cylinder2_width/10)).rotate((0,0,0),(0,1,0),+90).translate((cylinder2_width/2.0, cylinder2_offset_y, cylinder2_offset_z))
+
+            cylinder = cylinder_left + cylinder_right
+        else:
+            cylinder = (Workplane("XY").center(0, 0).circle(cylinder2_radius/2.0).extrude(cylinder2_width/2,both=True)).rotate((0,0,0),(0,1,0),-90).translate((0, cylinder2_offset_y, cylinder2_offset_z))
 
-    if reverse:
-        link_geometry = link_geometry.translate((0, -cylinder2_offset_y, -cylinder2_offset_z)).rotate((0, 0, 0), (1, 0, 0), 180)
+        link_geometry =  box_solid + cylinder + offset_cylinder
+        if reverse:
+            link_geometry = link_geometry.translate((0, -cylinder2_offset_y, -cylinder2_offset_z)).rotate((0, 0, 0), (1, 0, 0), 180)
+        return link_geometry
 
+    frame = gen_gimbal_link2_frame(cylinder2_offset_y, cylinder2_offset_z, cylinder2_radius)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
 
     return Link(
         link_name=link_name,
-        link_geometry=link_geometry,
+        link_geometry=LazyGeometry(build_geometry),
         joint_xyz=joint_xyz,
         joint_rpy=joint_rpy,
         geometry_xyz=np.zeros(3),
         geometry_rpy=np.zeros(3),
     )
 
+def gen_gimbal_link_frame(torus_radius: float, torus_section_radius: float, **params) -> LinkFrame:
+    # ジョイント位置（トーラスの端点を基準にする例）
+    return LinkFrame(np.array([torus_radius, torus_radius, 0]), np.zeros(3), capsule_radius=torus_section_radius/2.0)
+
+@link_generator(frame=gen_gimbal_link_frame)
 def gen_gimbal_link(
     link_name: str,
     torus_radius: float,
@@ -175,57 +215,89 @@ def gen_gimbal_link(
     Returns:
         Link: 生成したリンク
     """
-    # 1/4トーラス作成
-    elbow_torus = torus(torus_radius, torus_section_radius)
-    filter_box = box(torus_radius, torus_radius, torus_radius).translate((torus_radius/2, torus_radius/2, -torus_radius/2))
-    elbow = elbow_torus * filter_box
-    elbow = elbow.rotate((0, 0, 0), (0, 1, 0), 90).translate((0, offset_length, torus_radius/2))
-
-    # オフセット長さが設定されている場合、それ分の円筒を作成
-    if offset_length > 0:
-        offset_cylinder = (
-            Workplane("XY")
-            .center(0, 0)
-            .circle(torus_section_radius/2.0)
-            .extrude(offset_length)
-        )
-        offset_cylinder = offset_cylinder.rotate((0,0,0),(1,0,0),-90)
-    else:
-        offset_cylinder = cq.Compound.makeCompound([])
-    
-    # 円筒作成
-    if joint_structure == "clevis":
-        cylinder_left = (Workplane("XY").center(0, 0).circle(cylinder_radius/2.0).extrude(cylinder_height/10.0)).rotate((0,0,0),(0,1,0),-90).translate((-cylinder_height/2.0, cylinder_offset_y, cylinder_offset_z))
-        cylinder_right = (Workplane("XY").center(0, 0).circle(cylinder_radius/2.0).extrude(cylinder_height/10.0)).rotate((0,0,0),(0,1,0),+90).translate((cylinder_height/2.0, cylinder_offset_y, cylinder_offset_z))
+    if joint_structure not in ("clevis", "tang"):
+        raise ValueError("joint_structure must be 'clevis' or 'tang' or False. If you want to disable the joint structure, set it to False.")
 
-        cylinder = cylinder_left + cylinder_right
-    elif joint_structure == "tang":
-        cylinder = (Workplane("XY").center(0, 0).circle(cylinder_radius/2.0).extrude(cylinder_height)).rotate((0,0,0),(0,1,0),-90).translate((0, cylinder_offset_y, cylinder_offset_z))
+    def build_geometry():
+        import cadquery as cq
+        from cadquery import Workplane
+        from cadquery.func import box, torus
+
+        # 1/4トーラス作成
+        elbow_torus = torus(torus_radius, torus_section_radius)
+        filter_box = box(torus_radius, torus_radius, torus_radius).translate((torus_radius/2, torus_radius/2, -torus_radius/2))
+        elbow = elbow_torus * filter_box
+        elbow = elbow.rotate((0, 0, 0), (0, 1, 0), 90).translate((0, offset_length, torus_radius/2))
+
+        # オフセット長さが設定されている場合、それ分の円筒を作成
+        if offset_length > 0:
+            offset_cylinder = (
+                Workplane("XY")
+                .center(0, 0)
+                .circle(torus_section_radius/2.0)
+                .extrude(offset_length)
+            )
+            offset_cylinder = offset_cylinder.rotate((0,0,0),(1,0,0),-90)
+        else:
+            offset_cylinder = cq.Compound.makeCompound([])
 
-    else:
-        raise ValueError("joint_structure must be 'clevis' or 'tang' or False. If you want to disable the joint structure, set it to False.")
+        # 円筒作成
+        if joint_structure == "clevis":
+            cylinder_left = (Workplane("XY").center(0, 0).circle(cylinder_radius/2.0).extrude(cylinder_height/10.0)).rotate((0,0,0),(0,1,0),-90).translate((-cylinder_height/2.0, cylinder_offset_y, cylinder_offset_z))
+            cylinder_right = (Workplane("XY").center(0, 0).circle(cylinder_radius/2.0).extrude(cylinder_height/10.0)).rotate((0,0,0),(0,1,0),+90).translate((cylinder_height/2.0, cylinder_offset_y, cylinder_offset_z))
 
+            cylinder = cylinder_left + cylinder_right
+        else:
+            cylinder = (Workplane("XY").center(0, 0).circle(cylinder_radius/2.0).extrude(cylinder_height)).rotate((0,0,0),(0,1,0),-90).translate((0, cylinder_offset_y, cylinder_offset_z))
 
-    # 1/4トーラスから円筒を引く
-    # torus_cut = elbow.cut(cylinder)
-    torus_cut = elbow
+        # 1/4トーラスから円筒を引く
+        # torus_cut = elbow.cut(cylinder)
+        torus_cut = elbow
 
-    # 必要なら円筒を足す
-    link_geometry = offset_cylinder + torus_cut + cylinder
+        # 必要なら円筒を足す
+        return offset_cylinder + torus_cut + cylinder
 
-    # ジョイント位置（トーラスの端点を基準にする例）
-    joint_xyz = np.array([torus_radius, torus_radius, 0])
-    joint_rpy = np.zeros(3)
+    # torus() の引数は直径なので、半径は半分
+    elbow_mass = MassProperties.torus_sector(torus_radius/2, torus_section_radius/2, math.pi/2)
+    body_mass = elbow_mass.rotate((0, 0, 0), (0, 1, 0), 90).translate((0, offset_length, torus_radius/2))
+    if offset_length > 0:
+        body_mass = body_mass + MassProperties.cylinder(torus_section_radius/2.0, offset_length).rotate((0,0,0),(1,0,0),-90)
+    if joint_structure == "clevis":
+        cylinder_mass = (MassProperties.cylinder(cylinder_radius/2.0, cylinder_height/10.0).rotate((0,0,0),(0,1,0),-90).translate((-cylinder_height/2.0, cylinder_offset_y, cylinder_offset_z))
+                         + MassProperties.cylinder(cylinder_radius/2.0, cylinder_height/10.0).rotate((0,0,0),(0,1,0),+90).translate((cylinder_height/2.0, cylinder_offset_y, cylinder_offset_z)))
+        cylinder_x = (cylinder_height/2.0, cylinder_height/2.0 + cylinder_height/10.0)
+    else:
+        cylinder_mass = MassProperties.cylinder(cylinder_radius/2.0, cylinder_height).rotate((0,0,0),(0,1,0),-90).translate((0, cylinder_offset_y, cylinder_offset_z))
+        cylinder_x = (0.0, cylinder_height)
+    # トーラスと円筒の重なりは解析的に求めないので、重なりうるときはOCCTで計算する。
+    # トーラスとオフセットの円筒は |x| <= 断面半径 にあり、yz平面では (offset_length, torus_radius/2) を中心とする円環と長方形に収まる
+    section_radius = torus_section_radius/2.0
+    distance_to_elbow = abs(math.hypot(cylinder_offset_y - offset_length, cylinder_offset_z - torus_radius/2) - torus_radius/2)
+    distance_to_offset = math.hypot(max(0.0, -cylinder_offset_y, cylinder_offset_y - offset_length), max(0.0, abs(cylinder_offset_z) - section_radius))
+    apart_in_x = cylinder_x[0] >= section_radius
+    apart_in_yz = distance_to_elbow >= section_radius + cylinder_radius/2.0 and (offset_length <= 0 or distance_to_offset >= cylinder_radius/2.0)
+    mass_properties = body_mass + cylinder_mass if apart_in_x or apart_in_yz else None
+
+    frame = gen_gimbal_link_frame(torus_radius, torus_section_radius)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
 
     return Link(
         link_name=link_name,
-        link_geometry=link_geometry,
+        link_geometry=LazyGeometry(build_geometry),
         joint_xyz=joint_xyz,
         joint_rpy=joint_rpy,
         geometry_xyz=np.zeros(3),
         geometry_rpy=np.zeros(3),
+        mass_properties=mass_properties,
     )
 
+def gen_wrist_link_frame(box1_length: float, box1_height: float, box2_length: float, box2_offset_z: float = 0.0, joint_xyz: np.ndarray = None, **params) -> LinkFrame:
+    # set next joint position
+    if joint_xyz is None:
+        joint_xyz = np.array([0, box1_length + box2_length/2, box2_offset_z])
+    return LinkFrame(joint_xyz, np.zeros(3), capsule_radius=box1_height/2.0)
+
+@link_generator(frame=gen_wrist_link_frame)
 def gen_wrist_link(
     link_name: str,
     box1_width: float,
@@ -239,23 +311,46 @@ def gen_wrist_link(
     box2_offset_z: float = 0.0,
     joint_xyz: np.ndarray = None) -> Link:
 
-    # Generate a box1 
-    box1 = Workplane("XY").box(box1_width, box1_length, box1_height).translate((0, box1_length/2.0, 0))
+    def build_geometry():
+        from cadquery import Workplane
 
-    # Generate box2s
-    box21 = Workplane("XY").box(box2_width, box2_length, box2_height).translate((box2_span/2, box2_offset_y + box2_length/2, box2_offset_z))
-    box22 = Workplane("XY").box(box2_width, box2_length, box2_height).translate((-box2_span/2, box2_offset_y + box2_length/2, box2_offset_z))
+        # Generate a box1 
+        box1 = Workplane("XY").box(box1_width, box1_length, box1_height).translate((0, box1_length/2.0, 0))
 
-    # Combine the boxes
-    link_geometry = box1 + box21 + box22
+        # Generate box2s
+        box21 = Workplane("XY").box(box2_width, box2_length, box2_height).translate((box2_span/2, box2_offset_y + box2_length/2, box2_offset_z))
+        box22 = Workplane("XY").box(box2_width, box2_length, box2_height).translate((-box2_span/2, box2_offset_y + box2_length/2, box2_offset_z))
 
-    # set next joint position
-    if joint_xyz is None:
-        joint_xyz = np.array([0, box1_length + box2_length/2, box2_offset_z])
-    joint_rpy = np.zeros(3)
+        # Combine the boxes
+        return box1 + box21 + box22
+
+    # box1とbox2は重なることがあるので、重なり部分を差し引いて計算する
+    box1_center = np.array([0, box1_length/2.0, 0])
+    box2_center = np.array([box2_span/2, box2_offset_y + box2_length/2, box2_offset_z])
+    box1_half = np.array([box1_width, box1_length, box1_height]) / 2.0
+    box2_half = np.array([box2_width, box2_length, box2_height]) / 2.0
+    mirror_x = np.array([-1.0, 1.0, 1.0])
+    mass_properties = MassProperties.box_union([
+        (box1_center - box1_half, box1_center + box1_half),
+        (box2_center - box2_half, box2_center + box2_half),
+        (box2_center * mirror_x - box2_half, box2_center * mirror_x + box2_half),
+    ])
 
-    return Link(link_name=link_name, link_geometry=link_geometry, joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3))
+    frame = gen_wrist_link_frame(box1_length, box1_height, box2_length, box2_offset_z, joint_xyz)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
 
+    collision_primitives = [
+        CollisionPrimitive.box([box1_width, box1_length, box1_height], origin_xyz=np.array([0, box1_length/2.0, 0])),
+        CollisionPrimitive.box([box2_width, box2_length, box2_height], origin_xyz=np.array([box2_span/2, box2_offset_y + box2_length/2, box2_offset_z])),
+        CollisionPrimitive.box([box2_width, box2_length, box2_height], origin_xyz=np.array([-box2_span/2, box2_offset_y + box2_length/2, box2_offset_z])),
+    ]
+
+    return Link(link_name=link_name, link_geometry=LazyGeometry(build_geometry), joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3), collision_primitives=collision_primitives, mass_properties=mass_properties)
+
+def gen_horizontal_link_frame(link_length: float, link_width: float, link_height: float, **params) -> LinkFrame:
+    return LinkFrame(np.array([0, link_length, 0]), np.array([0, 0, 0]), capsule_radius=min(link_width, link_height)/2.0)
+
+@link_generator(frame=gen_horizontal_link_frame)
 def gen_horizontal_link(
     link_name: str,
     link_length: float,
@@ -286,30 +381,28 @@ def gen_horizontal_link(
     if root_joint_structure:
         link_body_length = link_body_length - link_width/2.0
         if (isinstance(root_joint_structure, str) and root_joint_structure.lower() == "clevis") or root_joint_structure is True:
-            root_joint_solid_top = make_d_shape(link_width, link_height/10).translate((0, 0, link_height/2.0 - link_height/10/2.0))
-            root_joint_solid_bottom = make_d_shape(link_width, link_height/10).translate((0, 0, -link_height/2.0 + link_height/10/2.0))
-            root_joint_solid = root_joint_solid_top.union(root_joint_solid_bottom).rotate((0, 0, 0), (0, 0, 1), 180)
+            root_joint_mass = (MassProperties.d_shape(link_width, link_height/10).translate((0, 0, link_height/2.0 - link_height/10/2.0))
+                               + MassProperties.d_shape(link_width, link_height/10).translate((0, 0, -link_height/2.0 + link_height/10/2.0))).rotate((0, 0, 0), (0, 0, 1), 180)
         elif isinstance(root_joint_structure, str) and root_joint_structure.lower() == "tang":
-            root_joint_solid = make_d_shape(link_width, 0.75 * link_height).rotate((0, 0, 0), (0, 0, 1), 180)
+            root_joint_mass = MassProperties.d_shape(link_width, 0.75 * link_height).rotate((0, 0, 0), (0, 0, 1), 180)
         else:
             raise ValueError("root_joint_structure must be 'clevis', 'tang' or True. If you want to disable the root joint structure, set it to False.")
-        root_joint_solid = root_joint_solid.translate((0, +link_width/2.0, 0))
+        root_joint_mass = root_joint_mass.translate((0, +link_width/2.0, 0))
     else:
-        root_joint_solid = cq.Compound.makeCompound([])
+        root_joint_mass = MassProperties()
 
     if tip_joint_structure:
         link_body_length = link_body_length - link_width/2.0
         if (isinstance(tip_joint_structure, str) and tip_joint_structure.lower() == "clevis") or tip_joint_structure is True:
-            tip_joint_solid_top = make_d_shape(link_width, link_height/10).translate((0, 0, link_height/2.0 - link_height/10/2.0))
-            tip_joint_solid_bottom = make_d_shape(link_width, link_height/10).translate((0, 0, -link_height/2.0 + link_height/10/2.0))
-            tip_joint_solid = tip_joint_solid_top.union(tip_joint_solid_bottom)
+            tip_joint_mass = MassProperties.d_shape(link_width, link_height/10).translate((0, 0, link_height/2.0 - link_height/10/2.0)) \
+                            + MassProperties.d_shape(link_width, link_height/10).translate((0, 0, -link_height/2.0 + link_height/10/2.0))
         elif isinstance(tip_joint_structure, str) and tip_joint_structure.lower() == "tang":
-            tip_joint_solid = make_d_shape(link_width, 0.75 * link_height)
+            tip_joint_mass = MassProperties.d_shape(link_width, 0.75 * link_height)
         else:
             raise ValueError("tip_joint_structure must be 'clevis', 'tang' or True. If you want to disable the root joint structure, set it to False.")
-        tip_joint_solid = tip_joint_solid.translate((0, link_length-link_width/2.0, 0))
+        tip_joint_mass = tip_joint_mass.translate((0, link_length-link_width/2.0, 0))
     else:
-        tip_joint_solid = cq.Compound.makeCompound([])
+        tip_joint_mass = MassProperties()
 
     origin = np.array([0, link_width/2.0 * (1.0 if root_joint_structure else 0.0), 0]) \
             + np.zeros(3) \
@@ -318,23 +411,52 @@ def gen_horizontal_link(
     # ボディ形状の選択
     if link_body_length > 0:
         if body_shape == "box":
-            box_solid = Workplane("XY").box(link_width, link_body_length, link_height).translate(tuple(origin))
+            body_mass = MassProperties.box((link_width, link_body_length, link_height)).translate(tuple(origin))
         elif body_shape == "cylinder":
-            # 円筒の直径=link_width, 高さ=link_body_length, 中心をoriginに合わせる
-            # 円筒の長手方向をY軸に合わせる
-            box_solid = Workplane("XY").circle(link_width/2).extrude(link_body_length).rotate((0,0,0), (1,0,0), -90).translate(tuple(np.array([0,link_width/2.0* (1.0 if root_joint_structure else 0.0),0])))
+            body_mass = MassProperties.cylinder(link_width/2, link_body_length).rotate((0,0,0), (1,0,0), -90).translate(tuple(np.array([0,link_width/2.0* (1.0 if root_joint_structure else 0.0),0])))
 
         else:
             raise ValueError("body_shape must be 'box' or 'cylinder'")
     else:
-        box_solid = cq.Compound.makeCompound([])
+        body_mass = MassProperties()
+
+    def build_geometry():
+        import cadquery as cq
+        from cadquery import Workplane
+
+        if link_body_length > 0:
+            if body_shape == "box":
+                box_solid = Workplane("XY").box(link_width, link_body_length, link_height).translate(tuple(origin))
+            else:
+                # 円筒の直径=link_width, 高さ=link_body_length, 中心をoriginに合わせる
+                # 円筒の長手方向をY軸に合わせる
+                box_solid = Workplane("XY").circle(link_width/2).extrude(link_body_length).rotate((0,0,0), (1,0,0), -90).translate(tuple(np.array([0,link_width/2.0* (1.0 if root_joint_structure else 0.0),0])))
+        else:
+            box_solid = cq.Compound.makeCompound([])
+        if root_joint_structure:
+            root_joint_solid = make_joint_solid(root_joint_structure, link_width, link_height).rotate((0, 0, 0), (0, 0, 1), 180).translate((0, +link_width/2.0, 0))
+        else:
+            root_joint_solid = cq.Compound.makeCompound([])
+        if tip_joint_structure:
+            tip_joint_solid = make_joint_solid(tip_joint_structure, link_width, link_height).translate((0, link_length-link_width/2.0, 0))
+        else:
+            tip_joint_solid = cq.Compound.makeCompound([])
+        return box_solid + root_joint_solid + tip_joint_solid
 
-    link_geometry = box_solid + root_joint_solid + tip_joint_solid
-    joint_xyz = np.array([0, link_length, 0])
-    joint_rpy = np.array([0, 0, 0])
+    mass_properties = body_mass + root_joint_mass + tip_joint_mass
+    frame = gen_horizontal_link_frame(link_length, link_width, link_height)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
 
-    return Link(link_name=link_name, link_geometry=link_geometry, joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3))
+    return Link(link_name=link_name, link_geometry=LazyGeometry(build_geometry), joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3), mass_properties=mass_properties)
+
+def gen_simple_cylinder_link_frame(link_length: float, link_radius: float, origin_xyz: np.ndarray = np.zeros(3), joint_xyz: np.ndarray = None, joint_rpy: np.ndarray = None, **params) -> LinkFrame:
+    if joint_xyz is None:
+        joint_xyz = np.array([0, 0, link_length-origin_xyz[2]])
+    if joint_rpy is None:
+        joint_rpy = np.zeros(3)
+    return LinkFrame(joint_xyz, joint_rpy, capsule_radius=link_radius)
 
+@link_generator(frame=gen_simple_cylinder_link_frame)
 def gen_simple_cylinder_link(
     link_name: str,
     link_length: float,
@@ -344,22 +466,26 @@ def gen_simple_cylinder_link(
     joint_rpy: np.ndarray = None
     ) -> Link:
 
-    # Generate a simple cylinder link
-    cylinder = Workplane("XY").circle(link_radius).extrude(link_length)
+    def build_geometry():
+        from cadquery import Workplane
 
-    cylinder = cylinder.translate(tuple(-origin_xyz))
+        # Generate a simple cylinder link
+        cylinder = Workplane("XY").circle(link_radius).extrude(link_length)
+        return cylinder.translate(tuple(-origin_xyz))
 
-    if joint_xyz is None:
-        joint_xyz = np.array([0, 0, link_length-origin_xyz[2]])
-    if joint_rpy is None:
-        joint_rpy = np.zeros(3)
+    frame = gen_simple_cylinder_link_frame(link_length, link_radius, origin_xyz, joint_xyz, joint_rpy)
+    joint_xyz, joint_rpy = frame.joint_xyz, frame.joint_rpy
 
-    link_geometry = cylinder
-    return Link(link_name=link_name, link_geometry=link_geometry, joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3))
+    collision_primitives = [CollisionPrimitive.cylinder(link_radius, link_length, origin_xyz=np.array([0, 0, link_length/2]) - origin_xyz)]
+    mass_properties = MassProperties.cylinder(link_radius, link_length).translate(tuple(-origin_xyz))
+    return Link(link_name=link_name, link_geometry=LazyGeometry(build_geometry), joint_xyz=joint_xyz, joint_rpy=joint_rpy, geometry_xyz=np.zeros(3), geometry_rpy=np.zeros(3), collision_primitives=collision_primitives, mass_properties=mass_properties)
     
 
 def xyz_axes(vector_xyz: np.ndarray = np.zeros(3),vector_rpy: np.ndarray = np.zeros(3)):
     """X, Y, Z軸を表示する関数"""
+    cq = load_cad()
+    from cadquery import Workplane
+
     # 赤: X軸、緑: Y軸、青: Z軸
     axis_length = 5  # 円柱の長さ
     axis_radius = 0.2  # 円柱の半径
@@ -484,6 +610,4 @@ def test():
 # with open('test_robot.srdf', 'w') as f:
 #     f.write(srdf)
 if __name__ == "__main__":
-    test()
-    # Initialize and run the server
-    # mcp.run(transport='stdio')
\ No newline at end of file
+    test()
\ No newline at end of file
@@ -1,295 +1,299 @@
-import cadquery as cq
-from cadquery.vis import show
-from cadquery import Workplane
-from cadquery import *
-from cadquery.func import *
-import math
-from enum import Enum
-from typing import Any
-import numpy as np
+import time
+_import_started = time.perf_counter()
+import sys
 import os
-from link_and_joint_class import *
-from snake_link import *
-
-from mcp.server.fastmcp import FastMCP
+import itertools
+from robot_spec import SPEC_DIR, RobotSpec, build_robot
+from build_manifest import BuildManifest
+from publish import current_build_dir
+from blanket_targets import load_blanket_targets, handling_targets
+from kinematics import inverse_kinematics
+from design_sweep import sweep_designs
+from reachability import reachability_map_for
+from cad_loader import import_timings
+from worker_pool import run_in_worker, start_worker_pool, worker_pool_status
+from build_requests import BuildCancelled, BuildCoalescer, ProgressSummary
+from build_jobs import BuildJobQueue
+
+from mcp.server.fastmcp import Context, FastMCP
+
+# cadquery を読み込まずにここまで来るので、サーバーはすぐに list_tools に応答できる
+SERVER_IMPORT_TIME = time.perf_counter() - _import_started
 
 mcp = FastMCP("mcp_robot2")
 
 targetdir = "../MFFRUnity/Assets/TemporaryRobotDescription"
+# 同じ出力先への連続した更新要求は最後のものだけを生成・公開する
+build_coalescer = BuildCoalescer()
+# submit_robot_build のジョブはそれぞれ jobs_dir/<job_id> に出力する。'.' で始まるのでUnityは読み込まない
+jobs_dir = "../MFFRUnity/Assets/.RobotBuildJobs"
+build_jobs = BuildJobQueue(jobs_dir)
+
+SNAKE_SPEC_PATH = os.path.join(SPEC_DIR, "snake_transporter.json")
+# list_of_length の各要素が設定するリンク
+SNAKE_LENGTH_LINKS = ["link_01", "link_02", "link_03", "link_06", "link_07"]
 
-def template_of_snake_robot():
+def snake_robot_spec(list_of_length: list) -> RobotSpec:
+    """
+    Get the spec of the snake transporter with the given link lengths.
+
+    Args:
+        list_of_length (list of float): lengths of link_01, link_02, link_03, link_06 and link_07.
+    """
+    if len(list_of_length) != len(SNAKE_LENGTH_LINKS):
+        raise ValueError(f"list_of_length must have {len(SNAKE_LENGTH_LINKS)} elements.")
+    spec = RobotSpec.load(SNAKE_SPEC_PATH)
+    return spec.patch({f"links.{name}.params.link_length": float(length) for name, length in zip(SNAKE_LENGTH_LINKS, list_of_length)})
+
+def template_of_snake_robot(parallel: bool = False, collision_method: str = "convex"):
     """
     Update the telbot type to the telbot type based on given link lengths.
 
     Args:
-        list_of_length: List of lengths.
+        parallel: build the links in a process pool
+        collision_method: "convex", "decimate" or "copy" (see collision_geometry)
+
+    Returns:
+        tuple[str, str]: paths of the written URDF and SRDF
     """
-    
-
-    # Delete the existing mesh directory if it exists
-    if os.path.exists(f"{targetdir}/mesh"):
-        import shutil
-        shutil.rmtree(f"{targetdir}/mesh")
-    if os.path.exists(f"{targetdir}/collision"):
-        import shutil
-        shutil.rmtree(f"{targetdir}/collision")
-
-
-    robot_description = '<?xml version="1.0" ?>\n<robot name="test_robot">\n'
-    robot_description += Link("world", None).get_link_description()
-
-
-    srdf_description = '<?xml version="1.0" ?>\n'
-    srdf_description += '<robot name="test_robot">\n'
-    srdf_description += '\t<group name="arm">\n'
-
-    base_link = gen_base_rail_link(link_name = "base_link", rail_length=10.0, rail_width=1.0, rail_size=0.1, origin_xyz=np.zeros(3), origin_rpy=np.zeros(3), joint_xyz=None, joint_rpy=None )
-    base_link.gen_mesh_file(targetdir=targetdir)
-    joint_world_to_base = Joint("world_joint", JointType.fixed, Link("world", None), base_link)
-    robot_description += joint_world_to_base.get_joint_description()
-    robot_description += base_link.get_link_description()
-    srdf_description += joint_world_to_base.get_joint_description_srdf()
-
-    links = [base_link]
-
-    link_01 = gen_horizontal_link( link_name="link_01", link_length=1.0, link_width=0.7, link_height=0.375*2, root_joint_structure=False, tip_joint_structure="Clevis", body_shape="box")
-    link_01.gen_mesh_file(targetdir=targetdir)
-    joint_01 = Joint("joint_01", JointType.prismatic, base_link, link_01, origin_xyz=np.array([0, 0, 0.375]), axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_01.get_joint_description()
-    robot_description += link_01.get_link_description()
-    srdf_description += joint_01.get_joint_description_srdf()
-    links.append(link_01)
-
-    link_02 = gen_horizontal_link( link_name="link_02", link_length=1.41, link_width=0.7, link_height=0.375*2, root_joint_structure="tang", tip_joint_structure="Clevis", body_shape="box")
-    link_02.gen_mesh_file(targetdir=targetdir)
-    joint_02 = Joint("joint_02", JointType.revolute, link_01, link_02)
-    robot_description += joint_02.get_joint_description()
-    robot_description += link_02.get_link_description()
-    srdf_description += joint_02.get_joint_description_srdf()
-    links.append(link_02)
-
-    link_03 = gen_horizontal_link( link_name="link_03", link_length=1.13, link_width=0.7, link_height=0.375*2, root_joint_structure="tang", tip_joint_structure=False, body_shape="box")
-    link_03.gen_mesh_file(targetdir=targetdir)
-    joint_03 = Joint("joint_03", JointType.revolute, link_02, link_03)
-    robot_description += joint_03.get_joint_description()
-    robot_description += link_03.get_link_description()
-    srdf_description += joint_03.get_joint_description_srdf()
-    links.append(link_03)
-
-    link_04 = gen_gimbal_link2(link_name="link_04", cylinder1_radius=0.435*2, cylinder1_length=0.11, cylinder2_offset_y=0.565257, cylinder2_offset_z=0.356751, cylinder2_radius=0.87, cylinder2_width=0.88, joint_structure="tang")
-    link_04.gen_mesh_file(targetdir=targetdir)
-    joint_04 = Joint("joint_04", JointType.revolute, link_03, link_04, axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_04.get_joint_description()
-    robot_description += link_04.get_link_description()
-    srdf_description += joint_04.get_joint_description_srdf()
-    links.append(link_04)
-
-    link_05 = gen_gimbal_link2(link_name="link_05", cylinder1_radius=0, cylinder1_length=0, cylinder2_offset_y=0.86, cylinder2_offset_z=0.39, cylinder2_radius=0.9, cylinder2_width=0.9, joint_structure="clevis", reverse=True)
-    link_05.gen_mesh_file(targetdir=targetdir)
-    joint_05 = Joint("joint_05", JointType.revolute, link_04, link_05, axis_xyz=np.array([1, 0, 0]),origin_rpy=np.array([0, 0, math.pi]))
-    robot_description += joint_05.get_joint_description()
-    robot_description += link_05.get_link_description()
-    srdf_description += joint_05.get_joint_description_srdf()
-    links.append(link_05)
-
-    link_06 = gen_horizontal_link( link_name="link_06", link_length=1.175, link_width=0.7, link_height=0.26*2, root_joint_structure=False, tip_joint_structure="tang", body_shape="box")
-    link_06.gen_mesh_file(targetdir=targetdir)
-    joint_06 = Joint("joint_06", JointType.revolute, link_05, link_06, axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_06.get_joint_description()
-    robot_description += link_06.get_link_description()
-    srdf_description += joint_06.get_joint_description_srdf()
-    links.append(link_06)
-
-    link_07 = gen_horizontal_link( link_name="link_07", link_length=0.62, link_width=0.48, link_height=0.44, root_joint_structure="Clevis", tip_joint_structure=False, body_shape="box")
-    link_07.gen_mesh_file(targetdir=targetdir)
-    joint_07 = Joint("joint_07", JointType.revolute, link_06, link_07)
-    robot_description += joint_07.get_joint_description()
-    robot_description += link_07.get_link_description()
-    srdf_description += joint_07.get_joint_description_srdf()
-    links.append(link_07)
-
-    link_08 = gen_wrist_link( link_name="link_08", box1_width=0.8, box1_length=0.32, box1_height=0.52, box2_width=0.2, box2_length=1.0, box2_height=0.2, box2_span=0.72, box2_offset_y=0.0, box2_offset_z=0.2, joint_xyz=np.array([0.0, 0.68,0.2]))
-    link_08.gen_mesh_file(targetdir=targetdir)
-    joint_08 = Joint("joint_08", JointType.revolute, link_07, link_08,axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_08.get_joint_description()
-    robot_description += link_08.get_link_description()
-    srdf_description += joint_08.get_joint_description_srdf()
-    links.append(link_08)
-
-    link_09 = gen_simple_cylinder_link(link_name="link_09", link_length=0.8, link_radius=0.26, origin_xyz=np.array([0.0, 0.0, 0.15]))
-    link_09.gen_mesh_file(targetdir=targetdir)
-    joint_09 = Joint("joint_09", JointType.revolute, link_08, link_09,axis_xyz=np.array([1, 0, 0]),origin_rpy=np.array([-math.pi/2, 0, 0]))
-    robot_description += joint_09.get_joint_description()
-    robot_description += link_09.get_link_description()
-    srdf_description += joint_09.get_joint_description_srdf()
-    links.append(link_09)
-
-    link_10 = gen_simple_cylinder_link(link_name="link_10", link_length=0.2, link_radius=0.2)
-    link_10.gen_mesh_file(targetdir=targetdir)
-    joint_10 = Joint("joint_10", JointType.revolute, link_09, link_10)
-    robot_description += joint_10.get_joint_description()
-    robot_description += link_10.get_link_description()
-    srdf_description += joint_10.get_joint_description_srdf()
-    links.append(link_10)
-
-
-    robot_description += '</robot>'
-
-    srdf_description += '\t</group>\n'
-    srdf_description += f'\t<end_effector name="eef" parent_link="{link_10.link_name}" group="arm"/>\n'
-    srdf_description += '\t<virtual_joint name="virtual_joint" type="fixed" parent_frame="world" child_link="base_link"/>\n'
-    for i in range(len(links) - 1):
-        srdf_description += f'\t<disable_collisions link1="{links[i].link_name}" link2="{links[i+1].link_name}" reason="Adjacent"/>\n'
-
-    srdf_description += '</robot>'
-    # print(robot_description)
-    # Save the descriptions to files
-    with open(f"{targetdir}/temporary_robot.urdf", 'w') as f:
-        f.write(robot_description)
-    with open(f"{targetdir}/temporary_robot.srdf", 'w') as f:
-        f.write(srdf_description)
-
-    return robot_description , srdf_description
+    list_of_length = [1.0, 1.41, 1.13, 1.175, 0.62]
+
+    build_robot(snake_robot_spec(list_of_length), targetdir, parallel=parallel, mesh_options={"collision_method": collision_method})
+
+    return f"{targetdir}/temporary_robot.urdf", f"{targetdir}/temporary_robot.srdf"
 
 
 
 @mcp.tool()
-async def update_snake_robot_link_length(list_of_length=[1.0, 1.41, 1.13,1.175, 0.62]):
+async def update_snake_robot_link_length(ctx: Context, list_of_length=[1.0, 1.41, 1.13,1.175, 0.62], parallel: bool = False, collision_method: str = "convex"):
     """
     Update the snake robot's link lengths based on the provided list.
 
+    Progress notifications are sent per phase and per link, and the meshes of each link are
+    published as soon as they are ready; the URDF follows when all links are done.
+
     Args:
         list_of_length (list of float): List specifying the length of each link. 
             The order corresponds to each link in the robot arm.
+        parallel (bool): If True, generate the link geometries and meshes in a process pool.
+        collision_method (str): "convex" (convex hulls), "decimate" (reduced mesh) or "copy"
+            (full resolution visual mesh) for the collision geometry.
+    Returns:
+        dict: collision geometry report (hull count, triangle count, Hausdorff error) per link,
+            or {"status": "superseded", ...} if a newer call replaced this one before it was published.
+            Calls made in quick succession are coalesced and only the last configuration is built.
+    """
+
+    summary = ProgressSummary()
+
+    async def on_progress(event: dict) -> None:
+        summary.update(event)
+        await ctx.report_progress(summary.done, summary.total, summary.message)
+
+    # CADの処理はワーカープロセスで行い、その間もイベントループは他の要求に応答する
+    try:
+        result = await build_coalescer.submit(targetdir, build_robot, snake_robot_spec(list_of_length), targetdir, on_progress=on_progress,
+                                              parallel=parallel, mesh_options={"collision_method": collision_method}, progressive=True)
+    except BuildCancelled as e:
+        return {"status": "superseded", "list_of_length": list_of_length, "reason": str(e)}
+
+    return result["collision_reports"]
+
+@mcp.tool()
+async def submit_robot_build(list_of_length: list[float]|None = None, spec: dict|None = None, patch: dict|None = None,
+                             priority: int = 0, parallel: bool = False, collision_method: str = "convex"):
+    """
+    Queue a robot build that runs in the background and writes to a directory of its own.
+
+    Several jobs run at the same time (up to half the number of CPUs) and the others wait
+    in the queue, highest priority first. Follow the job with get_build_status and get its
+    output with get_build_result. update_snake_robot_link_length is not affected. Only the
+    output of the last 16 finished jobs is kept.
+
+    Args:
+        list_of_length (list of float): link lengths of the snake transporter, as in update_snake_robot_link_length
+        spec (dict): a complete robot spec (see robot_spec.RobotSpec) instead of the snake transporter
+        patch (dict): spec fields to change by dotted path, e.g. {"links.link_02.params.link_length": 1.5}
+        priority (int): jobs with a higher priority start first
+        parallel (bool): generate the links of the job in a process pool
+        collision_method (str): "convex", "decimate" or "copy"
+    Returns:
+        dict: status of the new job (see get_build_status), including "job_id"
+    """
+    if spec is not None and list_of_length is not None:
+        raise ValueError("Give either list_of_length or spec.")
+    robot_spec = RobotSpec(spec) if spec is not None else snake_robot_spec(list_of_length or [1.0, 1.41, 1.13, 1.175, 0.62])
+    if patch:
+        robot_spec.patch(patch)
+    description = {"robot": robot_spec.name, "list_of_length": list_of_length}
+    job = build_jobs.submit(build_robot, robot_spec, priority=priority, description=description,
+                            parallel=parallel, mesh_options={"collision_method": collision_method})
+    return {**job.status(), "queue_position": build_jobs.queue_position(job)}
+
+@mcp.tool()
+async def get_build_status(job_id: str|None = None):
+    """
+    Get the status of a job of submit_robot_build, or of all jobs.
+
+    Args:
+        job_id (str): job to report. All jobs if None.
+    Returns:
+        dict: {"job_id", "state" ("queued", "running", "done" or "failed"), "priority", "targetdir",
+            "submitted", "started", "finished" (UNIX times), "progress": {"done", "total", "message"},
+            "error", "queue_position"}, or {"jobs": [...]} for all jobs
+    """
+    if job_id is None:
+        return {"jobs": [{**job.status(), "queue_position": build_jobs.queue_position(job)} for job in build_jobs.jobs.values()]}
+    job = build_jobs.job(job_id)
+    return {**job.status(), "queue_position": build_jobs.queue_position(job)}
+
+@mcp.tool()
+async def get_build_result(job_id: str):
+    """
+    Get the output of a finished job of submit_robot_build.
+
+    Args:
+        job_id (str): job id returned by submit_robot_build
+    Returns:
+        dict: {"job_id", "state", "urdf", "srdf" (paths), "rebuilt_links", "collision_reports"} when the
+            job is done, otherwise its status (see get_build_status)
+    """
+    job = build_jobs.job(job_id)
+    if job.state != "done":
+        return {**job.status(), "queue_position": build_jobs.queue_position(job)}
+    return {
+        "job_id": job.job_id,
+        "state": job.state,
+        "urdf": os.path.join(job.targetdir, "temporary_robot.urdf"),
+        "srdf": os.path.join(job.targetdir, "temporary_robot.srdf"),
+        "rebuilt_links": job.result["rebuilt_links"],
+        "collision_reports": job.result["collision_reports"],
+    }
+
+def blanket_reachability(directory: str, blanket_names: list[str], link: str) -> dict:
+    """Body of check_blanket_reachability, run in a worker process."""
+    model = BuildManifest(current_build_dir(directory)).kinematic_model()
+    reachability = reachability_map_for(model, directory, link=link)
+    targets = load_blanket_targets()
+    unknown = [name for name in blanket_names if name not in targets]
+    if unknown:
+        raise ValueError(f"Unknown blankets: {', '.join(unknown)}")
+    return {name: reachability.can_reach_blanket(targets[name]) for name in blanket_names}
+
+@mcp.tool()
+async def check_blanket_reachability(blanket_names: list[str], link: str = "link_10"):
+    """
+    Check whether a link of the last generated snake robot can reach blanket modules.
+
+    The answer comes from a reachability map stored next to the URDF. The map is rebuilt
+    (a few seconds) only after the kinematics of the robot changed.
+
+    Args:
+        blanket_names (list of str): blanket modules, e.g. ["SB01C05"] (see blanket_configuration.json)
+        link (str): link that has to reach the blankets
+    Returns:
+        dict: {blanket name: True if the link reached the voxel of the blanket}
+    """
+    return await run_in_worker(blanket_reachability, targetdir, blanket_names, link)
+
+def blanket_handling(directory: str, blanket_names: list[str]|None, link: str) -> dict:
+    """Body of solve_blanket_handling, run in a worker process."""
+    model = BuildManifest(current_build_dir(directory)).kinematic_model()
+    targets = load_blanket_targets()
+    blanket_names = list(targets) if blanket_names is None else blanket_names
+    unknown = [name for name in blanket_names if name not in targets]
+    if unknown:
+        raise ValueError(f"Unknown blankets: {', '.join(unknown)}")
+    positions, approach_axes = handling_targets([targets[name] for name in blanket_names])
+    solutions, solved, errors = inverse_kinematics(model, positions, approach_axes, link=link)
+    return {
+        name: {"solved": bool(ok), "error": float(error), "joint_positions": dict(zip(model.joint_names, q.tolist()))}
+        for name, q, ok, error in zip(blanket_names, solutions, solved, errors)
+    }
+
+@mcp.tool()
+async def solve_blanket_handling(blanket_names: list[str]|None = None, link: str = "link_10"):
+    """
+    Solve the inverse kinematics of the last generated snake robot for blanket handling poses.
+
+    All blankets are solved in one batch: the link has to reach the plasma-facing side of
+    each module with its z axis pointing against the module normal.
+
+    Args:
+        blanket_names (list of str): blanket modules, e.g. ["SB01C05"]. All modules of blanket_configuration.json if None.
+        link (str): link that handles the blankets
     Returns:
-        tuple: (robot_description, srdf_description)
+        dict: {blanket name: {"solved": bool, "error": remaining error, "joint_positions": {joint: position}}}
     """
+    return await run_in_worker(blanket_handling, targetdir, blanket_names, link)
+
+def sweep_link_lengths(list_of_lengths: list[list[float]]|None, length_grid: list[list[float]]|None,
+                       blanket_names: list[str]|None, top: int, parallel: bool) -> list[dict]:
+    """Body of sweep_snake_robot_link_lengths, run in a worker process."""
+    candidates = [list(lengths) for lengths in list_of_lengths or []]
+    if length_grid is not None:
+        if len(length_grid) != len(SNAKE_LENGTH_LINKS):
+            raise ValueError(f"length_grid must have {len(SNAKE_LENGTH_LINKS)} lists of candidate lengths.")
+        candidates.extend(list(lengths) for lengths in itertools.product(*length_grid))
+    if not candidates:
+        raise ValueError("Give list_of_lengths or length_grid.")
+    targets = load_blanket_targets()
+    blanket_names = list(targets) if blanket_names is None else blanket_names
+    unknown = [name for name in blanket_names if name not in targets]
+    if unknown:
+        raise ValueError(f"Unknown blankets: {', '.join(unknown)}")
+    positions, approach_axes = handling_targets([targets[name] for name in blanket_names])
+
+    rows = sweep_designs([snake_robot_spec(lengths) for lengths in candidates], positions, approach_axes, parallel=parallel, link="link_10")
+    return [{
+        "rank": row["rank"],
+        "list_of_length": candidates[row["index"]],
+        "total_length": float(sum(candidates[row["index"]])),
+        "reachable": row["reachable"],
+        "solved": row["solved"],
+        "self_collisions": row["self_collisions"],
+        "mean_manipulability": row["mean_manipulability"],
+    } for row in rows[:top]]
 
-    # Delete the existing mesh directory if it exists
-    if os.path.exists(f"{targetdir}/mesh"):
-        import shutil
-        shutil.rmtree(f"{targetdir}/mesh")
-    if os.path.exists(f"{targetdir}/collision"):
-        import shutil
-        shutil.rmtree(f"{targetdir}/collision")
-
-
-    robot_description = '<?xml version="1.0" ?>\n<robot name="test_robot">\n'
-    robot_description += Link("world", None).get_link_description()
-
-
-    srdf_description = '<?xml version="1.0" ?>\n'
-    srdf_description += '<robot name="test_robot">\n'
-    srdf_description += '\t<group name="arm">\n'
-
-    base_link = gen_base_rail_link(link_name = "base_link", rail_length=10.0, rail_width=1.0, rail_size=0.1, origin_xyz=np.zeros(3), origin_rpy=np.zeros(3), joint_xyz=None, joint_rpy=None )
-    base_link.gen_mesh_file(targetdir=targetdir)
-    joint_world_to_base = Joint("world_joint", JointType.fixed, Link("world", None), base_link)
-    robot_description += joint_world_to_base.get_joint_description()
-    robot_description += base_link.get_link_description()
-    srdf_description += joint_world_to_base.get_joint_description_srdf()
-
-    links = [base_link]
-
-    link_01 = gen_horizontal_link( link_name="link_01", link_length=list_of_length[0], link_width=0.7, link_height=0.375*2, root_joint_structure=False, tip_joint_structure="Clevis", body_shape="box")
-    link_01.gen_mesh_file(targetdir=targetdir)
-    joint_01 = Joint("joint_01", JointType.prismatic, base_link, link_01, origin_xyz=np.array([0, 0, 0.375]), axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_01.get_joint_description()
-    robot_description += link_01.get_link_description()
-    srdf_description += joint_01.get_joint_description_srdf()
-    links.append(link_01)
-
-    link_02 = gen_horizontal_link( link_name="link_02", link_length=list_of_length[1], link_width=0.7, link_height=0.375*2, root_joint_structure="tang", tip_joint_structure="Clevis", body_shape="box")
-    link_02.gen_mesh_file(targetdir=targetdir)
-    joint_02 = Joint("joint_02", JointType.revolute, link_01, link_02)
-    robot_description += joint_02.get_joint_description()
-    robot_description += link_02.get_link_description()
-    srdf_description += joint_02.get_joint_description_srdf()
-    links.append(link_02)
-
-    link_03 = gen_horizontal_link( link_name="link_03", link_length=list_of_length[2], link_width=0.7, link_height=0.375*2, root_joint_structure="tang", tip_joint_structure=False, body_shape="box")
-    link_03.gen_mesh_file(targetdir=targetdir)
-    joint_03 = Joint("joint_03", JointType.revolute, link_02, link_03)
-    robot_description += joint_03.get_joint_description()
-    robot_description += link_03.get_link_description()
-    srdf_description += joint_03.get_joint_description_srdf()
-    links.append(link_03)
-
-    link_04 = gen_gimbal_link2(link_name="link_04", cylinder1_radius=0.435*2, cylinder1_length=0.11, cylinder2_offset_y=0.565257, cylinder2_offset_z=0.356751, cylinder2_radius=0.87, cylinder2_width=0.88, joint_structure="tang")
-    link_04.gen_mesh_file(targetdir=targetdir)
-    joint_04 = Joint("joint_04", JointType.revolute, link_03, link_04, axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_04.get_joint_description()
-    robot_description += link_04.get_link_description()
-    srdf_description += joint_04.get_joint_description_srdf()
-    links.append(link_04)
-
-    link_05 = gen_gimbal_link2(link_name="link_05", cylinder1_radius=0, cylinder1_length=0, cylinder2_offset_y=0.86, cylinder2_offset_z=0.39, cylinder2_radius=0.9, cylinder2_width=0.9, joint_structure="clevis", reverse=True)
-    link_05.gen_mesh_file(targetdir=targetdir)
-    joint_05 = Joint("joint_05", JointType.revolute, link_04, link_05, axis_xyz=np.array([1, 0, 0]),origin_rpy=np.array([0, 0, math.pi]))
-    robot_description += joint_05.get_joint_description()
-    robot_description += link_05.get_link_description()
-    srdf_description += joint_05.get_joint_description_srdf()
-    links.append(link_05)
-
-    link_06 = gen_horizontal_link( link_name="link_06", link_length=list_of_length[3], link_width=0.7, link_height=0.26*2, root_joint_structure=False, tip_joint_structure="tang", body_shape="box")
-    link_06.gen_mesh_file(targetdir=targetdir)
-    joint_06 = Joint("joint_06", JointType.revolute, link_05, link_06, axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_06.get_joint_description()
-    robot_description += link_06.get_link_description()
-    srdf_description += joint_06.get_joint_description_srdf()
-    links.append(link_06)
-
-    link_07 = gen_horizontal_link( link_name="link_07", link_length=list_of_length[4], link_width=0.48, link_height=0.44, root_joint_structure="Clevis", tip_joint_structure=False, body_shape="box")
-    link_07.gen_mesh_file(targetdir=targetdir)
-    joint_07 = Joint("joint_07", JointType.revolute, link_06, link_07)
-    robot_description += joint_07.get_joint_description()
-    robot_description += link_07.get_link_description()
-    srdf_description += joint_07.get_joint_description_srdf()
-    links.append(link_07)
-
-    link_08 = gen_wrist_link( link_name="link_08", box1_width=0.8, box1_length=0.32, box1_height=0.52, box2_width=0.2, box2_length=1.0, box2_height=0.2, box2_span=0.72, box2_offset_y=0.0, box2_offset_z=0.2, joint_xyz=np.array([0.0, 0.68,0.2]))
-    link_08.gen_mesh_file(targetdir=targetdir)
-    joint_08 = Joint("joint_08", JointType.revolute, link_07, link_08,axis_xyz=np.array([0, 1, 0]))
-    robot_description += joint_08.get_joint_description()
-    robot_description += link_08.get_link_description()
-    srdf_description += joint_08.get_joint_description_srdf()
-    links.append(link_08)
-
-    link_09 = gen_simple_cylinder_link(link_name="link_09", link_length=0.8, link_radius=0.26, origin_xyz=np.array([0.0, 0.0, 0.15]))
-    link_09.gen_mesh_file(targetdir=targetdir)
-    joint_09 = Joint("joint_09", JointType.revolute, link_08, link_09,axis_xyz=np.array([1, 0, 0]),origin_rpy=np.array([-math.pi/2, 0, 0]))
-    robot_description += joint_09.get_joint_description()
-    robot_description += link_09.get_link_description()
-    srdf_description += joint_09.get_joint_description_srdf()
-    links.append(link_09)
-
-    link_10 = gen_simple_cylinder_link(link_name="link_10", link_length=0.2, link_radius=0.2)
-    link_10.gen_mesh_file(targetdir=targetdir)
-    joint_10 = Joint("joint_10", JointType.revolute, link_09, link_10)
-    robot_description += joint_10.get_joint_description()
-    robot_description += link_10.get_link_description()
-    srdf_description += joint_10.get_joint_description_srdf()
-    links.append(link_10)
-
-
-    robot_description += '</robot>'
-
-    srdf_description += '\t</group>\n'
-    srdf_description += f'\t<end_effector name="eef" parent_link="{link_10.link_name}" group="arm"/>\n'
-    srdf_description += '\t<virtual_joint name="virtual_joint" type="fixed" parent_frame="world" child_link="base_link"/>\n'
-    for i in range(len(links) - 1):
-        srdf_description += f'\t<disable_collisions link1="{links[i].link_name}" link2="{links[i+1].link_name}" reason="Adjacent"/>\n'
-
-    srdf_description += '</robot>'
-    # print(robot_description)
-    # Save the descriptions to files
-    with open(f"{targetdir}/temporary_robot.urdf", 'w') as f:
-        f.write(robot_description)
-    with open(f"{targetdir}/temporary_robot.srdf", 'w') as f:
-        f.write(srdf_description)
-
-    return 
+@mcp.tool()
+async def sweep_snake_robot_link_lengths(list_of_lengths: list[list[float]]|None = None, length_grid: list[list[float]]|None = None,
+                                         blanket_names: list[str]|None = None, top: int = 20, parallel: bool = True):
+    """
+    Compare many link length designs of the snake robot without generating any geometry.
+
+    Each design is scored from its kinematics only: batched IK to the blanket handling poses
+    and a capsule self-collision check of the solutions. Generate the meshes of the best
+    design afterwards with update_snake_robot_link_length.
+
+    Args:
+        list_of_lengths (list of list of float): designs, each like the list_of_length of update_snake_robot_link_length
+        length_grid (list of list of float): candidate values per length (5 lists); every combination is evaluated
+        blanket_names (list of str): blanket modules to handle. All modules if None.
+        top (int): number of designs returned
+        parallel (bool): evaluate the designs in a process pool
+    Returns:
+        list[dict]: best designs first, with "list_of_length", "total_length", "reachable" (blankets handled
+            without self-collision), "solved", "self_collisions" and "mean_manipulability"
+    """
+    return await run_in_worker(sweep_link_lengths, list_of_lengths, length_grid, blanket_names, top, parallel)
+
+@mcp.tool()
+async def get_server_import_timing():
+    """
+    Report how long the server took to import its modules and the state of the CAD (cadquery/OCP) import.
+
+    The tools run in a pool of worker processes that load the CAD stack when the server
+    starts, so the server process itself normally never imports it ("cad" stays unloaded).
+
+    Returns:
+        dict: {"server_import": seconds, "cad": {"loaded", "modules": {module: seconds}, "total"},
+            "workers": worker_pool.worker_pool_status(), "builds": BuildCoalescer.status()}
+    """
+    return {"server_import": SERVER_IMPORT_TIME, "cad": import_timings(), "workers": worker_pool_status(), "builds": build_coalescer.status()}
 
 if __name__ == "__main__":
+    # stdout はMCPの通信に使うので、時間はstderrに出す
+    print(f"mcp_robot2: modules imported in {SERVER_IMPORT_TIME:.2f} s, starting the worker pool", file=sys.stderr)
+    start_worker_pool(report=True)
     # Initialize and run the server
     mcp.run(transport='stdio')
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+
+from link_and_joint_class import Link, Joint
+from build_manifest import replace_if_changed
+
+# URDF/SRDF の書式を変えたら上げる（ビルド計画のキーに入るので、前のバージョンが再利用されなくなる）
+DESCRIPTION_FORMAT_VERSION = 1
+
+
+class RobotDescriptionWriter:
+    """
+    Write a URDF and its SRDF element by element to buffered files.
+
+    Each link and joint is written as soon as it is added, so the cost is linear in the
+    number of links and the document is never held in memory. The files are written next
+    to their destination and moved into place on close() only if their content changed,
+    so an unchanged robot does not trigger the Unity watcher.
+
+    Usage:
+        with RobotDescriptionWriter("robot.urdf", "robot.srdf") as writer:
+            writer.add_link(Link("world", None))
+            writer.add_joint(joint)
+            writer.add_link(joint.child_link)
+            writer.finish(end_effector_link="link_10", base_link="base_link", adjacent_links=links)
+    """
+
+    def __init__(self, urdf_path: str, srdf_path: str, robot_name: str = "test_robot", group_name: str = "arm",
+                 newline: str|None = '', buffer_size: int = 1 << 16):
+        """
+        Args:
+            urdf_path: destination of the URDF
+            srdf_path: destination of the SRDF
+            robot_name: name attribute of <robot>
+            group_name: name of the SRDF planning group that contains every joint
+            newline: passed to open(). The default '' writes '\\n' on every platform.
+            buffer_size: size of the write buffer in bytes
+        """
+        self.urdf_path = urdf_path
+        self.srdf_path = srdf_path
+        self.group_name = group_name
+        self.urdf_changed = False
+        self.srdf_changed = False
+        self._urdf_tmp = f"{urdf_path}.{os.getpid()}.tmp"
+        self._srdf_tmp = f"{srdf_path}.{os.getpid()}.tmp"
+        for path in (urdf_path, srdf_path):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._urdf = open(self._urdf_tmp, 'w', newline=newline, buffering=buffer_size)
+        self._srdf = open(self._srdf_tmp, 'w', newline=newline, buffering=buffer_size)
+        self._finished = False
+
+        self._urdf.write(f'<?xml version="1.0" ?>\n<robot name="{robot_name}">\n')
+        self._srdf.write('<?xml version="1.0" ?>\n')
+        self._srdf.write(f'<robot name="{robot_name}">\n')
+        self._srdf.write(f'\t<group name="{group_name}">\n')
+
+    def add_link(self, link: Link) -> None:
+        self._urdf.write(link.get_link_description())
+
+    def add_joint(self, joint: Joint) -> None:
+        """Write the joint to the URDF and add it to the planning group of the SRDF."""
+        self._urdf.write(joint.get_joint_description())
+        self._srdf.write(joint.get_joint_description_srdf())
+
+    def finish(self, end_effector_link: str, base_link: str = "base_link", adjacent_links: list|None = None) -> None:
+        """
+        Close the <robot> and <group> elements and write the rest of the SRDF.
+
+        Args:
+            end_effector_link: parent link of the end effector
+            base_link: child link of the virtual joint to the world frame
+            adjacent_links: links in chain order. Collisions between consecutive links are disabled.
+        """
+        self._urdf.write('</robot>')
+
+        self._srdf.write('\t</group>\n')
+        self._srdf.write(f'\t<end_effector name="eef" parent_link="{end_effector_link}" group="{self.group_name}"/>\n')
+        self._srdf.write(f'\t<virtual_joint name="virtual_joint" type="fixed" parent_frame="world" child_link="{base_link}"/>\n')
+        adjacent_links = adjacent_links or []
+        for link1, link2 in zip(adjacent_links, adjacent_links[1:]):
+            self._srdf.write(f'\t<disable_collisions link1="{link1.link_name}" link2="{link2.link_name}" reason="Adjacent"/>\n')
+        self._srdf.write('</robot>')
+        self._finished = True
+
+    def close(self) -> None:
+        """Flush the files and move them into place if they were finished and changed."""
+        self._urdf.close()
+        self._srdf.close()
+        if self._finished:
+            self.urdf_changed = replace_if_changed(self._urdf_tmp, self.urdf_path)
+            self.srdf_changed = replace_if_changed(self._srdf_tmp, self.srdf_path)
+        else:
+            # 途中で失敗した場合は書きかけのファイルを公開しない
+            for path in (self._urdf_tmp, self._srdf_tmp):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def __enter__(self) -> "RobotDescriptionWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self._finished = False
+        self.close()
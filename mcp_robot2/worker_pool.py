@@ -0,0 +1,139 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cad_loader import load_cad, import_timings
+
+# forkserver が一度だけ読み込み、ワーカーはそこからforkされる（CADカーネルとリンク生成関数の登録が済んだ状態）
+# forkserver がない環境（Windows）では、各ワーカーが起動時に読み込む
+PRELOAD_MODULES = ("cad_loader", "OCP", "cadquery", "cadquery.func", "snake_link", "robot_spec")
+
+_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+_pool_started = None
+_warm_up_futures = []
+# ワーカープロセスの中でだけ設定される（ワーカー1つあたりのCPU数）
+_worker_cpus = None
+
+
+def _initialize_worker(pool_workers: int) -> None:
+    global _worker_cpus
+    _worker_cpus = max(1, (os.cpu_count() or 1) // pool_workers)
+    # stdio のMCPサーバーでは stdout が通信路なので、ワーカーの出力（print など）は stderr に回す
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    # forkserver で読み込み済みなら時間の記録だけ
+    load_cad()
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+
+def worker_cpu_share() -> int|None:
+    """
+    Get the number of CPUs of this process if it is a worker of the pool.
+
+    Returns:
+        int|None: the CPUs divided by the workers of the pool (at least 1), or None outside the workers
+    """
+    return _worker_cpus
+
+
+def _pool_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(list(PRELOAD_MODULES))
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _worker_status() -> dict:
+    return {"pid": os.getpid(), "cad": import_timings()}
+
+
+def _warm_up_workers(pool: ProcessPoolExecutor, workers: int, report: bool) -> None:
+    global _warm_up_futures
+    # forkserver の起動と最初のforkは読み込みが終わるまで待つので、イベントループとは別のスレッドで行う
+    _warm_up_futures = [pool.submit(_worker_status) for _ in range(workers)]
+    if report:
+        for future in _warm_up_futures:
+            future.exception()
+        print(f"worker pool: {workers} workers ready in {time.perf_counter() - _pool_started:.2f} s", file=sys.stderr)
+
+
+def start_worker_pool(max_workers: int|None = None, report: bool = False) -> ProcessPoolExecutor:
+    """
+    Start the persistent process pool of the MCP tools, if it is not running.
+
+    The workers are forked from a forkserver that imported PRELOAD_MODULES once, so each
+    worker starts with the CAD kernel loaded and the link generators registered. Where
+    there is no forkserver (Windows), the workers are spawned and import PRELOAD_MODULES
+    in their initializer. The forkserver is started and the workers are forked in a
+    background thread; this function returns immediately.
+
+    Args:
+        max_workers: number of worker processes, defaults to the number of CPUs
+        report: print to stderr when all workers are ready
+    """
+    global _pool, _pool_workers, _pool_started
+    with _lock:
+        if _pool is None:
+            context = _pool_context()
+            _pool_workers = max_workers or os.cpu_count()
+            _pool_started = time.perf_counter()
+            _pool = ProcessPoolExecutor(max_workers=_pool_workers, mp_context=context, initializer=_initialize_worker, initargs=(_pool_workers,))
+            threading.Thread(target=_warm_up_workers, args=(_pool, _pool_workers, report), name="worker-warm-up", daemon=True).start()
+        return _pool
+
+
+def shutdown_worker_pool() -> None:
+    """Stop the worker processes. The next start_worker_pool or run_in_worker starts a new pool."""
+    global _pool, _warm_up_futures
+    with _lock:
+        pool, _pool, _warm_up_futures = _pool, None, []
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def worker_pool_status() -> dict:
+    """
+    Get the state of the worker pool.
+
+    Returns:
+        dict: {"running": bool, "workers": count, "ready": workers that answered the warm-up,
+            "seconds_since_start": age of the pool, "workers_status": [{"pid", "cad": cad_loader.import_timings() of the worker}]}
+    """
+    finished = [future for future in _warm_up_futures if future.done() and future.exception() is None]
+    return {
+        "running": _pool is not None,
+        "workers": _pool_workers if _pool is not None else 0,
+        "ready": len({future.result()["pid"] for future in finished}),
+        "seconds_since_start": time.perf_counter() - _pool_started if _pool is not None else None,
+        "workers_status": [future.result() for future in finished],
+    }
+
+
+async def run_in_worker(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) in the worker pool and wait for it without blocking the event loop.
+
+    func must be a module-level function and the arguments and the result are pickled.
+    As with the spawn start method, the worker imports the main module of the parent
+    process, so a script that calls it must guard its entry point with
+    if __name__ == "__main__". If a worker died (e.g. out of memory), the pool is replaced
+    and BrokenProcessPool is raised.
+    """
+    pool = start_worker_pool()
+    # submit は forkserver の起動を待つことがあるので、スレッドで呼ぶ
+    future = await asyncio.to_thread(pool.submit, func, *args, **kwargs)
+    try:
+        return await asyncio.wrap_future(future)
+    except BrokenProcessPool:
+        shutdown_worker_pool()
+        raise